@@ -1,9 +1,15 @@
 from PyQt5.QtWidgets import QApplication
 import sys
-from PyQt5.QtWidgets import QGridLayout, QWidget, QApplication
+from PyQt5.QtWidgets import QGridLayout, QWidget, QApplication, QFileDialog, QMessageBox, QShortcut
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtCore import QTimer
 import sys
+import os
+import time
 from frontend import sidebar, timeline, video_label
 from backend import video
+from backend.reframe import Reframer
+from backend.project_file import ProjectFileError
 
 
 """
@@ -18,6 +24,8 @@ class MainWindow(QWidget):
         super().__init__()
         self._initializeWidgets()
         self._linkWidgets()
+        # the media of the previous session is restored once the window is shown
+        QTimer.singleShot(0, self.video_player.importer.restoreSession)
 
     def _initializeWidgets(self):
         main_layout = QGridLayout()
@@ -56,6 +64,75 @@ class MainWindow(QWidget):
         self.edit_video.back_button.clicked.connect(self.video_player.thread.back)
         self.edit_video.front_button.clicked.connect(self.video_player.thread.front)
         self.edit_video.add_slot_button.clicked.connect(self.edit_video.tracks.slots_manager.addSlot)
+        self.edit_video.play_timeline_button.clicked.connect(self.playTimeline)
+        self.edit_video.split_cuts_button.clicked.connect(lambda: self.edit_video.tracks.splitAtCuts())
+        self.edit_video.export_button.clicked.connect(self.export)
+        self.edit_video.undo_button.clicked.connect(self.edit_video.tracks.undo)
+        self.edit_video.redo_button.clicked.connect(self.edit_video.tracks.redo)
+        QShortcut(QKeySequence.Undo, self, self.edit_video.tracks.undo)
+        QShortcut(QKeySequence.Redo, self, self.edit_video.tracks.redo)
+        self.edit_video.save_project_button.clicked.connect(self.saveProject)
+        self.edit_video.open_project_button.clicked.connect(self.openProject)
+
+    def saveProject(self):
+        """ Saves the timeline to a project file chosen by the user. Later edits are saved to it as they are made """
+        path, _ = QFileDialog.getSaveFileName(self, "Save Project", "project.smproj", "Projects (*.smproj)")
+        if path:
+            self.edit_video.tracks.saveProject(path)
+
+    def openProject(self):
+        """ Replaces the timeline with a project file chosen by the user """
+        path, _ = QFileDialog.getOpenFileName(self, "Open Project", "", "Projects (*.smproj)")
+        if path:
+            try:
+                self.edit_video.tracks.openProject(path)
+            except ProjectFileError as e:
+                QMessageBox.warning(self, "Open Project", str(e))
+
+    def closeEvent(self, event):
+        # the edits still queued for the project file are written before quitting
+        self.edit_video.tracks.closeProject()
+        super().closeEvent(event)
+
+    def playTimeline(self):
+        """ Loads the whole timeline in the video player, composited over every slot """
+        tracks = self.edit_video.tracks
+        self.video_player.playTimeline(tracks.exportClips(), tracks.track_fps, reframe=self.reframer())
+
+    def reframer(self):
+        """ Returns the Reframer of the output format selected in the edit section, or None to keep the sources' """
+        index = self.edit_video.format_box.currentIndex()
+        if index == 1:
+            return Reframer(Reframer.FIXED)
+        if index == 2:
+            return Reframer(Reframer.MOTION)
+        return None
+
+    def export(self):
+        """
+        Renders the timeline into the output folder in the background. Clicking Export again while
+        rendering cancels the export
+        """
+        export_thread = getattr(self.video_player, "export_thread", None)
+        if export_thread and export_thread.isRunning():
+            export_thread.cancel()
+            return
+
+        clips = self.edit_video.tracks.exportClips()
+        if not clips:
+            return
+
+        output_path = os.path.join("output", time.strftime("export_%Y%m%d_%H%M%S.mp4"))
+        # renders segments of the timeline in parallel, one process per core
+        export_thread = self.video_player.export(clips, output_path, self.edit_video.tracks.track_fps,
+                                                 workers=os.cpu_count() or 1, reframe=self.reframer())
+        export_thread.progress_signal.connect(self.exportProgress)
+        export_thread.finished_signal.connect(lambda path: self.edit_video.export_button.setText("Export"))
+        export_thread.failed_signal.connect(lambda message: self.edit_video.export_button.setText("Export"))
+
+    def exportProgress(self, done, total, fps, eta):
+        eta = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+        self.edit_video.export_button.setText(f"Exporting {100 * done // max(total, 1)}% ({fps:.0f} fps, ETA {eta})")
 
 
 def main():
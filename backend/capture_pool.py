@@ -0,0 +1,184 @@
+import os
+import threading
+from collections import OrderedDict
+from backend.lazy_import import lazy_import
+cv2 = lazy_import("cv2")
+
+class PooledCapture:
+    """
+    A cv2.VideoCapture handed out by a CapturePool, for the use of one reader at a time.
+    It has the methods of VideoCapture that the editor uses, and release() gives the capture back to the
+    pool, which keeps it open for the next reader of the source, instead of closing it
+    """
+    __slots__ = ("pool", "path", "cap", "generation")
+
+    def __init__(self, pool, path, cap, generation):
+        self.pool = pool
+        self.path = path
+        self.cap = cap
+        self.generation = generation
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def read(self):
+        return self.cap.read()
+
+    def grab(self):
+        return self.cap.grab()
+
+    def release(self):
+        """ Gives the capture back to the pool. The PooledCapture can't be used after """
+        cap, self.cap = self.cap, None
+        if cap is not None:
+            self.pool._giveBack(self.path, cap, self.generation)
+
+class CapturePool:
+    """
+    The open cv2.VideoCapture handles of the sources, shared by everything that decodes them in the
+    process: the player, the probes of the imports, the thumbnail workers, the timeline playback and
+    the export.
+    acquire() hands out a capture of a source, which the caller has to itself until it releases it.
+    Released captures stay open, with their position, for the next acquire() of the same source: it gets
+    the one positioned nearest before the time it wants to read, so it reads on without seeking (and
+    without opening the file and the decoder again).
+    At most max_open captures are kept open: past that, the least recently used idle ones are closed.
+    Captures in use are never closed, so the pool only goes over max_open while more than max_open
+    captures are in use at the same time.
+    """
+    def __init__(self, max_open=16):
+        self.max_open = max_open
+        self.lock = threading.RLock()
+        # idle captures, least recently used first: key -> (path, capture, position in frames, fps)
+        self.idle = OrderedDict()
+        self.next_key = 0
+        self.in_use = 0
+        # captures handed out before a fork belong to the parent process, and aren't taken back after it
+        self.generation = 0
+
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+    def acquire(self, path, seconds=None):
+        """
+        Returns a PooledCapture of the video in path (which isn't opened if the file can't be read).
+        seconds -> time of the source that will be read first, if known, to pick the best positioned capture
+        """
+        with self.lock:
+            best = None
+            best_distance = None
+            for key, (idle_path, _, position, fps) in self.idle.items():
+                if idle_path != path:
+                    continue
+                if seconds is None:
+                    # the most recently used one
+                    distance = (False, 0)
+                else:
+                    distance = int(seconds * fps + 1e-6) - position
+                    # a capture behind the time reads on to it, one after it has to seek back
+                    distance = (distance < 0, abs(distance))
+                if best_distance is None or distance <= best_distance:
+                    best, best_distance = key, distance
+
+            if best is not None:
+                _, cap, _, _ = self.idle.pop(best)
+                self.in_use += 1
+                self.reused += 1
+                return PooledCapture(self, path, cap, self.generation)
+            generation = self.generation
+
+        # opening a video can take a while, the other threads don't wait for it
+        cap = cv2.VideoCapture(path)
+        with self.lock:
+            if generation == self.generation:
+                self.in_use += 1
+            self.opened += 1
+            evicted = self._evict()
+        self._close(evicted)
+        return PooledCapture(self, path, cap, generation)
+
+    def _giveBack(self, path, cap, generation):
+        with self.lock:
+            if generation != self.generation:
+                # a capture of the parent process, after a fork
+                evicted = [cap]
+            else:
+                self.in_use -= 1
+                if cap.isOpened():
+                    self.idle[self.next_key] = (path, cap, int(cap.get(cv2.CAP_PROP_POS_FRAMES)),
+                                                cap.get(cv2.CAP_PROP_FPS) or 30)
+                    self.next_key += 1
+                    evicted = self._evict()
+                else:
+                    # the file couldn't be read, there is nothing to keep
+                    evicted = [cap]
+        self._close(evicted)
+
+    def _evict(self):
+        """ Removes the least recently used idle captures over the budget, and returns them to be closed """
+        evicted = []
+        while self.idle and self.in_use + len(self.idle) > self.max_open:
+            _, (_, cap, _, _) = self.idle.popitem(last=False)
+            evicted.append(cap)
+        return evicted
+
+    def _close(self, captures):
+        # captures are closed outside of the lock, since closing a decoder can take a while too
+        for cap in captures:
+            cap.release()
+        if captures:
+            with self.lock:
+                self.closed += len(captures)
+
+    def clear(self):
+        """ Closes every idle capture """
+        with self.lock:
+            evicted = [cap for _, cap, _, _ in self.idle.values()]
+            self.idle.clear()
+        self._close(evicted)
+
+    def stats(self):
+        """ Returns the number of open captures (in use and idle), and the open, reuse and close counters """
+        with self.lock:
+            return {
+                "open": self.in_use + len(self.idle),
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "max_open": self.max_open,
+                "opened": self.opened,
+                "reused": self.reused,
+                "closed": self.closed,
+            }
+
+    def _afterFork(self):
+        # the captures were opened by the parent process, which keeps using them. The child starts with none
+        # (the lock too is new, another thread of the parent may have been holding it)
+        self.lock = threading.RLock()
+        self.idle = OrderedDict()
+        self.in_use = 0
+        self.generation += 1
+
+
+# the pool shared by the whole process
+_shared_pool = None
+
+def shared_capture_pool():
+    """ Returns the process-wide CapturePool, creating it on first use """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = CapturePool()
+    return _shared_pool
+
+def _reset_after_fork():
+    if _shared_pool is not None:
+        _shared_pool._afterFork()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,247 @@
+from collections import namedtuple, deque
+
+# state of a clip on the timeline. Frames are timeline frames, source_start is the frame of the source where
+# the clip starts
+ClipState = namedtuple("ClipState", ["source_path", "slot", "start", "length", "source_start"])
+
+class TimelineClip:
+    """
+    A clip placed on the timeline. The timeline keeps one per clip, on screen or not, and only the visible
+    ones get a graphics item, so a clip is just its fields.
+    Frames are timeline frames, cuts are the scene cuts inside the clip in frames from its start (sorted),
+    snapped is the clip (or snap point) it is snapped to, at the frame snap_frame
+    """
+    __slots__ = ("clip_id", "source_path", "slot", "start", "nframes", "source_start", "cuts", "snapped",
+                 "snap_frame")
+
+    def __init__(self, clip_id, source_path, slot, start, nframes, source_start=0):
+        self.clip_id = clip_id
+        self.source_path = source_path
+        self.slot = slot
+        self.start = start
+        self.nframes = nframes
+        self.source_start = source_start
+        self.cuts = []
+        self.snapped = None
+        self.snap_frame = None
+
+    @property
+    def end(self):
+        return self.start + self.nframes
+
+    def state(self):
+        return ClipState(self.source_path, self.slot, self.start, self.nframes, self.source_start)
+
+    def snap(self, other, frame):
+        self.snapped = other
+        self.snap_frame = frame
+
+    def unsnap(self):
+        self.snapped = None
+        self.snap_frame = None
+
+class _Node:
+    """ Node of a PersistentMap. Nodes are never modified once created, so versions can share them """
+    __slots__ = ("key", "value", "left", "right", "height", "size")
+
+    def __init__(self, key, value, left, right):
+        self.key = key
+        self.value = value
+        self.left = left
+        self.right = right
+        self.height = 1 + max(left.height if left else 0, right.height if right else 0)
+        self.size = 1 + (left.size if left else 0) + (right.size if right else 0)
+
+def _height(node):
+    return node.height if node else 0
+
+def _rotate_right(node):
+    left = node.left
+    return _Node(left.key, left.value, left.left, _Node(node.key, node.value, left.right, node.right))
+
+def _rotate_left(node):
+    right = node.right
+    return _Node(right.key, right.value, _Node(node.key, node.value, node.left, right.left), right.right)
+
+def _balanced(key, value, left, right):
+    """ Returns a new node with the given children, rotated if needed to keep the AVL invariant """
+    node = _Node(key, value, left, right)
+    balance = _height(left) - _height(right)
+    if balance > 1:
+        if _height(left.left) < _height(left.right):
+            node = _Node(key, value, _rotate_left(left), right)
+        return _rotate_right(node)
+    if balance < -1:
+        if _height(right.right) < _height(right.left):
+            node = _Node(key, value, left, _rotate_right(right))
+        return _rotate_left(node)
+    return node
+
+def _insert(node, key, value):
+    if node is None:
+        return _Node(key, value, None, None)
+    if key < node.key:
+        return _balanced(node.key, node.value, _insert(node.left, key, value), node.right)
+    if key > node.key:
+        return _balanced(node.key, node.value, node.left, _insert(node.right, key, value))
+    return _Node(key, value, node.left, node.right)
+
+def _pop_min(node):
+    """ Returns the node with the smallest key, and the subtree without it """
+    if node.left is None:
+        return node, node.right
+    smallest, left = _pop_min(node.left)
+    return smallest, _balanced(node.key, node.value, left, node.right)
+
+def _delete(node, key):
+    if key < node.key:
+        return _balanced(node.key, node.value, _delete(node.left, key), node.right)
+    if key > node.key:
+        return _balanced(node.key, node.value, node.left, _delete(node.right, key))
+    if node.left is None:
+        return node.right
+    if node.right is None:
+        return node.left
+    smallest, right = _pop_min(node.right)
+    return _balanced(smallest.key, smallest.value, node.left, right)
+
+def _build(items, lo, hi):
+    if lo >= hi:
+        return None
+    mid = (lo + hi) // 2
+    key, value = items[mid]
+    return _Node(key, value, _build(items, lo, mid), _build(items, mid + 1, hi))
+
+class PersistentMap:
+    """
+    Immutable sorted map (an AVL tree). set() and remove() return a new map and leave this one unchanged,
+    copying only the O(log n) nodes on the path to the key: everything else is shared between the two
+    versions. Keeping many versions of a large map therefore costs memory proportional to the changes.
+    """
+    __slots__ = ("root",)
+
+    def __init__(self, root=None):
+        self.root = root
+
+    @classmethod
+    def from_items(cls, items):
+        """ Returns a map with the given (key, value) pairs, built in O(n) """
+        items = sorted(items, key=lambda item: item[0])
+        return cls(_build(items, 0, len(items)))
+
+    def __len__(self):
+        return self.root.size if self.root else 0
+
+    def get(self, key, default=None):
+        node = self.root
+        while node is not None:
+            if key < node.key:
+                node = node.left
+            elif key > node.key:
+                node = node.right
+            else:
+                return node.value
+        return default
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def set(self, key, value):
+        return PersistentMap(_insert(self.root, key, value))
+
+    def remove(self, key):
+        if key not in self:
+            return self
+        return PersistentMap(_delete(self.root, key))
+
+    def items(self):
+        """ Yields the (key, value) pairs in key order """
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.key, node.value
+            node = node.right
+
+_missing = object()
+
+class HistoryStep:
+    """ One undoable edit: the versions of the clips before and after it, and the ids of the clips it changed """
+    __slots__ = ("label", "before", "after", "changed")
+
+    def __init__(self, label, before, after, changed):
+        self.label = label
+        self.before = before
+        self.after = after
+        self.changed = changed
+
+class TimelineHistory:
+    """
+    Undo/redo history of the clips of a timeline.
+    The clips (clip id -> ClipState) are a PersistentMap, so each step only keeps the two versions of the map
+    around the edit, which share every node the edit didn't touch. put() and remove() change the current
+    version, commit() turns the changes since the last commit into one step (for example all the parts of a
+    split). Undoing or redoing a step is O(k log n), for the k clips it changed.
+    max_steps -> number of steps kept, the oldest ones are forgotten first
+    """
+    def __init__(self, max_steps=10000):
+        self.max_steps = max_steps
+        self.reset()
+
+    def reset(self, clips=()):
+        """ Forgets the history, and starts from the given (clip id, ClipState) pairs """
+        self.clips = PersistentMap.from_items(clips)
+        self.committed = self.clips
+        self.changed = set()
+        # the oldest steps fall off the end once there are max_steps
+        self.undo_steps = deque(maxlen=self.max_steps)
+        self.redo_steps = []
+
+    def put(self, clip_id, state):
+        if self.clips.get(clip_id) != state:
+            self.clips = self.clips.set(clip_id, state)
+            self.changed.add(clip_id)
+
+    def remove(self, clip_id):
+        if clip_id in self.clips:
+            self.clips = self.clips.remove(clip_id)
+            self.changed.add(clip_id)
+
+    def commit(self, label):
+        """ Records the changes since the last commit as one step. Returns False if nothing changed """
+        if not self.changed:
+            return False
+        self.undo_steps.append(HistoryStep(label, self.committed, self.clips, frozenset(self.changed)))
+        self.redo_steps = []
+        self.committed = self.clips
+        self.changed = set()
+        return True
+
+    def undo(self):
+        """
+        Goes back to the version before the last step. Returns {clip id: ClipState, or None if the clip
+        doesn't exist in that version} for the clips the step changed, or None if there is nothing to undo
+        """
+        # changes not committed yet are a step of their own
+        self.commit("edit")
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        return self._restore(step.before, step.changed)
+
+    def redo(self):
+        """ Applies again the last undone step. Returns the changed clips, as undo() """
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        return self._restore(step.after, step.changed)
+
+    def _restore(self, version, changed):
+        self.clips = self.committed = version
+        self.changed = set()
+        return {clip_id: version.get(clip_id) for clip_id in changed}
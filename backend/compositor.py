@@ -0,0 +1,97 @@
+from backend.lazy_import import lazy_import
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+class Compositor:
+    """
+    Blends the layers of one timeline frame into an output frame of a fixed size.
+    Each layer is scaled to fit the output (keeping its aspect ratio, centered), and blended in slot order
+    over the previous layers. The area outside a layer's rectangle is transparent, so lower slots show through.
+    Blending is vectorized NumPy integer arithmetic, on scratch buffers that are allocated once per shape:
+        out += (layer - out) * alpha
+    with alpha being the layer's opacity, times its alpha channel for BGRA layers.
+    """
+    # alpha is represented in [0, alpha_one], so (layer - out) * alpha fits in int16
+    alpha_shift = 7
+    alpha_one = 1 << alpha_shift
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # scratch buffers, by (name, shape)
+        self.scratch = {}
+
+    def _buffer(self, name, shape, dtype):
+        key = (name, shape)
+        buf = self.scratch.get(key)
+        if buf is None:
+            buf = self.scratch[key] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def placement(self, w, h):
+        """ Returns the rectangle (x, y, width, height) of a w x h layer fitted in the output """
+        scale = min(self.width / w, self.height / h)
+        new_w, new_h = max(int(w * scale), 1), max(int(h * scale), 1)
+        return (self.width - new_w) // 2, (self.height - new_h) // 2, new_w, new_h
+
+    def compose(self, layers, out=None):
+        """
+        Blends the layers into out (a (height, width, 3) uint8 array, allocated if not given) and returns it.
+        layers -> list of (slot, frame, opacity). frame is a BGR or BGRA uint8 image, opacity is in [0, 1]
+        """
+        if out is None:
+            out = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        out[:] = 0
+
+        for _, frame, opacity in sorted(layers, key=lambda layer: layer[0]):
+            if opacity <= 0:
+                continue
+            h, w, ch = frame.shape
+            x, y, new_w, new_h = self.placement(w, h)
+            roi = out[y:y + new_h, x:x + new_w]
+
+            if (w, h) != (new_w, new_h):
+                resized = self._buffer("resized", (new_h, new_w, ch), np.uint8)
+                interpolation = cv2.INTER_AREA if new_w < w else cv2.INTER_LINEAR
+                cv2.resize(frame, (new_w, new_h), dst=resized, interpolation=interpolation)
+                frame = resized
+
+            if ch == 3 and opacity >= 1:
+                # opaque layer, a plain copy
+                roi[:] = frame
+            else:
+                self._blend(roi, frame, opacity)
+        return out
+
+    def _blend(self, roi, frame, opacity):
+        shape = roi.shape
+        color = frame
+        if frame.shape[2] == 4:
+            # NumPy is much slower on the strided color channels of a BGRA frame, so they are copied out first
+            color = self._buffer("color", shape, np.uint8)
+            cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR, dst=color)
+
+        diff = self._buffer("diff", shape, np.int16)
+        np.subtract(color, roi, out=diff, dtype=np.int16)
+
+        if frame.shape[2] == 4:
+            # per pixel alpha, from [0, 255] to [0, alpha_one]: (a + (a >> 7)) >> 1
+            alpha8 = self._buffer("alpha8", shape[:2], np.uint8)
+            cv2.extractChannel(frame, 3, dst=alpha8)
+            alpha = self._buffer("alpha", shape[:2], np.int16)
+            np.right_shift(alpha8, 7, out=alpha, dtype=np.int16)
+            np.add(alpha, alpha8, out=alpha)
+            np.right_shift(alpha, 1, out=alpha)
+            if opacity < 1:
+                np.multiply(alpha, int(opacity * self.alpha_one), out=alpha)
+                np.right_shift(alpha, self.alpha_shift, out=alpha)
+            # broadcasting a single channel over the 3 color channels is slow, it is replicated instead
+            alpha3 = self._buffer("alpha3", shape, np.int16)
+            cv2.merge([alpha, alpha, alpha], dst=alpha3)
+            np.multiply(diff, alpha3, out=diff)
+        else:
+            np.multiply(diff, int(opacity * self.alpha_one), out=diff)
+
+        np.right_shift(diff, self.alpha_shift, out=diff)
+        # roi + (frame - roi) * alpha always stays in [0, 255]
+        np.add(roi, diff, out=roi, casting="unsafe")
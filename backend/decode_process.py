@@ -0,0 +1,478 @@
+"""
+Decoding in a separate process.
+
+Decoding and converting frames holds the GIL for much of each frame, and the GUI thread has to wait for it: with
+large (4K) sources, playing a video makes the timeline stutter. In this mode a DecodeProcess decodes and
+converts the frames in a child process, which writes them into the slots of a ring of shared memory
+(SharedFrameRing). Only small messages go through the pipe between the two processes:
+    GUI -> decoder   ("open", generation, spec, frame)               opens a source (see Video.spec) at a frame
+                     ("seek", generation, frame)                     decodes ahead from a frame
+                     ("read", generation, frame)                     converts that frame only, and stops
+                     ("skip", generation, frame)                     skips (without retrieving) the frames before
+                     ("target", width, height)                       size the frames are converted to
+                     ("ring", generation, name, slots, slot_bytes)   writes into another ring, and stops
+                     ("ack",)                                        the GUI is done with a frame of the ring
+                     None                                            exits
+    decoder -> GUI   ("frame", generation, frame, slot, shape, ahead, timings)
+                     ("end", generation)                             no more frames (or no such frame to read)
+Every open, seek, read and ring starts a new generation, and the frames of older generations are dropped by
+the GUI when they arrive (still acknowledged, so their slots are freed).
+
+A frame is acknowledged once the video label copied it (see VideoLabelWidget.frame_shown), or when the player
+drops it as late, not when it is taken out of the ring: a frame still queued to the GUI is never overwritten.
+The decoder keeps at most `slots - reserve` frames that weren't acknowledged, and writes the slots in turn.
+"""
+import time
+import atexit
+import threading
+from collections import deque
+# multiprocessing is only imported when the mode is turned on, keeping it out of startup
+from backend.lazy_import import lazy_import
+np = lazy_import("numpy")
+multiprocessing = lazy_import("multiprocessing")
+shared_memory = lazy_import("multiprocessing.shared_memory")
+from backend.profiler import shared_profiler
+
+# size frames are converted to while the video label has no size yet
+DEFAULT_TARGET = (1280, 720)
+
+class SharedFrameRing:
+    """
+    slots frames of at most slot_bytes bytes each, in a block of shared memory.
+    The GUI process creates the ring, and the decoder process attaches to it by name
+    """
+    def __init__(self, slots, slot_bytes, name=None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.unlinked = name is not None
+
+    def frame(self, slot, shape):
+        """ Returns the frame of the given shape in a slot, as an array over the shared memory (no copy) """
+        # frombuffer holds the buffer while the array lives, so the ring can't be unmapped under it
+        count = shape[0] * shape[1] * shape[2]
+        return np.frombuffer(self.memory.buf, np.uint8, count, slot * self.slot_bytes).reshape(shape)
+
+    def close(self):
+        """
+        Unmaps the ring, and removes it if this process created it.
+        Returns False if arrays over the ring are still alive, in which case it has to be closed again later
+        """
+        if not self.unlinked:
+            self.unlinked = True
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+        try:
+            self.memory.close()
+        except BufferError:
+            return False
+        return True
+
+# rings closed while frames over them were still alive (queued to the gui, displayed), closed again later
+_closing = []
+
+def _close_rings(rings):
+    global _closing
+    _closing = [ring for ring in _closing + rings if ring is not None and not ring.close()]
+
+def _open_source(spec):
+    # imported here, backend.video imports this module
+    if spec[0] == "video":
+        from backend.video import Video
+        return Video(spec[1])
+    from backend.timeline_source import TimelineSource
+    clips, fps, size, reframe = spec[1:]
+    # each frame is converted into the ring as soon as it is composited
+    return TimelineSource(clips, fps, size, pool_size=2, reframe=reframe)
+
+class _Decoder:
+    """ The loop of the decoder process, see the module docstring """
+    def __init__(self, conn, credits):
+        from backend.frame_converter import FrameConverter
+        self.conn = conn
+        # frames that can still be written before the GUI acknowledges some
+        self.credits = self.max_credits = credits
+        self.converter = FrameConverter(pool_size=1)
+        self.ring = None
+        self.next_slot = 0
+        self.source = None
+        self.generation = 0
+        self.streaming = False
+        # frame to read, for a "read" message
+        self.read = None
+        self.skip_until = 0
+
+    def busy(self):
+        return self.source is not None and self.ring is not None and self.credits > 0 and \
+            (self.streaming or self.read is not None)
+
+    def run(self):
+        while True:
+            # messages come first, and are waited for when there is nothing to decode
+            while not self.busy() or self.conn.poll():
+                message = self.conn.recv()
+                if message is None:
+                    return
+                self.handle(message)
+
+            if self.read is not None:
+                frame, self.read = self.read, None
+                start = time.perf_counter()
+                cv_img = self.source.read_frame(frame)
+                self.send(frame, cv_img, start)
+            else:
+                self.decode_next()
+
+    def handle(self, message):
+        kind = message[0]
+        if kind == "ack":
+            self.credits += 1
+        elif kind == "skip":
+            if message[1] == self.generation:
+                self.skip_until = max(self.skip_until, message[2])
+        elif kind == "target":
+            self.converter.set_target_size(*message[1:])
+        elif kind == "ring":
+            self.generation, name, slots, slot_bytes = message[1:]
+            if self.ring is not None:
+                self.ring.close()
+            try:
+                self.ring = SharedFrameRing(slots, slot_bytes, name)
+            except FileNotFoundError:
+                # already replaced by the GUI, the next ring is on its way
+                self.ring = None
+            self.next_slot = 0
+            self.streaming = False
+            self.read = None
+        else:
+            self.generation = message[1]
+            if kind == "open":
+                if self.source is not None and hasattr(self.source, "release"):
+                    self.source.release()
+                self.source = _open_source(message[2])
+            frame = message[-1]
+            self.skip_until = 0
+            if kind == "read":
+                self.streaming = False
+                self.read = frame
+            else:
+                self.streaming = True
+                self.read = None
+                self.source.seek(frame)
+
+    def decode_next(self):
+        frame_index = self.source.position()
+        start = time.perf_counter()
+        if frame_index < self.skip_until:
+            ret, cv_img = self.source.skip_frame(), None
+        else:
+            ret, cv_img = self.source.next_frame()
+        if not ret:
+            self.streaming = False
+            self.conn.send(("end", self.generation))
+        elif cv_img is not None:
+            self.send(frame_index, cv_img, start)
+
+    def send(self, frame_index, cv_img, start):
+        """ Converts a frame into the next slot and tells the GUI about it """
+        if cv_img is None:
+            self.conn.send(("end", self.generation))
+            return
+        decoded = time.perf_counter()
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.ring.slots
+        frame = self.converter.convert(cv_img, out=lambda shape: self.ring.frame(slot, shape))
+        self.credits -= 1
+        self.conn.send(("frame", self.generation, frame_index, slot, frame.shape, self.max_credits - self.credits,
+                        (start, decoded, time.perf_counter())))
+
+def _decode_main(conn, credits):
+    try:
+        _Decoder(conn, credits).run()
+    except (EOFError, OSError):
+        # the GUI process is gone
+        pass
+
+class DecodeProcess:
+    """
+    GUI side of the decoder process: starts it, owns the rings the frames arrive in, and sends it the messages
+    of the module docstring. One DecodeProcess serves every video played, each one through a ProcessDecodeWorker.
+    slots -> number of frames in the ring
+    reserve -> number of slots more than the frames the decoder may leave unacknowledged, a margin for frames
+               acknowledged out of order
+    """
+    def __init__(self, slots=12, reserve=4):
+        # spawned rather than forked, a fork of the GUI process would inherit the state of its threads
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.slots = slots
+        self.credits = slots - reserve
+        self.process = context.Process(target=_decode_main, args=(child_conn, self.credits), name="decode-process",
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        self.send_lock = threading.Lock()
+        # held by whoever is reading the pipe
+        self.recv_lock = threading.Lock()
+        # messages read by a worker that belong to the worker that replaced it
+        self.pending = deque()
+        # id -> frame, of the frames taken out of the ring and not released yet
+        self.taken = {}
+        self.generation = 0
+        self.ring = None
+        self.target = None
+        self.closed = False
+        # the ring is removed from the shared memory even if the player is never stopped
+        atexit.register(self.close)
+
+    def alive(self):
+        return not self.closed and self.process.is_alive()
+
+    def send(self, message):
+        with self.send_lock:
+            try:
+                self.conn.send(message)
+            except OSError:
+                # the decoder process died, the next read of the pipe finds out
+                pass
+
+    def restart(self, kind, *args):
+        """ Sends a message that starts a new generation, and returns the generation """
+        with self.send_lock:
+            self.generation += 1
+            generation = self.generation
+            try:
+                self.conn.send((kind, generation) + args)
+            except OSError:
+                pass
+            return generation
+
+    def ack(self):
+        self.send(("ack",))
+
+    def take(self, frame):
+        """ Marks a frame of the ring as in use by the GUI, its slot is freed by release() """
+        self.taken[id(frame)] = frame
+
+    def release(self, frame):
+        """ Frees the slot of a frame given by take(), once it was displayed or dropped. Other frames are ignored """
+        if self.taken.pop(id(frame), None) is not None:
+            self.ack()
+
+    def ready(self):
+        """ Returns True if a message is waiting to be read """
+        try:
+            return bool(self.pending) or self.conn.poll()
+        except OSError:
+            return True
+
+    def receive(self, timeout):
+        """ Returns the next message, or None if none came in timeout seconds. Must be called with recv_lock held """
+        if self.pending:
+            return self.pending.popleft()
+        if self.conn.poll(timeout):
+            return self.conn.recv()
+        return None
+
+    def set_target_size(self, width, height):
+        """
+        Sets the size frames are converted to. Returns True if the ring had to grow for it, which drops the frames
+        decoded so far (the caller seeks again)
+        """
+        if not width or not height:
+            width, height = DEFAULT_TARGET
+        if self.target == (width, height):
+            return False
+        self.target = (width, height)
+
+        frame_bytes = width * height * 3
+        grown = self.ring is None or frame_bytes > self.ring.slot_bytes
+        if grown:
+            _close_rings([self.ring])
+            # some room to grow, so resizing the window doesn't replace the ring every time
+            self.ring = SharedFrameRing(self.slots, frame_bytes * 5 // 4)
+            # before the new size, so no frame of that size is written into the old ring
+            self.restart("ring", self.ring.name, self.ring.slots, self.ring.slot_bytes)
+        self.send(("target", width, height))
+        return grown
+
+    def close(self):
+        """ Stops the decoder process and removes the rings """
+        if self.closed:
+            return
+        self.closed = True
+        self.send(None)
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        _close_rings([self.ring])
+        atexit.unregister(self.close)
+
+class ProcessFrameBuffer:
+    """
+    The frames of a ProcessDecodeWorker, with the interface of FrameRingBuffer that VideoThread uses
+    (pop, end_of_stream, stats). The frames wait in the slots of the ring and their messages in the pipe, so
+    nothing is buffered on this side
+    """
+    def __init__(self, process):
+        self.process = process
+        self.max_frames = process.credits
+        self.generation = None
+        self.end_of_stream = False
+        self.closed = False
+        # True while a frame is read with random access, whose frame only goes to read_frame()
+        self.reading = False
+        self.underruns = 0
+        # frames decoded ahead, and size of a frame, as of the last frame popped
+        self.ahead = 0
+        self.frame_bytes = 0
+        # index of the frame after the last one popped
+        self.position = 0
+        self.profiler = shared_profiler()
+
+    def reset(self, generation, frame, reading=False):
+        self.generation = generation
+        self.reading = reading
+        self.position = frame
+        self.end_of_stream = False
+        self.ahead = 0
+
+    def pop(self, timeout_ms=None, count_underrun=True):
+        """
+        Returns the next (frame_index, frame) pair, the frame being an array over the ring.
+        Returns None on timeout, at the end of the stream, or once the buffer was closed
+        """
+        if count_underrun and not self.reading and not self.process.ready():
+            self.underruns += 1
+        return self.take(timeout_ms, False)
+
+    def take(self, timeout_ms, reading):
+        """ pop(), for the frames decoded ahead (reading=False) or the frame being read (reading=True) """
+        process = self.process
+        if self.generation is None or self.end_of_stream or self.closed or self.reading != reading:
+            return None
+
+        deadline = None if timeout_ms is None else time.perf_counter() + timeout_ms / 1000
+        with process.recv_lock:
+            while not self.end_of_stream and not self.closed:
+                # waits in short steps, so closing the buffer is noticed
+                wait = 0.05 if deadline is None else min(max(deadline - time.perf_counter(), 0), 0.05)
+                try:
+                    message = process.receive(wait)
+                except (EOFError, OSError):
+                    # the decoder process died
+                    if not self.closed:
+                        self.end_of_stream = True
+                    return None
+
+                if message is None:
+                    if deadline is not None and time.perf_counter() >= deadline:
+                        return None
+                    continue
+
+                kind, generation = message[:2]
+                if generation != process.generation:
+                    # decoded before a seek
+                    if kind == "frame":
+                        process.ack()
+                    continue
+                if generation != self.generation or self.reading != reading:
+                    # frame of the worker that replaced this one, or frame being read
+                    process.pending.appendleft(message)
+                    return None
+                if kind == "end":
+                    self.end_of_stream = True
+                    self.reading = False
+                    return None
+
+                _, _, frame_index, slot, shape, self.ahead, (start, decoded, converted) = message
+                self.position = frame_index + 1
+                self.reading = False
+                if self.profiler.enabled:
+                    # clocks are shared between processes, so the decoder's timings go with the GUI's
+                    self.profiler.record("decode", start, decoded)
+                    self.profiler.record("convert", decoded, converted)
+                frame = process.ring.frame(slot, shape)
+                self.frame_bytes = frame.nbytes
+                # acknowledged when the frame is released, after it was displayed or dropped
+                process.take(frame)
+                return frame_index, frame
+        return None
+
+    def close(self):
+        self.closed = True
+
+    def stats(self):
+        """ Returns the fill level of the ring (as of the last frame popped) and the number of underruns so far """
+        frames = max(self.ahead - 1, 0)
+        return {
+            "frames": frames,
+            "max_frames": self.max_frames,
+            "bytes": frames * self.frame_bytes,
+            "max_bytes": self.max_frames * (self.process.ring.slot_bytes if self.process.ring else 0),
+            "underruns": self.underruns,
+        }
+
+class ProcessDecodeWorker:
+    """
+    Decodes a Video (or a TimelineSource) in a DecodeProcess, with the interface of DecodeAheadWorker that
+    VideoThread uses. Frames are converted in the decoder process, so the frames of self.buffer and of
+    read_frame() are ready to display
+    """
+    def __init__(self, process, video, target_size):
+        self.process = process
+        self.video = video
+        self.buffer = ProcessFrameBuffer(process)
+        self.opened = False
+        # False after read_frame(), until the next seek()
+        self.streaming = False
+        process.set_target_size(*target_size)
+
+    def _restart(self, kind, frame):
+        if self.opened:
+            generation = self.process.restart(kind, frame)
+        else:
+            generation = self.process.restart("open", self.video.spec(), frame)
+            if kind == "read":
+                generation = self.process.restart("read", frame)
+            self.opened = True
+        self.buffer.reset(generation, frame, reading=kind == "read")
+        self.streaming = kind == "seek"
+
+    def start(self):
+        """ Nothing to start, the decoder process decodes from the first seek() """
+
+    def seek(self, frame):
+        """ Discards the frames decoded ahead and restarts decoding at the given frame """
+        self._restart("seek", max(frame, 0))
+
+    def skip_to(self, frame):
+        """ Makes the decoder skip (without retrieving) every frame before the given one """
+        self.process.send(("skip", self.buffer.generation, frame))
+
+    def read_frame(self, frame):
+        """ Returns a single frame, converted, or None. The caller must seek() before popping frames again """
+        if frame < 0 or frame >= self.video.total_frames:
+            return None
+        self._restart("read", frame)
+        # a read decodes at most a GOP, it only takes this long if the decoder process is stuck
+        item = self.buffer.take(10000, True)
+        return item[1] if item else None
+
+    def set_target_size(self, width, height):
+        """ Frames decoded from now on are converted to the given size """
+        if self.process.set_target_size(width, height) and self.opened and self.streaming:
+            # the frames decoded for the old ring are lost, decoding restarts after the last one shown
+            self.seek(self.buffer.position)
+
+    def stop(self):
+        """ Detaches from the decoder process, which is left to the next worker """
+        self.buffer.close()
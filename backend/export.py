@@ -0,0 +1,431 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import queue
+# ProcessPoolExecutor is loaded by concurrent.futures on first use, keeping multiprocessing out of startup
+import concurrent.futures
+from backend.lazy_import import lazy_import
+cv2 = lazy_import("cv2")
+multiprocessing = lazy_import("multiprocessing")
+from backend.compositor import Compositor
+from backend.capture_pool import shared_capture_pool
+
+class ExportClip:
+    """
+    A clip placed on the timeline, as seen by the export engine.
+    source_path -> path of the source video
+    start_frame -> first timeline frame of the clip
+    nframes -> number of timeline frames of the clip
+    slot -> slot of the clip. Clips in later slots are drawn over clips in earlier slots
+    opacity -> opacity of the clip over the clips of earlier slots, in [0, 1]
+    source_start -> time (in seconds) of the source where the clip starts, for clips that don't start at the
+                    beginning of their source (for example, the parts of a clip split at its scene cuts)
+    """
+    def __init__(self, source_path, start_frame, nframes, slot=0, opacity=1.0, source_start=0.0):
+        self.source_path = source_path
+        self.start_frame = start_frame
+        self.nframes = nframes
+        self.slot = slot
+        self.opacity = opacity
+        self.source_start = source_start
+
+    @property
+    def end_frame(self):
+        return self.start_frame + self.nframes
+
+class ClipReader:
+    """
+    Reads the frames of a clip's source sequentially, resampled to the timeline fps
+    (source frames are repeated or skipped as needed).
+    The capture comes from the capture pool, which gives the reader of a clip that follows another part
+    of the same source (like the parts of a split clip) the capture where the previous reader stopped
+    reframe -> optional Reframer, the frames returned are then its crop windows (views on the decoded frames)
+    wait_reframe -> False to crop with the fixed window while the source is analyzed, instead of waiting
+                    for the analysis (see Reframer.crop)
+    """
+    def __init__(self, clip, reframe=None, wait_reframe=True):
+        self.clip = clip
+        self.reframe = reframe
+        self.wait_reframe = wait_reframe
+        self.cap = shared_capture_pool().acquire(clip.source_path, clip.source_start)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        # index of the next source frame that read() returns
+        self.next_frame = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        self.last_frame = None
+
+    def frame_at(self, seconds):
+        """ Returns the source frame displayed at the given time from the beginning of the clip """
+        target = int((seconds + self.clip.source_start) * self.fps + 1e-6)
+        # the last frame read is repeated while the target is still on it
+        behind = target < self.next_frame - 1 if self.last_frame is not None else target < self.next_frame
+        if behind or target - self.next_frame > self.fps:
+            # seeks when going backwards, or when starting in the middle of the clip (segmented export),
+            # instead of grabbing every frame in between
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            self.next_frame = target
+
+        while self.next_frame <= target:
+            if self.next_frame < target:
+                # frames that are never displayed are only grabbed
+                ret = self.cap.grab()
+            else:
+                ret, frame = self.cap.read()
+                if ret:
+                    self.last_frame = frame
+            if not ret:
+                break
+            self.next_frame += 1
+        if self.reframe is not None and self.last_frame is not None:
+            return self.reframe.crop(self.last_frame, self.clip.source_path, self.next_frame - 1, self.wait_reframe)
+        return self.last_frame
+
+    def release(self):
+        self.cap.release()
+
+class ExportCancelled(Exception):
+    pass
+
+def timeline_length(clips):
+    """ Returns the number of frames of the timeline: the end of its last clip """
+    return max((clip.end_frame for clip in clips), default=0)
+
+def timeline_size(clips, reframe=None):
+    """
+    Returns the default (width, height) of the rendered timeline: the size of the source of its first clip
+    (by start frame, then slot), once reframed by the optional Reframer
+    """
+    for clip in sorted(clips, key=lambda clip: (clip.start_frame, clip.slot)):
+        cap = shared_capture_pool().acquire(clip.source_path, clip.source_start)
+        try:
+            if cap.isOpened():
+                size = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                return reframe.output_size(*size) if reframe else size
+        finally:
+            cap.release()
+    return reframe.output_size(1920, 1080) if reframe else (1920, 1080)
+
+# marks the end of the stream in the queues of the pipeline
+_END = object()
+
+class ExportEngine:
+    """
+    Renders the clips of the timeline into a video file.
+    Frames are streamed through three stages running on separate threads, connected by bounded queues:
+        decode (source frames of the clips active at each timeline frame)
+        -> transform (layers blended in slot order by a Compositor)
+        -> encode (cv2.VideoWriter)
+    so the memory used is constant, whatever the length of the timeline.
+
+    clips -> list of ExportClip
+    output_path -> path of the rendered video
+    fps -> fps of the timeline (and of the output)
+    size -> (width, height) of the output. Defaults to the size of the first clip's source
+    queue_size -> maximum number of frames waiting between two stages
+    progress -> optional callback(frames done, total frames, render fps, eta in seconds),
+                called at most every progress_interval seconds from the encode thread
+    start, end -> optional range [start, end) of timeline frames to render. Defaults to the whole timeline
+    reframe -> optional Reframer that crops every source (for example to 9:16). The default size is then
+               the size of the first clip's source once reframed
+    """
+    def __init__(self, clips, output_path, fps=30, size=None, fourcc="mp4v", queue_size=8,
+                 progress=None, progress_interval=0.5, start=0, end=None, reframe=None):
+        self.clips = sorted(clips, key=lambda clip: (clip.start_frame, clip.slot))
+        self.output_path = output_path
+        self.fps = fps
+        self.reframe = reframe
+        self.size = size or timeline_size(self.clips, reframe)
+        self.fourcc = fourcc
+        self.queue_size = queue_size
+        self.progress = progress
+        self.progress_interval = progress_interval
+
+        self.start = start
+        self.end = timeline_length(self.clips) if end is None else end
+        self.total_frames = max(self.end - self.start, 0)
+        self.frames_done = 0
+        self.cancelled = threading.Event()
+        self.error = None
+        self.compositor = Compositor(*self.size)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _put(self, q, item):
+        # blocks while the queue is full, but gives up if the export is cancelled or failed
+        while not self.cancelled.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self.cancelled.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.cancelled.set()
+
+    def decode(self, out_queue):
+        """ Decode stage: puts (frame, [(slot, source frame, opacity), ...]) for every timeline frame """
+        readers = {}
+        next_clip = 0
+        try:
+            for frame in range(self.start, self.end):
+                for key, reader in list(readers.items()):
+                    if frame >= reader.clip.end_frame:
+                        # the clip ended, its capture goes back to the pool right away, before the readers of
+                        # the clips that start at this frame are opened (the next part of a split clip reuses it)
+                        reader.release()
+                        del readers[key]
+
+                # opens the readers of the clips that start at this frame
+                while next_clip < len(self.clips) and self.clips[next_clip].start_frame <= frame:
+                    clip = self.clips[next_clip]
+                    if clip.end_frame > frame:
+                        readers[id(clip)] = ClipReader(clip, self.reframe)
+                    next_clip += 1
+
+                layers = []
+                for reader in readers.values():
+                    clip = reader.clip
+                    source_frame = reader.frame_at((frame - clip.start_frame) / self.fps)
+                    if source_frame is not None:
+                        layers.append((clip.slot, source_frame, clip.opacity))
+
+                if not self._put(out_queue, (frame, layers)):
+                    return
+            self._put(out_queue, _END)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for reader in readers.values():
+                reader.release()
+
+    def compose(self, layers):
+        """ Blends the layers of one timeline frame, in slot order, into a new output frame """
+        # a new frame each time, as the previous ones may still be waiting in the encode queue
+        return self.compositor.compose(layers)
+
+    def transform(self, in_queue, out_queue):
+        """ Transform stage: turns the decoded layers of each frame into an output frame """
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _END:
+                    self._put(out_queue, _END)
+                    return
+                frame, layers = item
+                if not self._put(out_queue, (frame, self.compose(layers))):
+                    return
+        except Exception as e:
+            self._fail(e)
+
+    def encode(self, in_queue):
+        """ Encode stage: writes the output frames """
+        width, height = self.size
+        writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+        if not writer.isOpened():
+            self._fail(IOError(f"could not open {self.output_path} for writing"))
+            return
+
+        start = last_report = time.perf_counter()
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _END:
+                    break
+                _, output_frame = item
+                writer.write(output_frame)
+                self.frames_done += 1
+
+                now = time.perf_counter()
+                if self.progress and now - last_report >= self.progress_interval:
+                    last_report = now
+                    self.progress(*self.stats(now - start))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            writer.release()
+
+        if self.progress and self.error is None and not self.cancelled.is_set():
+            self.progress(*self.stats(time.perf_counter() - start))
+
+    def stats(self, elapsed):
+        """ Returns (frames done, total frames, render fps, eta in seconds) """
+        render_fps = self.frames_done / elapsed if elapsed > 0 else 0.0
+        remaining = self.total_frames - self.frames_done
+        eta = remaining / render_fps if render_fps > 0 else float("inf")
+        return self.frames_done, self.total_frames, render_fps, eta
+
+    def render(self):
+        """
+        Renders the timeline. Blocks until the export is done.
+        Raises ExportCancelled if cancel() was called, or the error of the stage that failed
+        """
+        if os.path.dirname(self.output_path):
+            os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+
+        decoded = queue.Queue(self.queue_size)
+        transformed = queue.Queue(self.queue_size)
+        threads = [
+            threading.Thread(target=self.decode, args=(decoded,), name="export-decode", daemon=True),
+            threading.Thread(target=self.transform, args=(decoded, transformed), name="export-transform", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        self.encode(transformed)
+        # stops the other stages if encoding stopped early
+        if self.frames_done < self.total_frames:
+            self.cancelled.set()
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+        if self.cancelled.is_set() and self.frames_done < self.total_frames:
+            raise ExportCancelled()
+        return self.output_path
+
+
+def split_segments(clips, nsegments, tolerance=0.25):
+    """
+    Splits the timeline into about nsegments [start, end) ranges of similar length, that can be rendered
+    independently. Cuts are placed at the clip boundary (start or end of a clip) nearest to each ideal cut,
+    so most segments don't start in the middle of a clip. When there is no boundary within tolerance of
+    the segment length, the cut is placed at the ideal frame, and the clips are entered by seeking
+    """
+    total = timeline_length(clips)
+    if total == 0:
+        return []
+    nsegments = max(1, min(nsegments, total))
+    length = total / nsegments
+    boundaries = sorted({frame for clip in clips for frame in (clip.start_frame, clip.end_frame) if 0 < frame < total})
+
+    cuts = [0]
+    for i in range(1, nsegments):
+        ideal = round(i * length)
+        nearest = min(boundaries, key=lambda frame: abs(frame - ideal), default=None)
+        cut = nearest if nearest is not None and abs(nearest - ideal) <= tolerance * length else ideal
+        if cut > cuts[-1]:
+            cuts.append(cut)
+    cuts.append(total)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+def _render_segment(clips, output_path, fps, size, fourcc, start, end, reframe):
+    # runs in a worker process of SegmentedExport
+    ExportEngine(clips, output_path, fps, size, fourcc, start=start, end=end, reframe=reframe).render()
+    return output_path, end - start
+
+def concatenate(parts, output_path):
+    """
+    Joins the rendered parts into output_path with ffmpeg, copying the streams without re-encoding (lossless).
+    Raises RuntimeError if ffmpeg isn't installed: re-encoding the parts would lose quality, and take as long
+    as a single-stream export
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg is needed to join the segments of the export")
+    list_path = output_path + ".parts.txt"
+    with open(list_path, "w") as f:
+        for part in parts:
+            f.write("file '%s'\n" % os.path.abspath(part).replace("'", "'\\''"))
+    try:
+        subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+                        "-c", "copy", output_path], check=True)
+    finally:
+        os.remove(list_path)
+    return output_path
+
+class SegmentedExport:
+    """
+    Renders the timeline with several processes.
+    The timeline is split into independent segments (see split_segments), each segment is rendered by an
+    ExportEngine in a worker process of a process pool, and the parts are then concatenated into the output
+    with ffmpeg (see available()).
+    Every output frame is composed exactly as in the single-stream export, only the encoder is restarted at
+    each segment (so each part starts with a keyframe). With an intra-only codec (MJPG) the output decodes
+    to the same frames as the single-stream export; with inter-frame codecs (the default mp4v) the frames
+    around the cuts are encoded differently, so they only match up to the codec's loss.
+    The workers are spawned, not forked: the GUI process has threads (Qt's, OpenCV's) whose locks a fork
+    could copy while they are held.
+
+    workers -> number of processes. Defaults to the number of cores
+    segments_per_worker -> more segments than workers balances the load when segments have different costs
+    progress -> optional callback(frames done, total frames, render fps, eta in seconds), called as
+                segments complete
+    reframe -> optional Reframer, see ExportEngine
+    """
+    def __init__(self, clips, output_path, fps=30, size=None, fourcc="mp4v", workers=None,
+                 segments_per_worker=2, progress=None, reframe=None):
+        self.clips = sorted(clips, key=lambda clip: (clip.start_frame, clip.slot))
+        self.output_path = output_path
+        self.fps = fps
+        self.reframe = reframe
+        self.fourcc = fourcc
+        self.workers = workers or os.cpu_count() or 1
+        self.segments_per_worker = segments_per_worker
+        self.progress = progress
+
+        # the size is resolved once, so that every part has the same size
+        self.size = size or timeline_size(self.clips, reframe)
+        self.total_frames = timeline_length(self.clips)
+        self.frames_done = 0
+        self.cancelled = threading.Event()
+
+    @staticmethod
+    def available():
+        """ Returns True if the parts can be joined (ffmpeg is installed). Otherwise export with ExportEngine """
+        return shutil.which("ffmpeg") is not None
+
+    def cancel(self):
+        """ Segments that didn't start are dropped. Segments being rendered finish first """
+        self.cancelled.set()
+
+    def render(self):
+        if os.path.dirname(self.output_path):
+            os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+
+        if self.reframe is not None and self.reframe.mode == self.reframe.MOTION:
+            # sources are analyzed once here, and the worker processes receive the tracks with the reframer
+            for source_path in {clip.source_path for clip in self.clips}:
+                self.reframe.track(source_path)
+
+        segments = split_segments(self.clips, self.workers * self.segments_per_worker)
+        extension = os.path.splitext(self.output_path)[1] or ".mp4"
+        parts_dir = tempfile.mkdtemp(prefix="export_parts_", dir=os.path.dirname(os.path.abspath(self.output_path)))
+        parts = [os.path.join(parts_dir, f"part_{i:05d}{extension}") for i in range(len(segments))]
+
+        start = time.perf_counter()
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                          mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = [executor.submit(_render_segment, self.clips, part, self.fps, self.size, self.fourcc, a, b,
+                                       self.reframe)
+                       for part, (a, b) in zip(parts, segments)]
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancelled.is_set():
+                    raise ExportCancelled()
+                _, nframes = future.result()
+                self.frames_done += nframes
+                if self.progress:
+                    elapsed = time.perf_counter() - start
+                    render_fps = self.frames_done / elapsed if elapsed > 0 else 0.0
+                    remaining = self.total_frames - self.frames_done
+                    eta = remaining / render_fps if render_fps > 0 else float("inf")
+                    self.progress(self.frames_done, self.total_frames, render_fps, eta)
+            executor.shutdown()
+            return concatenate(parts, self.output_path)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            shutil.rmtree(parts_dir, ignore_errors=True)
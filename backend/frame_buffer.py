@@ -0,0 +1,226 @@
+from collections import deque
+from PyQt5.QtCore import QThread, QMutex, QWaitCondition
+from backend.profiler import shared_profiler
+
+class FrameRingBuffer:
+    """
+    Bounded FIFO of decoded frames shared between a decode-ahead worker (producer) and the
+    presentation loop (consumer). The buffer is bounded both by number of frames and by bytes,
+    whichever limit is hit first.
+
+    Every clear() starts a new "generation". Frames decoded for an older generation (for example
+    a frame that was being decoded while the user seeked) are silently discarded by put().
+    """
+    def __init__(self, max_frames=8, max_bytes=256 * 1024 * 1024):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+
+        self.mutex = QMutex()
+        # signalled when a frame is added, or the stream ends
+        self.not_empty = QWaitCondition()
+        # signalled when a frame is removed, the buffer is cleared or closed
+        self.not_full = QWaitCondition()
+
+        self.frames = deque()
+        self.bytes_used = 0
+        self.generation = 0
+        self.end_of_stream = False
+        self.closed = False
+
+        # number of times the consumer asked for a frame and the buffer was empty
+        self.underruns = 0
+
+    def _is_full(self):
+        if not self.frames:
+            # always accept at least one frame, even if it alone exceeds the byte budget
+            return False
+        return len(self.frames) >= self.max_frames or self.bytes_used >= self.max_bytes
+
+    def put(self, generation, frame_index, frame):
+        """
+        Adds a decoded frame to the buffer, blocking while the buffer is full.
+        Returns False if the frame was discarded (buffer cleared or closed in the meantime)
+        """
+        self.mutex.lock()
+        try:
+            while self._is_full() and generation == self.generation and not self.closed:
+                self.not_full.wait(self.mutex)
+
+            if generation != self.generation or self.closed:
+                return False
+
+            self.frames.append((frame_index, frame))
+            self.bytes_used += frame.nbytes
+            self.not_empty.wakeAll()
+            return True
+        finally:
+            self.mutex.unlock()
+
+    def pop(self, timeout_ms=None, count_underrun=True):
+        """
+        Removes and returns the oldest (frame_index, frame) pair.
+        If the buffer is empty it counts an underrun and waits up to timeout_ms for a frame.
+        Returns None on timeout, at the end of the stream, or if the buffer was closed
+        count_underrun -> False for pops that are expected to wait, like stepping right after a seek
+        """
+        self.mutex.lock()
+        try:
+            if not self.frames and not self.end_of_stream and not self.closed:
+                if count_underrun:
+                    self.underruns += 1
+                if timeout_ms is None:
+                    while not self.frames and not self.end_of_stream and not self.closed:
+                        self.not_empty.wait(self.mutex)
+                else:
+                    self.not_empty.wait(self.mutex, int(timeout_ms))
+
+            if not self.frames:
+                return None
+
+            frame_index, frame = self.frames.popleft()
+            self.bytes_used -= frame.nbytes
+            self.not_full.wakeAll()
+            return frame_index, frame
+        finally:
+            self.mutex.unlock()
+
+    def mark_end(self, generation):
+        """ Called by the producer when there are no more frames to decode """
+        self.mutex.lock()
+        if generation == self.generation:
+            self.end_of_stream = True
+            self.not_empty.wakeAll()
+        self.mutex.unlock()
+
+    def wait_while_idle(self, generation):
+        """
+        Blocks the producer after the end of the stream was reached, until the buffer is
+        cleared (seek) or closed
+        """
+        self.mutex.lock()
+        while self.end_of_stream and generation == self.generation and not self.closed:
+            self.not_full.wait(self.mutex)
+        self.mutex.unlock()
+
+    def clear(self):
+        """ Drops every buffered frame and starts a new generation. Returns the new generation """
+        self.mutex.lock()
+        self.frames.clear()
+        self.bytes_used = 0
+        self.end_of_stream = False
+        self.generation += 1
+        generation = self.generation
+        self.not_full.wakeAll()
+        self.mutex.unlock()
+        return generation
+
+    def close(self):
+        """ Wakes up both producer and consumer, and makes every later put/pop return immediately """
+        self.mutex.lock()
+        self.closed = True
+        self.frames.clear()
+        self.bytes_used = 0
+        self.not_full.wakeAll()
+        self.not_empty.wakeAll()
+        self.mutex.unlock()
+
+    def stats(self):
+        """ Returns the fill level of the buffer and the number of underruns so far """
+        self.mutex.lock()
+        stats = {
+            "frames": len(self.frames),
+            "max_frames": self.max_frames,
+            "bytes": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "underruns": self.underruns,
+        }
+        self.mutex.unlock()
+        return stats
+
+
+class DecodeAheadWorker(QThread):
+    """
+    Worker thread that keeps decoding frames of a Video into a FrameRingBuffer, ahead of
+    the presentation loop in VideoThread, so a slow decode doesn't show up directly as stutter.
+    All accesses to the Video's capture go through self.mutex, so seeks from the GUI thread
+    are safe while the worker is decoding.
+    converter -> optional FrameConverter. When given, frames are buffered already converted for display
+    """
+    def __init__(self, video, max_frames=8, max_bytes=256 * 1024 * 1024, converter=None):
+        super().__init__()
+        self.video = video
+        self.converter = converter
+        self.buffer = FrameRingBuffer(max_frames, max_bytes)
+        self.mutex = QMutex()
+        self.stopped = False
+        # frames before this index are late, they are skipped without being retrieved or buffered
+        self.skip_until = 0
+        self.profiler = shared_profiler()
+
+    def run(self):
+        profiler = self.profiler
+        profiler.name_thread("decode-ahead")
+        while not self.stopped:
+            self.mutex.lock()
+            # the generation is read while holding the capture lock, so a seek can't happen between
+            # reading the generation and decoding the frame
+            generation = self.buffer.generation
+            frame_index = self.video.position()
+            start = profiler.begin()
+            if frame_index < self.skip_until:
+                ret, frame = self.video.skip_frame(), None
+                profiler.end("skip", start)
+            else:
+                ret, frame = self.video.next_frame()
+                profiler.end("decode", start)
+            self.mutex.unlock()
+
+            if ret:
+                if frame is not None:
+                    if self.converter:
+                        start = profiler.begin()
+                        frame = self.converter.convert(frame)
+                        profiler.end("convert", start)
+                    # the time the frame waits in the buffer is measured when it is popped
+                    profiler.stamp("buffer", id(frame))
+                    self.buffer.put(generation, frame_index, frame)
+            else:
+                # no more frames, sleep until the user seeks somewhere else
+                self.buffer.mark_end(generation)
+                self.buffer.wait_while_idle(generation)
+
+    def seek(self, frame):
+        """ Discards the buffered frames and restarts decoding at the given frame """
+        self.mutex.lock()
+        self.buffer.clear()
+        self.skip_until = 0
+        self.video.seek(frame)
+        self.mutex.unlock()
+
+    def skip_to(self, frame):
+        """ Makes the worker skip (without retrieving) every frame before the given one """
+        self.skip_until = max(self.skip_until, frame)
+
+    def read_frame(self, frame):
+        """
+        Random access to a single frame of the video (see Video.read_frame), serialized with the decoding.
+        The frame is converted like the buffered ones.
+        The buffered frames are left untouched, the caller must seek() before consuming them again
+        """
+        self.mutex.lock()
+        cv_img = self.video.read_frame(frame)
+        self.mutex.unlock()
+        if cv_img is not None and self.converter:
+            cv_img = self.converter.convert(cv_img)
+        return cv_img
+
+    def set_target_size(self, width, height):
+        """ Frames decoded from now on are converted to the given size """
+        if self.converter:
+            self.converter.set_target_size(width, height)
+
+    def stop(self):
+        """ Stops the worker and waits for it to finish """
+        self.stopped = True
+        self.buffer.close()
+        self.wait()
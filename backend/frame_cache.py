@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from PyQt5.QtCore import QMutex
+
+class FrameCache:
+    """
+    Process-wide cache of decoded frames, shared by every loaded video.
+    Frames are keyed by (video id, frame index), and the cache is bounded by the total size in bytes
+    of the stored frames. When the budget is exceeded, the least recently used frames are evicted.
+
+    Cached frames are made read-only, since the same array can be handed to several consumers.
+    """
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.mutex = QMutex()
+        # ordered from least recently used to most recently used
+        self.frames = OrderedDict()
+        self.bytes_used = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, video_id, frame_index):
+        """ Returns the cached frame, or None if it isn't cached """
+        key = (video_id, frame_index)
+        self.mutex.lock()
+        frame = self.frames.get(key)
+        if frame is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.frames.move_to_end(key)
+        self.mutex.unlock()
+        return frame
+
+    def put(self, video_id, frame_index, frame):
+        """ Stores a frame, evicting least recently used frames if the budget is exceeded """
+        if frame.nbytes > self.max_bytes:
+            return
+        frame.setflags(write=False)
+
+        key = (video_id, frame_index)
+        self.mutex.lock()
+        old = self.frames.pop(key, None)
+        if old is not None:
+            self.bytes_used -= old.nbytes
+        self.frames[key] = frame
+        self.bytes_used += frame.nbytes
+        self._evict()
+        self.mutex.unlock()
+
+    def _evict(self):
+        # must be called with the mutex locked
+        while self.bytes_used > self.max_bytes and self.frames:
+            _, frame = self.frames.popitem(last=False)
+            self.bytes_used -= frame.nbytes
+            self.evictions += 1
+
+    def set_budget(self, max_bytes):
+        """ Changes the byte budget of the cache, evicting frames if it shrank """
+        self.mutex.lock()
+        self.max_bytes = max_bytes
+        self._evict()
+        self.mutex.unlock()
+
+    def invalidate(self, video_id):
+        """ Drops every cached frame of the given video """
+        self.mutex.lock()
+        for key in [key for key in self.frames if key[0] == video_id]:
+            self.bytes_used -= self.frames.pop(key).nbytes
+        self.mutex.unlock()
+
+    def clear(self):
+        self.mutex.lock()
+        self.frames.clear()
+        self.bytes_used = 0
+        self.mutex.unlock()
+
+    def stats(self):
+        """ Returns the size of the cache and the hit, miss and eviction counters """
+        self.mutex.lock()
+        lookups = self.hits + self.misses
+        stats = {
+            "frames": len(self.frames),
+            "bytes": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+        self.mutex.unlock()
+        return stats
+
+
+# the cache shared by the whole process
+_shared_cache = None
+
+def shared_frame_cache():
+    """ Returns the process-wide FrameCache, creating it on first use """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = FrameCache()
+    return _shared_cache
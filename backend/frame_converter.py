@@ -0,0 +1,104 @@
+import weakref
+from backend.lazy_import import lazy_import
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+from PyQt5.QtCore import QMutex
+from PyQt5.QtGui import QImage
+
+class FrameConverter:
+    """
+    Converts decoded frames to what the video label displays, off the GUI thread.
+    Frames are resized (keeping the aspect ratio) to fit the label's current size, and written
+    into a pool of reused buffers, so no full-size buffer is allocated per frame.
+    A buffer only goes back to the pool when release() is called with it, after the label copied it
+    (see VideoLabelWidget.frame_shown), so a frame still queued to the gui is never overwritten.
+    Frames that are dropped before being shown are left to the garbage collector, and the pool allocates
+    a new buffer when it has no free one.
+
+    When Qt supports BGR888 images, the frames stay in OpenCV's BGR order and the label wraps them
+    directly. Otherwise the channels are swapped in the same buffer (swap_rb).
+    pool_size -> maximum number of free buffers kept for reuse
+    """
+    def __init__(self, pool_size=12):
+        self.pool_size = pool_size
+        self.mutex = QMutex()
+        self.target_width = None
+        self.target_height = None
+
+        # released buffers, ready to be written again
+        self.pool = []
+        self.pool_shape = None
+        # id -> buffer, of every buffer handed out by the pool that is still alive
+        self.owned = weakref.WeakValueDictionary()
+
+        self.swap_rb = not hasattr(QImage, "Format_BGR888")
+
+    def set_target_size(self, width, height):
+        """ Sets the size of the area the frames must fit in (the label's size) """
+        self.mutex.lock()
+        self.target_width = width
+        self.target_height = height
+        self.mutex.unlock()
+
+    def fitted_size(self, width, height):
+        """ Returns the size of a width x height frame scaled to fit the target, keeping the aspect ratio """
+        aspect_ratio = width / height
+
+        new_w = self.target_width
+        new_h = int(new_w / aspect_ratio)
+
+        if new_h > self.target_height:
+            new_h = self.target_height
+            new_w = int(new_h * aspect_ratio)
+
+        return max(new_w, 1), max(new_h, 1)
+
+    def _buffer(self, shape):
+        # must be called with the mutex locked
+        if shape != self.pool_shape:
+            # the target size changed, the old buffers are left to the frames that still use them
+            self.pool = []
+            self.pool_shape = shape
+
+        if self.pool:
+            return self.pool.pop()
+        buf = np.empty(shape, dtype=np.uint8)
+        self.owned[id(buf)] = buf
+        return buf
+
+    def release(self, buf):
+        """
+        Gives a converted frame back to the pool, once nothing reads it anymore.
+        Frames that weren't converted into one of the pool's buffers are ignored
+        """
+        self.mutex.lock()
+        if self.owned.get(id(buf)) is buf and buf.shape == self.pool_shape and len(self.pool) < self.pool_size:
+            self.pool.append(buf)
+        self.mutex.unlock()
+
+    def convert(self, cv_img, out=None):
+        """
+        Returns the frame resized to the target size, in one of the pool's buffers.
+        If no target size was set yet, the frame is returned unchanged
+        out -> optional function returning the buffer to write a frame of the given shape into, instead of
+               one of the pool's (for example a slot of shared memory)
+        """
+        self.mutex.lock()
+        try:
+            if not self.target_width or not self.target_height:
+                return cv_img
+
+            h, w, ch = cv_img.shape
+            new_w, new_h = self.fitted_size(w, h)
+            buf = self._buffer((new_h, new_w, ch)) if out is None else None
+        finally:
+            self.mutex.unlock()
+
+        if buf is None:
+            buf = out((new_h, new_w, ch))
+        # INTER_AREA is both faster and better looking than the default when shrinking
+        interpolation = cv2.INTER_AREA if new_w < w else cv2.INTER_LINEAR
+        cv2.resize(cv_img, (new_w, new_h), dst=buf, interpolation=interpolation)
+        if self.swap_rb:
+            cv2.cvtColor(buf, cv2.COLOR_BGR2RGB, dst=buf)
+        return buf
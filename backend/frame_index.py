@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+from bisect import bisect_right
+from PyQt5.QtCore import QRunnable, QThreadPool
+from backend.lazy_import import lazy_import
+cv2 = lazy_import("cv2")
+
+class FrameIndex:
+    """
+    Keyframe and timestamp index of a video file.
+    timestamps_ms -> presentation timestamp (in milliseconds) of every frame, in presentation order
+    keyframes -> sorted list with the indexes of the frames that are keyframes (always includes 0)
+
+    All lookups are binary searches, so they are O(log n) in the number of frames.
+    The index is built once by scanning the file, and saved in the user's cache folder, keyed by the path,
+    size and mtime of the video, so it is reused as long as the video doesn't change.
+    """
+    cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "ShortsMaker", "frame_index")
+    cache_version = 2
+
+    def __init__(self, timestamps_ms, keyframes):
+        self.timestamps_ms = timestamps_ms
+        self.keyframes = keyframes if keyframes and keyframes[0] == 0 else [0] + list(keyframes)
+
+    @property
+    def total_frames(self):
+        return len(self.timestamps_ms)
+
+    def keyframe_before(self, frame):
+        """ Returns the index of the last keyframe at or before the given frame """
+        i = bisect_right(self.keyframes, frame) - 1
+        return self.keyframes[max(i, 0)]
+
+    def gop_bounds(self, frame):
+        """ Returns the [start, end) frame range of the GOP that contains the given frame """
+        i = bisect_right(self.keyframes, frame) - 1
+        start = self.keyframes[max(i, 0)]
+        end = self.keyframes[i + 1] if i + 1 < len(self.keyframes) else self.total_frames
+        return start, end
+
+    def frame_at_time(self, ms):
+        """ Returns the index of the frame being displayed at the given time (in milliseconds) """
+        if not self.timestamps_ms:
+            return 0
+        i = bisect_right(self.timestamps_ms, ms) - 1
+        return min(max(i, 0), self.total_frames - 1)
+
+    @classmethod
+    def cache_path(cls, path):
+        """ Returns the path of the cached index of the video in the given path (whether it exists or not) """
+        stat = os.stat(path)
+        key = hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime}".encode()).hexdigest()
+        return os.path.join(cls.cache_dir, key + ".json")
+
+    @classmethod
+    def load_or_scan(cls, path, fallback_gop=30):
+        """
+        Loads the index of the video in the given path from the cache, or scans the video
+        (and caches the index) if it isn't cached
+        """
+        index = cls.load(path)
+        if index is None:
+            index = cls.scan(path, fallback_gop)
+            index.save(path)
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """ Loads the cached index of the video. Returns None if it is missing, or the video changed since """
+        try:
+            with open(cls.cache_path(path)) as f:
+                data = json.load(f)
+            if data.get("version") != cls.cache_version:
+                return None
+            return cls(data["timestamps_ms"], data["keyframes"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, path):
+        """ Caches the index of the video. Failing to write it is not an error, the video is scanned again next time """
+        data = {
+            "version": self.cache_version,
+            "timestamps_ms": self.timestamps_ms,
+            "keyframes": self.keyframes,
+        }
+        try:
+            cache_path = self.cache_path(path)
+            tmp_path = cache_path + ".part"
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+    @classmethod
+    def scan(cls, path, fallback_gop=30):
+        """
+        Scans the whole video once, collecting the timestamp of every frame and the keyframes.
+        When the OpenCV build supports raw (undecoded) reads, packets are only demuxed and keyframes
+        are taken from the container. Otherwise frames are grabbed normally, and keyframes are assumed
+        every fallback_gop frames
+        """
+        cap = cv2.VideoCapture(path)
+        raw = hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME") and cap.set(cv2.CAP_PROP_FORMAT, -1)
+
+        timestamps_ms = []
+        keyframes = []
+        while cap.grab():
+            if raw and cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(len(timestamps_ms))
+            timestamps_ms.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+        cap.release()
+
+        # raw packets come in decode order, which differs from presentation order when there are B-frames
+        timestamps_ms.sort()
+
+        if not raw:
+            keyframes = list(range(0, len(timestamps_ms), fallback_gop))
+
+        return cls(timestamps_ms, keyframes)
+
+
+class FrameIndexTask(QRunnable):
+    """
+    Loads or builds the FrameIndex of a Video in a worker thread, and gives it to the video when it is ready.
+    Until then the video seeks without the index (see Video.read_frame)
+    """
+    def __init__(self, video):
+        super().__init__()
+        self.video = video
+
+    def run(self):
+        try:
+            index = FrameIndex.load_or_scan(self.video.path, fallback_gop=max(int(round(self.video.fps)), 1))
+        except OSError:
+            # the video was moved or deleted, it keeps seeking without the index
+            return
+        self.video.index = index
+
+
+# the pool shared by the whole process
+_index_pool = None
+
+def shared_index_pool():
+    """ Returns the process-wide thread pool that builds the frame indexes, one video at a time """
+    global _index_pool
+    if _index_pool is None:
+        _index_pool = QThreadPool()
+        _index_pool.setMaxThreadCount(1)
+    return _index_pool
+
+
+class GopCache:
+    """
+    Holds a contiguous run of decoded frames [start, start + len(frames)) of one video, so that
+    stepping backwards through a GOP decodes it only once.
+    The run is bounded by max_frames and max_bytes. When it doesn't fit, the frames closest to the
+    requested frame are kept.
+    """
+    def __init__(self, max_frames=64, max_bytes=256 * 1024 * 1024):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.start = 0
+        self.frames = []
+
+    def get(self, frame):
+        """ Returns the cached frame, or None if it isn't cached """
+        i = frame - self.start
+        if 0 <= i < len(self.frames):
+            return self.frames[i]
+        return None
+
+    def store(self, start, frames):
+        """ Replaces the cached run with the given frames, the first of which is frame 'start' """
+        end = start + len(frames)
+        frames = frames[-self.max_frames:]
+        nbytes = 0
+        kept = 0
+        # keeps the most recent frames (the ones closest to the playhead) within the byte budget
+        for frame in reversed(frames):
+            if kept and nbytes + frame.nbytes > self.max_bytes:
+                break
+            nbytes += frame.nbytes
+            kept += 1
+        self.frames = frames[len(frames) - kept:]
+        self.start = end - kept
+
+    def clear(self):
+        self.frames = []
@@ -0,0 +1,22 @@
+import types
+import importlib
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported the first time one of its attributes is used.
+    The heavy modules (cv2, numpy) are bound with lazy_import() at the top of the modules that use them,
+    so starting the editor doesn't pay for importing them until a video is imported or played.
+
+    The import itself goes through importlib, whose per-module lock makes a first use from several threads
+    at once safe. Once imported, the attributes of the module are copied into the stand-in, so later
+    lookups are plain attribute reads.
+    """
+    def __getattr__(self, attr):
+        # only called for attributes not copied yet, so at most once per attribute after the import
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+def lazy_import(name):
+    """ Returns a stand-in for the module with the given name, imported on first use (see LazyModule) """
+    return LazyModule(name)
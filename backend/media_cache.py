@@ -0,0 +1,89 @@
+import os
+import json
+from collections import OrderedDict
+
+class MediaCache:
+    """
+    Metadata of the imported videos, kept between sessions in a JSON file.
+    Each entry holds the result of probe() for a video, with the size and mtime the video had when it
+    was probed, so an entry is only used while the file is unchanged. Entries are kept in import order,
+    and are the media restored when the editor starts, without opening any video.
+    path -> JSON file of the cache
+    max_entries -> number of videos remembered, the least recently imported ones are forgotten first
+    """
+    version = 1
+
+    def __init__(self, path=None, max_entries=500):
+        self.path = path or os.path.join(os.path.expanduser("~"), ".cache", "ShortsMaker", "media.json")
+        self.max_entries = max_entries
+        # video path -> {"file": {"size", "mtime"}, "metadata": [total_frames, fps, length_seconds]}
+        self.entries = OrderedDict()
+        self.load()
+
+    @staticmethod
+    def _file_key(video_path):
+        stat = os.stat(video_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def load(self):
+        """ Reads the cache file. A missing or unreadable file leaves the cache empty """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self.entries = OrderedDict((entry["path"], {"file": entry["file"], "metadata": entry["metadata"]})
+                                           for entry in data["media"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.entries = OrderedDict()
+
+    def save(self):
+        """ Writes the cache file. Failing to write it is not an error, the videos are probed again next time """
+        data = {
+            "version": self.version,
+            "media": [{"path": path, **entry} for path, entry in self.entries.items()],
+        }
+        tmp_path = self.path + ".part"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def get(self, video_path):
+        """ Returns the cached (total_frames, fps, length_seconds) of the video, or None if missing or stale """
+        entry = self.entries.get(video_path)
+        if entry is None:
+            return None
+        try:
+            if entry["file"] != self._file_key(video_path):
+                return None
+        except OSError:
+            return None
+        return tuple(entry["metadata"])
+
+    def put(self, video_path, metadata):
+        """ Remembers the metadata of a video that was just imported """
+        try:
+            file_key = self._file_key(video_path)
+        except OSError:
+            return
+        self.entries.pop(video_path, None)
+        self.entries[video_path] = {"file": file_key, "metadata": list(metadata)}
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def media(self):
+        """
+        Returns the (path, metadata) of the remembered videos that are unchanged on disk, in import order.
+        Entries of videos that were moved, deleted or edited are dropped
+        """
+        media = []
+        for video_path in list(self.entries):
+            metadata = self.get(video_path)
+            if metadata is None:
+                del self.entries[video_path]
+            else:
+                media.append((video_path, metadata))
+        return media
@@ -0,0 +1,117 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from backend.video_container import probe
+from backend.media_cache import MediaCache
+
+class ProbeSignals(QObject):
+    """ Signals of a ProbeTask. QRunnable isn't a QObject, so it can't declare signals itself """
+    # job id, video path, metadata (None if the video couldn't be read)
+    finished = pyqtSignal(int, str, object)
+
+class ProbeTask(QRunnable):
+    """
+    Reads the metadata of one video in a worker thread of the thread pool
+    """
+    def __init__(self, job_id, video_path, importer):
+        super().__init__()
+        self.job_id = job_id
+        self.video_path = video_path
+        self.importer = importer
+        self.signals = ProbeSignals()
+
+    def run(self):
+        if self.importer.job_id != self.job_id:
+            # the import was cancelled before this probe started
+            return
+        # videos imported in an earlier session are not opened again, unless they changed since
+        metadata = self.importer.cache.get(self.video_path) or probe(self.video_path)
+        self.signals.finished.emit(self.job_id, self.video_path, metadata)
+
+class MediaImporter(QObject):
+    """
+    Imports videos without blocking the gui.
+    The metadata of every selected video is probed in parallel in a thread pool, and each video is added
+    to the VideoContainer (on the gui thread) as soon as its probe completes.
+    Probed metadata is remembered in a MediaCache, so the videos of the previous session can be restored
+    at startup (see restoreSession) without opening them.
+    max_workers -> maximum number of videos probed at the same time
+    cache -> MediaCache of the metadata, by default the one in the user's cache folder
+    """
+    # id and length in seconds of a video that was added to the container, and its path
+    imported = pyqtSignal(int, float, str)
+    # path of a video that couldn't be read
+    failed = pyqtSignal(str)
+    # number of probed videos, and total number of videos of the current import
+    progress = pyqtSignal(int, int)
+    # emitted when every video of the import was probed, or the import was cancelled
+    finished = pyqtSignal()
+    # id and length in seconds of a video of the previous session that was added to the container, and its path
+    restored = pyqtSignal(int, float, str)
+
+    def __init__(self, video_container, max_workers=4, cache=None, parent=None):
+        super().__init__(parent)
+        self.video_container = video_container
+        self.cache = cache if cache is not None else MediaCache()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_workers)
+
+        # id of the current import. Results of older (cancelled) imports are ignored
+        self.job_id = 0
+        self.done = 0
+        self.total = 0
+
+    def importVideos(self, video_paths):
+        """ Starts importing the given videos. Any import still in progress is cancelled """
+        if self.isRunning():
+            # replaced without emitting finished, the new import goes on with the same progress display
+            self._abort()
+
+        self.job_id += 1
+        self.done = 0
+        self.total = len(video_paths)
+        self.progress.emit(self.done, self.total)
+
+        for video_path in video_paths:
+            task = ProbeTask(self.job_id, video_path, self)
+            task.signals.finished.connect(self._probeFinished)
+            self.pool.start(task)
+
+    def restoreSession(self):
+        """
+        Adds the videos remembered from the previous sessions to the container, from their cached metadata.
+        Videos that were moved or changed since are skipped
+        """
+        for video_path, metadata in self.cache.media():
+            id, length = self.video_container.addVideo(video_path, metadata)
+            self.restored.emit(id, length, video_path)
+
+    def isRunning(self):
+        return self.done < self.total
+
+    def cancel(self):
+        """ Cancels the current import. Probes that didn't start are dropped, running ones are ignored """
+        self._abort()
+        self.finished.emit()
+
+    def _abort(self):
+        self.job_id += 1
+        self.pool.clear()
+        self.total = self.done
+        self.cache.save()
+
+    def _probeFinished(self, job_id, video_path, metadata):
+        # runs on the gui thread, so the container is only ever modified from one thread
+        if job_id != self.job_id:
+            return
+
+        self.done += 1
+        if metadata is None:
+            self.failed.emit(video_path)
+        else:
+            id, length = self.video_container.addVideo(video_path, metadata)
+            self.cache.put(video_path, metadata)
+            self.imported.emit(id, length, video_path)
+
+        self.progress.emit(self.done, self.total)
+        if not self.isRunning():
+            self.cache.save()
+            self.finished.emit()
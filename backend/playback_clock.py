@@ -0,0 +1,99 @@
+import time
+from collections import deque
+
+class PlaybackClock:
+    """
+    Monotonic presentation clock.
+    Each frame is scheduled against an absolute deadline, computed from the frame that started
+    the playback (the anchor) and the exact fps of the video, so decode/conversion time is
+    never accumulated, and fractional frame rates (29.97, 59.94) don't drift.
+
+    It also keeps the statistics of the presentation: achieved fps, dropped frames and jitter
+    (distance between the moment a frame was presented and its deadline).
+    window -> number of recent frames used to compute the achieved fps and the jitter
+    """
+    def __init__(self, fps, window=120):
+        self.fps = fps
+        self.frame_duration = 1 / fps
+
+        self.anchor_time = None
+        self.anchor_frame = 0
+        self.last_presented = None
+        # set by reset(), which can be called from another thread while a frame is being presented.
+        # The anchor itself is only changed by start(), on the presentation thread
+        self.reset_requested = False
+
+        self.presented = 0
+        self.dropped = 0
+        # presentation times and lateness (seconds) of the most recent frames
+        self.present_times = deque(maxlen=window)
+        self.lateness = deque(maxlen=window)
+
+    @staticmethod
+    def now():
+        return time.perf_counter()
+
+    @property
+    def started(self):
+        return self.anchor_time is not None and not self.reset_requested
+
+    def start(self, frame):
+        """ Anchors the clock, so that the given frame is due right now """
+        self.reset_requested = False
+        self.anchor_time = self.now()
+        self.anchor_frame = frame
+        self.last_presented = frame - 1
+
+    def reset(self):
+        """ Stops the clock (pause or seek). The next presented frame anchors it again """
+        self.reset_requested = True
+
+    def deadline(self, frame):
+        """ Absolute time at which the given frame must be presented """
+        return self.anchor_time + (frame - self.anchor_frame) * self.frame_duration
+
+    def due_frame(self):
+        """ Index of the frame that should be on screen right now """
+        return self.anchor_frame + int((self.now() - self.anchor_time) * self.fps)
+
+    def is_late(self, frame):
+        """ A frame is late if its display slot is already over, i.e. the next frame is already due """
+        return self.now() >= self.deadline(frame) + self.frame_duration
+
+    def time_until(self, frame):
+        """ Seconds until the deadline of the given frame (negative if it already passed) """
+        return self.deadline(frame) - self.now()
+
+    def presented_frame(self, frame):
+        """ Records that the given frame was presented. Frames skipped since the last one count as dropped """
+        now = self.now()
+        if self.last_presented is not None and frame > self.last_presented + 1:
+            self.dropped += frame - self.last_presented - 1
+        self.last_presented = frame
+        self.presented += 1
+        self.present_times.append(now)
+        self.lateness.append(now - self.deadline(frame))
+
+    def stats(self):
+        """ Returns the achieved fps, total presented and dropped frames, and the jitter in milliseconds """
+        if len(self.present_times) > 1:
+            elapsed = self.present_times[-1] - self.present_times[0]
+            achieved_fps = (len(self.present_times) - 1) / elapsed if elapsed > 0 else 0.0
+        else:
+            achieved_fps = 0.0
+
+        if self.lateness:
+            mean = sum(self.lateness) / len(self.lateness)
+            jitter_ms = (sum((l - mean) ** 2 for l in self.lateness) / len(self.lateness)) ** 0.5 * 1000
+            mean_lateness_ms = mean * 1000
+        else:
+            jitter_ms = mean_lateness_ms = 0.0
+
+        return {
+            "target_fps": self.fps,
+            "achieved_fps": achieved_fps,
+            "presented": self.presented,
+            "dropped": self.dropped,
+            "jitter_ms": jitter_ms,
+            "mean_lateness_ms": mean_lateness_ms,
+        }
@@ -0,0 +1,160 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+
+class Histogram:
+    """
+    Log-scale histogram of durations. Bucket i counts the durations in [2^(i/4), 2^((i+1)/4)) microseconds,
+    so percentiles are accurate to about 19%, with a fixed memory, whatever the number of samples.
+    """
+    buckets_per_octave = 4
+    # up to 2^24 us (about 16 seconds), longer durations fall in the last bucket
+    nbuckets = 24 * buckets_per_octave
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.nbuckets
+        self.count = 0
+        self.total_us = 0.0
+        self.max_us = 0.0
+
+    def add(self, us):
+        i = int(math.log2(us) * self.buckets_per_octave) if us > 1 else 0
+        self.counts[min(i, self.nbuckets - 1)] += 1
+        self.count += 1
+        self.total_us += us
+        self.max_us = max(self.max_us, us)
+
+    def percentile(self, q):
+        """ Returns the upper bound (in microseconds) of the bucket holding the q-th percentile """
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(2 ** ((i + 1) / self.buckets_per_octave), self.max_us)
+        return self.max_us
+
+    def summary(self):
+        """ Returns the count, mean, p50, p95, p99 and max of the durations, in milliseconds """
+        return {
+            "count": self.count,
+            "mean_ms": self.total_us / self.count / 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50) / 1000,
+            "p95_ms": self.percentile(95) / 1000,
+            "p99_ms": self.percentile(99) / 1000,
+            "max_ms": self.max_us / 1000,
+        }
+
+class Profiler:
+    """
+    Timing probes of the playback hot paths.
+    A probe measures a stage with begin()/end(). Queue latencies (the time a frame waits between two threads)
+    are measured with stamp() when the frame is queued and since_stamp() when it is taken out.
+    Durations are aggregated in one Histogram per stage and, while enabled, also kept as trace events (the
+    most recent max_events), which export_trace() writes in the Chrome trace event format (chrome://tracing,
+    Perfetto).
+
+    Probes cost almost nothing while the profiler is disabled: begin() returns None and end() returns at once.
+    """
+    def __init__(self, enabled=False, max_events=100000):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.events = deque(maxlen=max_events)
+        # (channel, key) -> time the key was stamped on the channel
+        self.stamps = {}
+        # thread id -> name shown in the trace (QThreads are unnamed for Python)
+        self.thread_names = {}
+        self.origin = time.perf_counter()
+
+    def name_thread(self, name):
+        """ Names the calling thread in the exported traces """
+        self.thread_names[threading.get_ident()] = name
+
+    @staticmethod
+    def now():
+        return time.perf_counter()
+
+    def begin(self):
+        """ Starts measuring a stage. Returns the start time to pass to end(), or None if disabled """
+        return time.perf_counter() if self.enabled else None
+
+    def end(self, stage, start):
+        """ Records the duration of a stage started with begin() """
+        if start is not None:
+            self.record(stage, start, time.perf_counter())
+
+    def record(self, stage, start, end):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.add((end - start) * 1e6)
+            self.events.append((stage, threading.get_ident(), start, end))
+
+    def stamp(self, channel, key):
+        """ Records that the given key (for example id(frame)) entered a queue """
+        if self.enabled:
+            if len(self.stamps) > 10000:
+                # keys that never left their queue (frames dropped by a seek) are forgotten
+                self.stamps.clear()
+            self.stamps[(channel, key)] = time.perf_counter()
+
+    def since_stamp(self, stage, channel, key):
+        """ Records, as the given stage, the time since the key was stamped on the channel """
+        if not self.enabled:
+            return
+        start = self.stamps.pop((channel, key), None)
+        if start is not None:
+            self.record(stage, start, time.perf_counter())
+
+    def summary(self):
+        """ Returns the summary (see Histogram.summary) of every stage """
+        with self.lock:
+            return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.events.clear()
+            self.stamps = {}
+
+    def export_trace(self, path):
+        """ Writes the recorded trace events to path, in the Chrome trace event format (JSON) """
+        with self.lock:
+            events = list(self.events)
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        names.update(self.thread_names)
+        pid = os.getpid()
+
+        trace = []
+        for tid in {event[1] for event in events}:
+            trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                          "args": {"name": names.get(tid, f"thread {tid}")}})
+        for stage, tid, start, end in events:
+            trace.append({"name": stage, "ph": "X", "pid": pid, "tid": tid,
+                          "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+        return path
+
+# the profiler shared by the whole process
+_shared_profiler = None
+
+def shared_profiler():
+    """
+    Returns the process-wide Profiler, creating it on first use.
+    It starts enabled if the SHORTSMAKER_PROFILE environment variable is set to 1
+    """
+    global _shared_profiler
+    if _shared_profiler is None:
+        _shared_profiler = Profiler(enabled=os.environ.get("SHORTSMAKER_PROFILE") == "1")
+    return _shared_profiler
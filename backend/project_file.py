@@ -0,0 +1,304 @@
+"""
+Project files of the timeline.
+
+A project is saved as a snapshot ("<name>.smproj") and an append-only journal of the edits made since the
+snapshot ("<name>.smproj.journal"). Saving an edit only appends one short line to the journal, and every so
+often the journal is compacted: a new snapshot with every edit applied is written, and the journal restarts.
+Loading reads the snapshot and replays the journal over it.
+
+The snapshot stores the clips as columns (one array per field, see ProjectData), so reading it is a few
+bulk copies, whatever the number of clips:
+    b"SMPJ", version (uint16), header length (uint32), header (JSON: fps, slots, generation, sources,
+    number of clips), then the columns in ProjectData.columns order, as little-endian arrays
+Journal lines are JSON arrays. The first one is ["g", generation], the generation of the snapshot the journal
+applies to, so a journal left over from before a compaction (crash between the two writes) is ignored.
+    ["s", index, path]                                      adds a source
+    ["p", id, source, slot, start, length, source_start]    adds or replaces a clip
+    ["r", id]                                               removes a clip
+    ["n", slots]                                            sets the number of slots
+"""
+import os
+import sys
+import json
+import queue
+import struct
+import threading
+from array import array
+
+MAGIC = b"SMPJ"
+VERSION = 1
+JOURNAL_SUFFIX = ".journal"
+
+class ProjectFileError(Exception):
+    pass
+
+class ProjectData:
+    """
+    Clips of a timeline, stored column by column: clip ids, source indexes (in source_paths), slots, start
+    frames, lengths in frames and start frames in the source. Row i of every column is one clip.
+    fps -> fps of the timeline, which all the frames are counted in
+    slots -> number of slots of the timeline
+    generation -> number of the snapshot, incremented by each compaction
+    """
+    columns = (("ids", "q"), ("sources", "i"), ("slots", "i"), ("starts", "q"), ("lengths", "q"),
+               ("source_starts", "q"))
+
+    def __init__(self, fps=30, slots=1, source_paths=(), generation=0):
+        self.fps = fps
+        self.slot_count = slots
+        self.generation = generation
+        self.source_paths = list(source_paths)
+        self.source_ids = {path: i for i, path in enumerate(self.source_paths)}
+        for name, typecode in self.columns:
+            setattr(self, name, array(typecode))
+        # clip id -> row
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def source_id(self, path):
+        """ Returns the index of a source, adding it to the sources if needed """
+        index = self.source_ids.get(path)
+        if index is None:
+            index = self.source_ids[path] = len(self.source_paths)
+            self.source_paths.append(path)
+        return index
+
+    def put(self, clip_id, source, slot, start, length, source_start):
+        """ Adds a clip, or replaces the clip with the same id. source is an index in source_paths """
+        row = self.rows.get(clip_id)
+        values = (clip_id, source, slot, start, length, source_start)
+        if row is None:
+            self.rows[clip_id] = len(self.ids)
+            for (name, _), value in zip(self.columns, values):
+                getattr(self, name).append(value)
+        else:
+            for (name, _), value in zip(self.columns, values):
+                getattr(self, name)[row] = value
+        self.slot_count = max(self.slot_count, slot + 1)
+
+    def remove(self, clip_id):
+        """ Removes a clip, moving the last row into its place """
+        row = self.rows.pop(clip_id, None)
+        if row is None:
+            return
+        last = len(self.ids) - 1
+        for name, _ in self.columns:
+            column = getattr(self, name)
+            column[row] = column[last]
+            column.pop()
+        if row != last:
+            self.rows[self.ids[row]] = row
+
+    def clips(self):
+        """ Returns the (id, source path, slot, start, length, source_start) of every clip """
+        return [(clip_id, self.source_paths[source], slot, start, length, source_start)
+                for clip_id, source, slot, start, length, source_start
+                in zip(self.ids, self.sources, self.slots, self.starts, self.lengths, self.source_starts)]
+
+    def copy(self):
+        data = ProjectData(self.fps, self.slot_count, self.source_paths, self.generation)
+        for name, typecode in self.columns:
+            setattr(data, name, array(typecode, getattr(self, name)))
+        data.rows = dict(self.rows)
+        return data
+
+    def apply(self, record):
+        """ Applies one journal record (see the module docstring) """
+        op = record[0]
+        if op == "p":
+            self.put(*record[1:])
+        elif op == "r":
+            self.remove(record[1])
+        elif op == "s":
+            index, path = record[1:]
+            if index == len(self.source_paths):
+                self.source_id(path)
+            elif index > len(self.source_paths) or self.source_paths[index] != path:
+                raise ProjectFileError(f"source {index} out of order in the journal")
+        elif op == "n":
+            self.slot_count = record[1]
+
+    def write(self, path):
+        """ Writes the snapshot to path, through a temporary file so a crash never leaves a partial snapshot """
+        header = json.dumps({
+            "fps": self.fps,
+            "slots": self.slot_count,
+            "generation": self.generation,
+            "sources": self.source_paths,
+            "clips": len(self.ids),
+        }).encode()
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC + struct.pack("<HI", VERSION, len(header)) + header)
+            for name, _ in self.columns:
+                column = getattr(self, name)
+                if sys.byteorder == "big":
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_header(f, path):
+        start = f.read(len(MAGIC) + 6)
+        if len(start) < len(MAGIC) + 6 or start[:len(MAGIC)] != MAGIC:
+            raise ProjectFileError(f"{path} is not a project file")
+        version, header_length = struct.unpack("<HI", start[len(MAGIC):])
+        if version != VERSION:
+            raise ProjectFileError(f"{path}: unsupported project version {version}")
+        return json.loads(f.read(header_length))
+
+    @classmethod
+    def read_header(cls, path):
+        """ Returns the header (a dict) of the snapshot in path, or None if there is no valid snapshot """
+        try:
+            with open(path, "rb") as f:
+                return cls._read_header(f, path)
+        except (OSError, ValueError, ProjectFileError):
+            return None
+
+    @classmethod
+    def read(cls, path):
+        """ Reads a snapshot written by write(). Raises ProjectFileError if it isn't a valid project """
+        with open(path, "rb") as f:
+            header = cls._read_header(f, path)
+            data = cls(header["fps"], header["slots"], header["sources"], header["generation"])
+            count = header["clips"]
+            try:
+                for name, typecode in cls.columns:
+                    column = array(typecode)
+                    column.fromfile(f, count)
+                    if sys.byteorder == "big":
+                        column.byteswap()
+                    setattr(data, name, column)
+            except EOFError:
+                raise ProjectFileError(f"{path} is truncated")
+        data.rows = {clip_id: row for row, clip_id in enumerate(data.ids)}
+        return data
+
+def load_project(path):
+    """
+    Loads a project: its snapshot, with the edits of its journal replayed over it.
+    A journal line cut short by a crash (the last one) is ignored
+    """
+    try:
+        data = ProjectData.read(path)
+    except (OSError, ValueError, KeyError) as e:
+        raise ProjectFileError(f"{path}: {e}")
+
+    try:
+        with open(path + JOURNAL_SUFFIX) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return data
+    for i, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            if i == len(lines) - 1:
+                break
+            raise ProjectFileError(f"{path}: corrupt journal line {i + 1}")
+        if i == 0:
+            if record != ["g", data.generation]:
+                # journal of an older snapshot, its edits are already in the snapshot
+                break
+        else:
+            data.apply(record)
+    return data
+
+class ProjectAutosave:
+    """
+    Saves the edits of a timeline to its project as they are made, without blocking the caller.
+    put(), remove() and setSlots() update the in-memory ProjectData and queue one journal line. A writer thread
+    appends the queued lines to the journal, and compacts the project (writes a new snapshot from a copy of
+    the data, and restarts the journal) every compact_every edits. Creating the autosave writes a snapshot.
+    path -> path of the project
+    data -> ProjectData of the timeline as it is now
+    """
+    def __init__(self, path, data, compact_every=2000):
+        self.path = path
+        self.data = data
+        # generations only grow, so a journal left by an earlier save of this path is never replayed on this one
+        header = ProjectData.read_header(path)
+        if header is not None:
+            data.generation = max(data.generation, header.get("generation", 0))
+        self.compact_every = compact_every
+        self.edits = 0
+        self.error = None
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="project-autosave", daemon=True)
+        self.thread.start()
+        self.compact()
+
+    def put(self, clip_id, source_path, slot, start, length, source_start):
+        """ Saves a clip that was added or changed """
+        data = self.data
+        if source_path not in data.source_ids:
+            self._queue(["s", data.source_id(source_path), source_path])
+        source = data.source_ids[source_path]
+        data.put(clip_id, source, slot, start, length, source_start)
+        self._queue(["p", clip_id, source, slot, start, length, source_start])
+
+    def remove(self, clip_id):
+        """ Saves the removal of a clip """
+        if clip_id in self.data.rows:
+            self.data.remove(clip_id)
+            self._queue(["r", clip_id])
+
+    def setSlots(self, slots):
+        self.data.slot_count = slots
+        self._queue(["n", slots])
+
+    def compact(self):
+        """ Queues the writing of a snapshot with every edit so far, after which the journal restarts """
+        self.data.generation += 1
+        self.edits = 0
+        self.queue.put(("compact", self.data.copy()))
+
+    def close(self):
+        """ Writes the pending edits and stops the writer thread """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _queue(self, record):
+        self.queue.put(("line", json.dumps(record, separators=(",", ":")) + "\n"))
+        self.edits += 1
+        if self.edits >= self.compact_every:
+            self.compact()
+
+    def _run(self):
+        journal = None
+        try:
+            while True:
+                item = self.queue.get()
+                # writes everything queued so far before flushing, so a burst of edits is one write
+                items = [item]
+                while item is not None:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    items.append(item)
+
+                for item in items:
+                    if item is None:
+                        return
+                    kind, value = item
+                    if kind == "compact":
+                        if journal is not None:
+                            journal.close()
+                        value.write(self.path)
+                        journal = open(self.path + JOURNAL_SUFFIX, "w")
+                        journal.write(json.dumps(["g", value.generation]) + "\n")
+                    else:
+                        journal.write(value)
+                journal.flush()
+        except OSError as e:
+            # the timeline keeps working, only saving stops
+            self.error = e
+        finally:
+            if journal is not None:
+                journal.close()
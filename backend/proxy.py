@@ -0,0 +1,173 @@
+import os
+import hashlib
+from backend.lazy_import import lazy_import
+cv2 = lazy_import("cv2")
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QMutex, pyqtSignal
+
+class ProxyState:
+    """ States of the proxy of a source video """
+    NONE = "none"
+    QUEUED = "queued"
+    GENERATING = "generating"
+    READY = "ready"
+    FAILED = "failed"
+
+class ProxySignals(QObject):
+    """ Signals of a ProxyTask """
+    # source path, new state, progress (0 to 100)
+    state_changed = pyqtSignal(str, str, int)
+
+class ProxyTask(QRunnable):
+    """
+    Transcodes a source video into its proxy in a worker thread of the thread pool.
+    The proxy is written to a temporary file and renamed when complete, so a partial proxy is never used
+    """
+    def __init__(self, manager, source_path):
+        super().__init__()
+        self.manager = manager
+        self.source_path = source_path
+        self.signals = ProxySignals()
+
+    def run(self):
+        if self.manager.cancelled(self.source_path):
+            return
+
+        proxy_path = self.manager.proxyPathFor(self.source_path)
+        tmp_path = proxy_path + ".part" + os.path.splitext(proxy_path)[1]
+        self.signals.state_changed.emit(self.source_path, ProxyState.GENERATING, 0)
+
+        cap = cv2.VideoCapture(self.source_path)
+        writer = None
+        ok = False
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            if not cap.isOpened() or fps <= 0 or height <= 0:
+                return
+
+            # proxies are never larger than the source
+            proxy_height = min(self.manager.height, height)
+            proxy_width = max(int(round(width * proxy_height / height / 2)) * 2, 2)
+            writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*self.manager.fourcc), fps, (proxy_width, proxy_height))
+            if not writer.isOpened():
+                return
+
+            done = 0
+            last_progress = -1
+            while True:
+                if self.manager.cancelled(self.source_path):
+                    return
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                writer.write(cv2.resize(frame, (proxy_width, proxy_height), interpolation=cv2.INTER_AREA))
+                done += 1
+                progress = 100 * done // max(total_frames, 1)
+                if progress != last_progress:
+                    last_progress = progress
+                    self.signals.state_changed.emit(self.source_path, ProxyState.GENERATING, min(progress, 100))
+            ok = done > 0
+        finally:
+            cap.release()
+            if writer is not None:
+                writer.release()
+            if ok:
+                os.replace(tmp_path, proxy_path)
+                self.signals.state_changed.emit(self.source_path, ProxyState.READY, 100)
+            else:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if not self.manager.cancelled(self.source_path):
+                    self.signals.state_changed.emit(self.source_path, ProxyState.FAILED, 0)
+
+class ProxyManager(QObject):
+    """
+    Generates and looks up low-resolution proxies of the imported videos.
+    Proxies are intra-only (MJPG) so every frame is a keyframe, which makes seeking and stepping cheap,
+    and they are small enough to decode in real time. They are stored in cache_dir, keyed by the path,
+    size and mtime of the source, so they survive restarts and are regenerated if the source changes.
+
+    Only playback uses proxies, export always reads the original sources.
+    height -> height of the proxies in pixels
+    enabled -> when False, no proxy is generated nor used
+    """
+    # source path, state (see ProxyState), progress (0 to 100)
+    proxyStateChanged = pyqtSignal(str, str, int)
+
+    def __init__(self, cache_dir=None, height=360, fourcc="MJPG", max_workers=1, enabled=True, parent=None):
+        super().__init__(parent)
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "ShortsMaker", "proxies")
+        self.height = height
+        self.fourcc = fourcc
+        self.enabled = enabled
+
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_workers)
+        self.mutex = QMutex()
+        self.states = {}
+        self.cancelled_sources = set()
+
+    def proxyPathFor(self, source_path):
+        """ Returns the path of the proxy of the given source (whether it exists or not) """
+        stat = os.stat(source_path)
+        key = hashlib.sha1(f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime}|{self.height}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + ".avi")
+
+    def proxyPath(self, source_path):
+        """ Returns the path of the proxy of the given source if it is ready, None otherwise """
+        if not self.enabled:
+            return None
+        try:
+            proxy_path = self.proxyPathFor(source_path)
+        except OSError:
+            return None
+        return proxy_path if os.path.exists(proxy_path) else None
+
+    def playbackPath(self, source_path):
+        """ Returns the path that should be played for the given source: its proxy if ready, else the source """
+        return self.proxyPath(source_path) or source_path
+
+    def state(self, source_path):
+        if self.proxyPath(source_path):
+            return ProxyState.READY
+        return self.states.get(source_path, ProxyState.NONE)
+
+    def generate(self, source_path):
+        """ Queues the generation of the proxy of the given source, unless it exists or is queued """
+        if not self.enabled:
+            return
+        if self.proxyPath(source_path):
+            # generated in a previous session
+            self._stateChanged(source_path, ProxyState.READY, 100)
+            return
+        if self.states.get(source_path) in (ProxyState.QUEUED, ProxyState.GENERATING):
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.mutex.lock()
+        self.cancelled_sources.discard(source_path)
+        self.mutex.unlock()
+
+        task = ProxyTask(self, source_path)
+        task.signals.state_changed.connect(self._stateChanged)
+        self._stateChanged(source_path, ProxyState.QUEUED, 0)
+        self.pool.start(task)
+
+    def cancel(self, source_path):
+        """ Stops generating the proxy of the given source """
+        self.mutex.lock()
+        self.cancelled_sources.add(source_path)
+        self.mutex.unlock()
+        self._stateChanged(source_path, ProxyState.NONE, 0)
+
+    def cancelled(self, source_path):
+        self.mutex.lock()
+        cancelled = source_path in self.cancelled_sources
+        self.mutex.unlock()
+        return cancelled
+
+    def _stateChanged(self, source_path, state, progress):
+        self.states[source_path] = state
+        self.proxyStateChanged.emit(source_path, state, progress)
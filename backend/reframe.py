@@ -0,0 +1,296 @@
+import os
+import json
+import hashlib
+import logging
+from PyQt5.QtCore import QRunnable, QThreadPool, QMutex
+from backend.lazy_import import lazy_import
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+logger = logging.getLogger(__name__)
+
+class CropTrack:
+    """
+    Horizontal position of the crop window over every frame of a source video.
+    centers -> center of the window in each frame, as a fraction of the source width (so that a track computed
+               on a proxy also applies to its original)
+
+    Motion tracks are saved in the user's cache folder, keyed by the path, size and mtime of the video, and are
+    reused as long as the video and the analysis parameters don't change.
+    """
+    cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "ShortsMaker", "reframe")
+    cache_version = 2
+
+    def __init__(self, centers):
+        self.centers = np.asarray(centers, dtype=np.float32)
+
+    def center(self, frame):
+        if len(self.centers) == 0:
+            return 0.5
+        return float(self.centers[min(max(frame, 0), len(self.centers) - 1)])
+
+    @classmethod
+    def cache_path(cls, path):
+        """ Returns the path of the cached track of the video in the given path (whether it exists or not) """
+        stat = os.stat(path)
+        key = hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime}".encode()).hexdigest()
+        return os.path.join(cls.cache_dir, key + ".json")
+
+    @classmethod
+    def load(cls, path, params):
+        """ Loads the cached track of the video. Returns None if it is missing or stale """
+        try:
+            with open(cls.cache_path(path)) as f:
+                data = json.load(f)
+            if data.get("version") != cls.cache_version or data.get("params") != params:
+                return None
+            return cls(data["centers"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, path, params):
+        """ Caches the track of the video. Failing to write it is not an error, the video is analyzed again next time """
+        data = {
+            "version": self.cache_version,
+            "params": params,
+            "centers": [round(float(center), 5) for center in self.centers],
+        }
+        try:
+            cache_path = self.cache_path(path)
+            tmp_path = cache_path + ".part"
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+class CropTrackTask(QRunnable):
+    """ Analyzes a source (or loads its cached CropTrack) for a Reframer, in a worker thread of its thread pool """
+    def __init__(self, reframer, source_path):
+        super().__init__()
+        self.reframer = reframer
+        self.source_path = source_path
+
+    def run(self):
+        try:
+            self.reframer.track(self.source_path)
+        except (OSError, cv2.error) as e:
+            # the source keeps the fixed window for the rest of the session
+            logger.warning("motion analysis failed for %s: %s", self.source_path, e)
+            self.reframer.done(self.source_path, CropTrack([]))
+
+class Reframer:
+    """
+    Converts frames to a vertical aspect ratio (9:16 by default) by cropping a full-height window of the source.
+    Cropping is a view on the decoded frame, so the rest of the pipeline (compositing, scaling, encoding) only
+    processes the window, a fraction of the full frame.
+
+    mode -> FIXED: the window stays at a fixed horizontal position (position: 0 left, 0.5 center, 1 right)
+            MOTION: the window follows the motion of the source. Each source is analyzed once (and the result
+            saved, see CropTrack), on downsampled grayscale frames sampled at analysis_fps. The frames are
+            processed in blocks of block_size: the motion energy of every column, and the window with the most
+            energy, are computed for the whole block at once with NumPy. The positions are then smoothed over
+            smoothing_seconds, so the virtual camera pans instead of jumping.
+            Playback doesn't wait for the analysis (see crop), it runs in the background, one source at a time
+    aspect -> (width, height) aspect ratio of the output
+    """
+    FIXED = "fixed"
+    MOTION = "motion"
+
+    def __init__(self, mode=FIXED, aspect=(9, 16), position=0.5, analysis_width=160, analysis_fps=10,
+                 block_size=64, smoothing_seconds=1.5):
+        self.mode = mode
+        self.aspect = aspect
+        self.position = position
+        self.analysis_width = analysis_width
+        self.analysis_fps = analysis_fps
+        self.block_size = block_size
+        self.smoothing_seconds = smoothing_seconds
+        # source path -> CropTrack
+        self.tracks = {}
+        self.mutex = QMutex()
+        # sources being analyzed in the background, and the pool that analyzes them (created on first use)
+        self.pending = set()
+        self.pool = None
+
+    def __getstate__(self):
+        # the reframer is sent to the export workers and the decoder process with its tracks,
+        # but without the background analysis
+        state = self.__dict__.copy()
+        del state["mutex"], state["pending"], state["pool"]
+        self.mutex.lock()
+        state["tracks"] = dict(self.tracks)
+        self.mutex.unlock()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.mutex = QMutex()
+        self.pending = set()
+        self.pool = None
+
+    def crop_width(self, width, height):
+        """ Returns the width of the crop window in a width x height frame (even, and at most the width) """
+        crop_width = int(height * self.aspect[0] / self.aspect[1]) // 2 * 2
+        return min(max(crop_width, 2), width)
+
+    def output_size(self, width, height):
+        """ Returns the size of the reframed frames of a width x height source """
+        return self.crop_width(width, height), height
+
+    def _params(self):
+        return {
+            "aspect": list(self.aspect),
+            "analysis_width": self.analysis_width,
+            "analysis_fps": self.analysis_fps,
+            "smoothing_seconds": self.smoothing_seconds,
+        }
+
+    def track(self, source_path, wait=True):
+        """
+        Returns the CropTrack of the given source, analyzing it (or loading it from the cache) on first use
+        wait -> False to analyze the source in the background instead, returning None until the track is ready
+        """
+        self.mutex.lock()
+        track = self.tracks.get(source_path)
+        self.mutex.unlock()
+        if track is not None:
+            return track
+        if not wait:
+            self._request(source_path)
+            return None
+
+        params = self._params()
+        track = CropTrack.load(source_path, params)
+        if track is None:
+            track = self.analyze(source_path)
+            track.save(source_path, params)
+        self.done(source_path, track)
+        return track
+
+    def _request(self, source_path):
+        """ Queues the analysis of the given source, unless it is already queued """
+        self.mutex.lock()
+        requested = source_path in self.pending
+        if not requested:
+            self.pending.add(source_path)
+            if self.pool is None:
+                self.pool = QThreadPool()
+                self.pool.setMaxThreadCount(1)
+        self.mutex.unlock()
+        if not requested:
+            self.pool.start(CropTrackTask(self, source_path))
+
+    def done(self, source_path, track):
+        self.mutex.lock()
+        self.tracks[source_path] = track
+        self.pending.discard(source_path)
+        self.mutex.unlock()
+
+    def crop(self, frame, source_path, index, wait=True):
+        """
+        Returns the window of the given source frame (index is its frame number in the source), as a view
+        wait -> False to use the fixed window at position while the motion of the source is being analyzed
+        """
+        height, width = frame.shape[:2]
+        crop_width = self.crop_width(width, height)
+        if crop_width >= width:
+            return frame
+
+        track = self.track(source_path, wait) if self.mode == self.MOTION else None
+        center = self.position if track is None else track.center(index)
+        x = int(round(center * width - crop_width / 2))
+        x = min(max(x, 0), width - crop_width)
+        return frame[:, x:x + crop_width]
+
+    def analyze(self, source_path):
+        """ Computes the motion-following CropTrack of the given source """
+        cap = cv2.VideoCapture(source_path)
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            if not cap.isOpened() or width <= 0 or height <= 0:
+                return CropTrack([])
+
+            stride = max(int(round(fps / self.analysis_fps)), 1)
+            analysis_width = min(self.analysis_width, width)
+            analysis_height = max(int(height * analysis_width / width), 1)
+            window = max(int(round(self.crop_width(width, height) * analysis_width / width)), 1)
+
+            # the last sample of the previous block is kept as the first row, so motion is continuous
+            block = np.empty((self.block_size + 1, analysis_height, analysis_width), dtype=np.uint8)
+            filled = 0
+            sample_frames = []
+            centers = []
+            total_frames = 0
+            gray = np.empty((height, width), dtype=np.uint8)
+
+            while True:
+                if total_frames % stride:
+                    # frames between samples are only grabbed
+                    if not cap.grab():
+                        break
+                    total_frames += 1
+                    continue
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+                cv2.resize(gray, (analysis_width, analysis_height), dst=block[filled], interpolation=cv2.INTER_AREA)
+                sample_frames.append(total_frames)
+                filled += 1
+                total_frames += 1
+                if filled == len(block):
+                    centers.append(self._block_centers(block, window))
+                    block[0] = block[-1]
+                    filled = 1
+            if filled > 1:
+                centers.append(self._block_centers(block[:filled], window))
+        finally:
+            cap.release()
+
+        if not sample_frames:
+            return CropTrack([])
+        # the first sample has no motion, it takes the position of the second one
+        centers = np.concatenate([np.full(1, np.nan, dtype=np.float32)] + centers) / analysis_width
+        return CropTrack(self._smooth(np.asarray(sample_frames), centers, total_frames, fps / stride))
+
+    @staticmethod
+    def _block_centers(block, window):
+        """
+        Returns the center (in analysis pixels) of the window with the most motion, for every sample of the
+        block after the first. Samples with no motion at all are NaN, so they keep the surrounding positions
+        """
+        motion = np.abs(np.diff(block.astype(np.int16), axis=0))
+        # motion energy of every column of every sample: (samples, width)
+        energy = motion.sum(axis=1, dtype=np.int64)
+        # sum of the energy under every possible window position, with a cumulative sum over the columns
+        cumulative = np.pad(np.cumsum(energy, axis=1), ((0, 0), (1, 0)))
+        windows = cumulative[:, window:] - cumulative[:, :-window]
+        # several positions usually hold all the motion (the window is wider than the moving subject),
+        # the one in the middle of them is taken, which centers the subject
+        best = windows >= windows.max(axis=1, keepdims=True) * 0.98
+        first = np.argmax(best, axis=1)
+        last = best.shape[1] - 1 - np.argmax(best[:, ::-1], axis=1)
+        centers = ((first + last) / 2 + window / 2).astype(np.float32)
+        centers[energy.sum(axis=1) == 0] = np.nan
+        return centers
+
+    def _smooth(self, sample_frames, centers, total_frames, sample_fps):
+        """ Fills the gaps, smooths the sampled centers, and interpolates them to every source frame """
+        valid = ~np.isnan(centers)
+        if not valid.any():
+            return np.full(total_frames, 0.5, dtype=np.float32)
+        samples = np.arange(len(centers))
+        centers = np.interp(samples, samples[valid], centers[valid])
+
+        # two passes of a moving average (a triangular filter), with the edges padded
+        radius = max(int(self.smoothing_seconds * sample_fps / 2), 0)
+        if radius:
+            kernel = np.ones(2 * radius + 1) / (2 * radius + 1)
+            for _ in range(2):
+                centers = np.convolve(np.pad(centers, radius, mode="edge"), kernel, mode="valid")
+
+        return np.interp(np.arange(total_frames), sample_frames, centers).astype(np.float32)
@@ -0,0 +1,81 @@
+import logging
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QMutex, pyqtSignal
+from backend.lazy_import import lazy_import
+cv2 = lazy_import("cv2")
+from backend.scene_detect import SceneDetector
+
+logger = logging.getLogger(__name__)
+
+class SceneCutSignals(QObject):
+    """ Signals of a SceneCutTask """
+    # path of the source whose cuts were detected
+    ready = pyqtSignal(str)
+
+class SceneCutTask(QRunnable):
+    """ Detects the cuts of a source video (or loads them from its sidecar) in a worker thread of the thread pool """
+    def __init__(self, manager, source_path):
+        super().__init__()
+        self.manager = manager
+        self.source_path = source_path
+        self.signals = SceneCutSignals()
+
+    def run(self):
+        try:
+            cuts = self.manager.detector.cuts(self.source_path)
+        except (OSError, cv2.error) as e:
+            # the source may be readable again later (a network drive, a file being copied)
+            logger.warning("scene cut detection failed for %s: %s", self.source_path, e)
+            self.manager.failed(self.source_path)
+            return
+        self.manager.done(self.source_path, cuts)
+        self.signals.ready.emit(self.source_path)
+
+class SceneCutManager(QObject):
+    """
+    Detects the scene cuts of the sources of the timeline in the background, one source at a time
+    (the detection of each source already uses several processes, see SceneDetector).
+    detector -> SceneDetector used for every source
+    """
+    # path of a source whose cuts are available
+    cutsReady = pyqtSignal(str)
+
+    def __init__(self, detector=None, parent=None):
+        super().__init__(parent)
+        self.detector = detector or SceneDetector()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.mutex = QMutex()
+        # source path -> SceneCuts, or None while the detection is pending
+        self.results = {}
+
+    def cuts(self, source_path):
+        """ Returns the SceneCuts of the given source if they were detected, None otherwise """
+        self.mutex.lock()
+        cuts = self.results.get(source_path)
+        self.mutex.unlock()
+        return cuts
+
+    def request(self, source_path):
+        """ Queues the detection of the cuts of the given source, unless it was already requested """
+        self.mutex.lock()
+        requested = source_path in self.results
+        if not requested:
+            self.results[source_path] = None
+        self.mutex.unlock()
+        if requested:
+            return
+
+        task = SceneCutTask(self, source_path)
+        task.signals.ready.connect(self.cutsReady)
+        self.pool.start(task)
+
+    def done(self, source_path, cuts):
+        self.mutex.lock()
+        self.results[source_path] = cuts
+        self.mutex.unlock()
+
+    def failed(self, source_path):
+        """ Forgets a failed detection, so the next request() of the source tries again """
+        self.mutex.lock()
+        self.results.pop(source_path, None)
+        self.mutex.unlock()
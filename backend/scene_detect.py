@@ -0,0 +1,194 @@
+import os
+import json
+# ProcessPoolExecutor is loaded by concurrent.futures on first use, keeping multiprocessing out of startup
+import concurrent.futures
+from backend.lazy_import import lazy_import
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+multiprocessing = lazy_import("multiprocessing")
+
+class SceneCuts:
+    """
+    Scene cuts of a video file: the source frames where a new shot starts (frame 0 is never a cut).
+    fps -> fps of the source, to convert the cuts to timeline frames
+
+    Cuts are saved to a sidecar file next to the video ("<video path>.cuts.json"), which is reused as long
+    as the size and mtime of the video and the detection parameters don't change.
+    """
+    sidecar_suffix = ".cuts.json"
+    sidecar_version = 1
+
+    def __init__(self, frames, fps):
+        self.frames = frames
+        self.fps = fps
+
+    def seconds(self):
+        return [frame / self.fps for frame in self.frames]
+
+    @staticmethod
+    def _file_key(path):
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    @classmethod
+    def load(cls, path, params):
+        """ Loads the cuts from the sidecar file. Returns None if it is missing or stale """
+        try:
+            with open(path + cls.sidecar_suffix) as f:
+                data = json.load(f)
+            if data.get("version") != cls.sidecar_version or data.get("file") != cls._file_key(path) \
+                    or data.get("params") != params:
+                return None
+            return cls(data["frames"], data["fps"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, path, params):
+        """ Writes the cuts to the sidecar file. Failing to write it (read-only media) is not an error """
+        data = {
+            "version": self.sidecar_version,
+            "file": self._file_key(path),
+            "params": params,
+            "fps": self.fps,
+            "frames": self.frames,
+        }
+        try:
+            with open(path + self.sidecar_suffix, "w") as f:
+                json.dump(data, f)
+        except OSError:
+            pass
+
+class SceneDetector:
+    """
+    Detects the hard cuts of a video.
+    Frames are downscaled to analysis_width and converted to HSV, and each frame gets a joint histogram of
+    hue, saturation and value (hue_bins x sat_bins x value_bins). A frame starts a new scene when the
+    distance between its histogram and the previous one (half the L1 distance of the normalized histograms,
+    from 0 for identical to 1 for disjoint) is at least threshold, and the previous cut is at least
+    min_scene_frames before it.
+
+    Frames are processed in blocks of block_size: the histograms of a whole block are computed with a single
+    np.bincount, and the distances with array operations. The video is split in chunks that are scored in
+    parallel by worker processes, each one seeking to its chunk. The workers are spawned, not forked, since the
+    detection runs in a thread of the GUI process, whose other threads' locks a fork could copy while held.
+    workers -> number of processes. Defaults to the number of cores
+    """
+    def __init__(self, threshold=0.4, min_scene_frames=8, analysis_width=96, hue_bins=16, sat_bins=4,
+                 value_bins=4, block_size=128, workers=None, min_chunk_frames=600):
+        self.threshold = threshold
+        self.min_scene_frames = min_scene_frames
+        self.analysis_width = analysis_width
+        self.bins = (hue_bins, sat_bins, value_bins)
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self.min_chunk_frames = min_chunk_frames
+
+    def params(self):
+        return {
+            "threshold": self.threshold,
+            "min_scene_frames": self.min_scene_frames,
+            "analysis_width": self.analysis_width,
+            "bins": list(self.bins),
+        }
+
+    def cuts(self, path):
+        """ Returns the SceneCuts of the video in the given path, from its sidecar or by detecting them """
+        params = self.params()
+        cuts = SceneCuts.load(path, params)
+        if cuts is None:
+            cuts = self.detect(path)
+            cuts.save(path, params)
+        return cuts
+
+    def detect(self, path):
+        """ Detects the cuts of the video in the given path """
+        cap = cv2.VideoCapture(path)
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        finally:
+            cap.release()
+        if total_frames <= 1:
+            return SceneCuts([], fps)
+
+        nchunks = max(min(self.workers, total_frames // self.min_chunk_frames), 1)
+        bounds = np.linspace(0, total_frames, nchunks + 1).astype(int)
+        chunks = list(zip(bounds[:-1], bounds[1:]))
+        if nchunks == 1:
+            scores = [self.scores(path, 0, total_frames)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=nchunks,
+                                                        mp_context=multiprocessing.get_context("spawn")) as executor:
+                scores = list(executor.map(self.scores, [path] * nchunks, *zip(*chunks)))
+        return SceneCuts(self.pick_cuts(np.concatenate(scores)), fps)
+
+    def scores(self, path, start, end):
+        """
+        Returns the histogram distance between every frame of [start, end) and the frame before it
+        (0 for frame 0). Runs in a worker process
+        """
+        cap = cv2.VideoCapture(path)
+        scores = []
+        try:
+            # the frame before the chunk is read too, to score the first frame of the chunk
+            first = max(start - 1, 0)
+            if first:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+            previous = None
+            block = []
+            for _ in range(first, end):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                h, w = frame.shape[:2]
+                size = (min(self.analysis_width, w), max(int(h * min(self.analysis_width, w) / w), 1))
+                block.append(cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2HSV))
+                if len(block) == self.block_size:
+                    previous = self._score_block(np.stack(block), previous, scores)
+                    block = []
+            if block:
+                self._score_block(np.stack(block), previous, scores)
+        finally:
+            cap.release()
+
+        scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+        if start == 0:
+            # frame 0 has no previous frame
+            scores = np.concatenate([np.zeros(1, dtype=np.float32), scores])
+        # frames that couldn't be read score 0
+        scores = scores[:end - start]
+        return np.pad(scores, (0, end - start - len(scores)))
+
+    def _score_block(self, block, previous, scores):
+        """
+        Appends to scores the distances of the frames of the block (n, h, w, 3) to their previous frames.
+        previous -> histogram of the frame before the block, or None. Returns the histogram of the last frame
+        """
+        hue_bins, sat_bins, value_bins = self.bins
+        n = len(block)
+        # OpenCV's 8-bit hue is in [0, 180)
+        hue = block[..., 0].astype(np.int32) * hue_bins // 180
+        sat = block[..., 1].astype(np.int32) * sat_bins // 256
+        value = block[..., 2].astype(np.int32) * value_bins // 256
+        nbins = hue_bins * sat_bins * value_bins
+        # a single bincount over the whole block: the bin of each pixel is offset by its frame
+        bins = (hue * sat_bins + sat) * value_bins + value + (np.arange(n) * nbins)[:, None, None]
+        histograms = np.bincount(bins.ravel(), minlength=n * nbins).reshape(n, nbins).astype(np.float32)
+        histograms /= block.shape[1] * block.shape[2]
+
+        if previous is not None:
+            histograms = np.concatenate([previous[None], histograms])
+        distances = 0.5 * np.abs(np.diff(histograms, axis=0)).sum(axis=1)
+        scores.append(distances.astype(np.float32))
+        return histograms[-1]
+
+    def pick_cuts(self, scores):
+        """ Returns the frames whose score passes the threshold, at least min_scene_frames apart """
+        cuts = []
+        last = 0
+        for frame in np.flatnonzero(scores >= self.threshold):
+            frame = int(frame)
+            if frame - last >= self.min_scene_frames:
+                cuts.append(frame)
+                last = frame
+        return cuts
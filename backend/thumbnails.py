@@ -0,0 +1,193 @@
+import os
+import hashlib
+from backend.lazy_import import lazy_import
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+from backend.capture_pool import shared_capture_pool
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QMutex, pyqtSignal
+
+class ThumbnailStore:
+    """
+    On-disk cache of the thumbnails of one source video, memory-mapped so that reading a thumbnail
+    is only a view on the mapped file.
+    Thumbnails are fixed-size BGR images, appended to a data file ("<key>.thumbs") in the order they
+    are generated. The frame of each record is appended to an index file ("<key>.idx"), written after
+    the record itself, so a crash can't leave an index entry pointing to a missing thumbnail.
+    The key is derived from the path, size and mtime of the source, so an edited source gets a new cache.
+
+    Frames are timeline frames (at the timeline's fps) from the beginning of the source.
+    """
+    initial_capacity = 256
+
+    def __init__(self, cache_dir, source_path, width, height):
+        self.width = width
+        self.height = height
+        self.mutex = QMutex()
+
+        stat = os.stat(source_path)
+        key = hashlib.sha1(f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime}|{width}x{height}".encode()).hexdigest()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.data_path = os.path.join(cache_dir, key + ".thumbs")
+        self.index_path = os.path.join(cache_dir, key + ".idx")
+
+        # frame -> record number in the data file
+        self.records = {}
+        if os.path.exists(self.index_path):
+            frames = np.fromfile(self.index_path, dtype=np.int32)
+            self.records = {int(frame): i for i, frame in enumerate(frames)}
+
+        self.capacity = 0
+        self.data = None
+        self._map(max(self.initial_capacity, len(self.records)))
+
+    def _map(self, capacity):
+        # (re)maps the data file with room for 'capacity' thumbnails. Must be called with the mutex locked
+        record_size = self.height * self.width * 3
+        if self.data is not None:
+            self.data.flush()
+            del self.data
+        mode = "r+" if os.path.exists(self.data_path) else "w+"
+        if mode == "r+" and os.path.getsize(self.data_path) < capacity * record_size:
+            # grows the file (sparse on most filesystems) before mapping it
+            with open(self.data_path, "r+b") as f:
+                f.truncate(capacity * record_size)
+        self.data = np.memmap(self.data_path, dtype=np.uint8, mode=mode, shape=(capacity, self.height, self.width, 3))
+        self.capacity = capacity
+
+    def __contains__(self, frame):
+        return frame in self.records
+
+    def get(self, frame):
+        """ Returns the thumbnail of the given frame (a view on the mapped file), or None if it isn't cached """
+        self.mutex.lock()
+        try:
+            record = self.records.get(frame)
+            if record is None:
+                return None
+            return self.data[record]
+        finally:
+            self.mutex.unlock()
+
+    def put(self, frame, thumbnail):
+        """ Appends the thumbnail of the given frame to the cache """
+        self.mutex.lock()
+        try:
+            if frame in self.records:
+                return
+            record = len(self.records)
+            if record >= self.capacity:
+                self._map(self.capacity * 2)
+            self.data[record] = thumbnail
+            with open(self.index_path, "ab") as f:
+                f.write(np.int32(frame).tobytes())
+            self.records[frame] = record
+        finally:
+            self.mutex.unlock()
+
+class ThumbnailSignals(QObject):
+    """ Signals of a ThumbnailTask """
+    # path of the source whose thumbnails were generated
+    ready = pyqtSignal(str)
+
+class ThumbnailTask(QRunnable):
+    """
+    Decodes the given frames of a source video in a worker thread of the thread pool,
+    and stores their thumbnails
+    """
+    def __init__(self, cache, source_path, frames):
+        super().__init__()
+        self.cache = cache
+        self.source_path = source_path
+        self.frames = sorted(frames)
+        self.signals = ThumbnailSignals()
+
+    def run(self):
+        store = self.cache.store(self.source_path)
+        fps = self.cache.fps
+        cap = shared_capture_pool().acquire(self.source_path, self.frames[0] / fps)
+        try:
+            for frame in self.frames:
+                cap.set(cv2.CAP_PROP_POS_MSEC, frame * 1000 / fps)
+                ret, cv_img = cap.read()
+                if ret:
+                    store.put(frame, cv2.resize(cv_img, (store.width, store.height), interpolation=cv2.INTER_AREA))
+                self.cache.done(self.source_path, frame)
+        finally:
+            cap.release()
+        self.signals.ready.emit(self.source_path)
+
+class ThumbnailCache(QObject):
+    """
+    Thumbnails of the timeline clips, generated by background workers and stored in one ThumbnailStore
+    per source.
+    Thumbnails are requested by timeline frame. The frames requested depend on the zoom, at power of two
+    intervals (a tile pyramid), so the thumbnails of a coarser level are reused by every finer level.
+    fps -> frames per second of the timeline
+    """
+    # path of a source that has new thumbnails available
+    thumbnailsReady = pyqtSignal(str)
+
+    def __init__(self, fps, width=72, height=40, cache_dir=None, max_workers=2, batch_size=16, parent=None):
+        super().__init__(parent)
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "ShortsMaker", "thumbnails")
+        self.batch_size = batch_size
+
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_workers)
+
+        self.mutex = QMutex()
+        self.stores = {}
+        # (source path, frame) of thumbnails that are queued or being generated
+        self.pending = set()
+
+    def store(self, source_path):
+        """ Returns the ThumbnailStore of the given source, opening it on first use """
+        self.mutex.lock()
+        try:
+            store = self.stores.get(source_path)
+            if store is None:
+                store = ThumbnailStore(self.cache_dir, source_path, self.width, self.height)
+                self.stores[source_path] = store
+            return store
+        finally:
+            self.mutex.unlock()
+
+    @staticmethod
+    def level_step(pixels_per_frame, thumbnail_width):
+        """ Returns the interval in frames between thumbnails at the given zoom: a power of two """
+        step = 1
+        while step * pixels_per_frame < thumbnail_width:
+            step *= 2
+        return step
+
+    def get(self, source_path, frame):
+        """ Returns the thumbnail of the given frame if it is available, without ever decoding """
+        return self.store(source_path).get(frame)
+
+    def request(self, source_path, frames):
+        """ Queues the generation of the thumbnails of the given frames that aren't cached nor pending """
+        store = self.store(source_path)
+        self.mutex.lock()
+        missing = [frame for frame in frames if frame not in store and (source_path, frame) not in self.pending]
+        self.pending.update((source_path, frame) for frame in missing)
+        self.mutex.unlock()
+
+        for i in range(0, len(missing), self.batch_size):
+            task = ThumbnailTask(self, source_path, missing[i:i + self.batch_size])
+            task.signals.ready.connect(self.thumbnailsReady)
+            self.pool.start(task)
+
+    def done(self, source_path, frame):
+        self.mutex.lock()
+        self.pending.discard((source_path, frame))
+        self.mutex.unlock()
+
+    def cancelPending(self):
+        """ Drops the queued requests (for example, those of a zoom level that is no longer displayed) """
+        self.pool.clear()
+        self.mutex.lock()
+        self.pending.clear()
+        self.mutex.unlock()
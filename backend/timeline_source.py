@@ -0,0 +1,102 @@
+from backend.lazy_import import lazy_import
+np = lazy_import("numpy")
+from backend.video_container import IntervalTree
+from backend.compositor import Compositor
+from backend.export import ClipReader, timeline_length
+
+class TimelineSource:
+    """
+    Plays the timeline as if it was a single video: for each playhead frame, the clips active over every
+    slot are looked up in an IntervalTree, the matching source frames are read, and composited.
+    It has the interface of Video that DecodeAheadWorker and VideoThread use
+    (position, seek, next_frame, skip_frame, read_frame, fps, ...), so it plays through the same pipeline.
+
+    clips -> list of ExportClip (with the paths to decode, e.g. proxies)
+    size -> (width, height) of the composited frames
+    pool_size -> number of reused output buffers. It must be larger than the number of composited frames
+                 alive at the same time (decode-ahead buffer + frames being converted)
+    reframe -> optional Reframer, applied to every clip as in the export. Sources whose motion isn't analyzed
+               yet are played with the fixed window, the analysis runs in the background
+    """
+    def __init__(self, clips, fps, size, pool_size=12, reframe=None):
+        self.clips = clips
+        self.reframe = reframe
+        self.fps = fps
+        self.size = size
+        self.frame_interval_ms = int((1 / fps) * 1000)
+        self.total_frames = timeline_length(clips)
+        self.length = self.total_frames / fps
+        # a timeline has no single source path
+        self.path = None
+        self.current_frame = -1
+
+        self.index = IntervalTree()
+        self.index.bulk_load((clip.start_frame, clip.end_frame, clip.slot, clip) for clip in clips)
+        self.compositor = Compositor(*size)
+        # readers of the clips that were active in the last composited frame
+        self.readers = {}
+
+        width, height = size
+        self.outputs = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(pool_size)]
+        self.next_output = 0
+        self.playhead = 0
+
+    def spec(self):
+        """ Returns what a decoder process needs to open the timeline again (see decode_process) """
+        return ("timeline", self.clips, self.fps, self.size, self.reframe)
+
+    def position(self):
+        return self.playhead
+
+    def seek(self, frame):
+        self.playhead = max(frame, 0)
+
+    def frame_at(self, frame):
+        """ Composites the given timeline frame into the next output buffer """
+        active = self.index.at(frame)
+        active_clips = {clip for _, _, _, clip in active}
+        for clip in [clip for clip in self.readers if clip not in active_clips]:
+            # releases the captures of the clips that are not under the playhead anymore
+            self.readers.pop(clip).release()
+
+        layers = []
+        for start, _, slot, clip in active:
+            reader = self.readers.get(clip)
+            if reader is None:
+                reader = self.readers[clip] = ClipReader(clip, self.reframe, wait_reframe=False)
+            source_frame = reader.frame_at((frame - start) / self.fps)
+            if source_frame is not None:
+                layers.append((slot, source_frame, clip.opacity))
+
+        out = self.outputs[self.next_output]
+        self.next_output = (self.next_output + 1) % len(self.outputs)
+        self.current_frame = frame
+        return self.compositor.compose(layers, out)
+
+    def next_frame(self):
+        if self.playhead >= self.total_frames:
+            return False, None
+        out = self.frame_at(self.playhead)
+        self.playhead += 1
+        return True, out
+
+    def skip_frame(self):
+        if self.playhead >= self.total_frames:
+            return False
+        self.playhead += 1
+        return True
+
+    def read_frame(self, frame):
+        if frame < 0 or frame >= self.total_frames:
+            return None
+        out = self.frame_at(frame)
+        self.playhead = frame + 1
+        return out
+
+    def release(self):
+        for reader in self.readers.values():
+            reader.release()
+        self.readers = {}
+
+    def __del__(self):
+        self.release()
@@ -1,16 +1,34 @@
-from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt, QThread, QMutex, QWaitCondition
-import numpy as np
-import cv2
+import os
+from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt, QThread, QMutex, QWaitCondition, QTimer
+from backend.lazy_import import lazy_import
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
 from backend import video_container
+from backend.media_import import MediaImporter
+from backend.proxy import ProxyManager, ProxyState
+from backend.frame_buffer import DecodeAheadWorker
+from backend.decode_process import DecodeProcess, ProcessDecodeWorker, DEFAULT_TARGET
+from backend.frame_index import FrameIndex, FrameIndexTask, GopCache, shared_index_pool
+from backend.frame_cache import shared_frame_cache
+from backend.capture_pool import shared_capture_pool
+from backend.playback_clock import PlaybackClock
+from backend.frame_converter import FrameConverter
+from backend.profiler import shared_profiler
+from backend.export import ExportClip, ExportEngine, SegmentedExport, ExportCancelled, timeline_size
+from backend.timeline_source import TimelineSource
 
 class Video:
     """
     The Video class is responsible for storing the metadata of a video (title, duration)
     It provides functionality for playing a video (from the beggining or from a certain frame)
     """
-    def __init__(self, inputpath):
-        # Capture video
-        self.cap = cv2.VideoCapture(inputpath)
+    def __init__(self, inputpath, id=None):
+        self.path = inputpath
+        # key of this video in the shared frame cache
+        self.id = inputpath if id is None else id
+        self.frame_cache = shared_frame_cache()
+        # Capture video, from the pool of open captures (it may be one that was opened to probe the video)
+        self.cap = shared_capture_pool().acquire(inputpath)
         # Get total number of frames
         self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
         # Get fps of the video
@@ -20,36 +38,178 @@ class Video:
         # Interval between frames in milisseconds
         self.frame_interval_ms = int((1 / self.fps) * 1000) # turn seconds to ms
         self.cap.set(cv2.CAP_PROP_POS_FRAMES, -1)
-        # self.current_frame = -1
+        # index of the last frame returned by next_frame() or read_frame()
+        self.current_frame = -1
+
+        # keyframe/timestamp index, loaded or built in the background (None until it is ready)
+        self.index = None
+        # decoded frames of the last GOP read by read_frame(), used for stepping backwards
+        self.gop_cache = GopCache()
 
         if (self.cap.isOpened() == False): 
             print("camera not opened")
             return
+
+        shared_index_pool().start(FrameIndexTask(self))
             
 
     def __del__(self):
+        # gives the capture back to the pool
         self.cap.release()
 
+    def spec(self):
+        """ Returns what a decoder process needs to open the video again (see decode_process) """
+        return ("video", self.path)
+
+    def position(self):
+        """ Returns the index of the frame that the next call to next_frame() will return """
+        return int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+
+    def seek(self, frame):
+        """ Positions the capture so that next_frame() returns the given frame """
+        frame = max(frame, 0)
+        # seeking is expensive (decodes from the previous keyframe), so it's skipped if already there
+        if frame != self.position():
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+
+    def frame_index(self, wait=False):
+        """
+        Returns the keyframe/timestamp index of the video, or None while it is still being built in the background
+        wait -> loads or builds the index in the calling thread if it isn't ready, instead of returning None
+        """
+        if self.index is None and wait:
+            self.index = FrameIndex.load_or_scan(self.path, fallback_gop=max(int(round(self.fps)), 1))
+        return self.index
+
+    def frame_at_time(self, seconds):
+        """ Returns the index of the frame displayed at the given time """
+        index = self.index
+        if index is None:
+            # assumes a constant frame rate until the index is ready
+            return min(max(int(seconds * self.fps), 0), max(self.total_frames - 1, 0))
+        return index.frame_at_time(seconds * 1000)
+
+    def read_frame(self, frame):
+        """
+        Frame-accurate random access. Returns the decoded frame with the given index, or None.
+        On a miss the GOP containing the frame is decoded once from its keyframe up to the frame,
+        and kept in the GOP cache, so the following backward steps are served from memory.
+        While the frame index is being built, the capture just seeks to the frame instead.
+        """
+        if frame < 0 or frame >= self.total_frames:
+            return None
+
+        cv_img = self.frame_cache.get(self.id, frame)
+        if cv_img is None:
+            cv_img = self.gop_cache.get(frame)
+        if cv_img is not None:
+            self.current_frame = frame
+            return cv_img
+
+        if frame == self.position():
+            # sequential read, no need to go back to the keyframe
+            ret, cv_img = self.cap.read()
+            if not ret:
+                return None
+            self.current_frame = frame
+            self.frame_cache.put(self.id, frame, cv_img)
+            return cv_img
+
+        index = self.index
+        if index is None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            ret, cv_img = self.cap.read()
+            if not ret:
+                return None
+            self.current_frame = frame
+            self.frame_cache.put(self.id, frame, cv_img)
+            return cv_img
+
+        keyframe = index.keyframe_before(frame)
+        # first frame that is kept in the cache. Frames before it are only grabbed (not retrieved)
+        first_kept = max(keyframe, frame - self.gop_cache.max_frames + 1)
+
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        frames = []
+        for i in range(keyframe, frame + 1):
+            if i < first_kept:
+                ret = self.cap.grab()
+            else:
+                ret, cv_img = self.cap.read()
+                if ret:
+                    frames.append(cv_img)
+            if not ret:
+                break
+
+        self.gop_cache.store(first_kept, frames)
+        for i, decoded in enumerate(frames):
+            self.frame_cache.put(self.id, first_kept + i, decoded)
+        cv_img = self.gop_cache.get(frame)
+        if cv_img is not None:
+            self.current_frame = frame
+        return cv_img
+
     def previous_frame(self):
-        current_frame = self.cap.get(cv2.CAP_PROP_POS_FRAMES)
-        if current_frame > 0:
-            current_frame -= 1
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame-1)
-            return self.cap.read()
-        else:
-            return False, None
+        """ Returns the frame before the last one that was read """
+        cv_img = self.read_frame(self.current_frame - 1)
+        return cv_img is not None, cv_img
+
+    def skip_frame(self):
+        """ Advances past the next frame without retrieving it (no conversion nor copy). Returns False at the end """
+        if self.cap.isOpened() and self.cap.get(cv2.CAP_PROP_POS_FRAMES) < self.total_frames-1:
+            return self.cap.grab()
+        return False
 
     def next_frame(self):
         """ Reads the next frame as returns it """
         if self.cap.isOpened() and self.cap.get(cv2.CAP_PROP_POS_FRAMES) < self.total_frames-1:
-            return self.cap.read()
+            self.current_frame = self.position()
+            ret, cv_img = self.cap.read()
+            if ret:
+                # frames that were just played are the most likely to be scrubbed over again
+                self.frame_cache.put(self.id, self.current_frame, cv_img)
+            return ret, cv_img
         else:
             return False, None
 
+class VideoInfo:
+    """
+    Metadata of a video decoded in the decoder process, with the part of the interface of Video that VideoThread
+    and ProcessDecodeWorker use (spec, fps, total_frames...), so the video isn't also opened in this process
+    """
+    def __init__(self, path, total_frames, fps):
+        self.path = path
+        self.total_frames = total_frames
+        self.fps = fps
+        self.length = total_frames / fps
+        self.frame_interval_ms = int((1 / fps) * 1000)
+
+    def spec(self):
+        return ("video", self.path)
+
+    def open(self):
+        """ Returns the Video, to decode it in this process """
+        return Video(self.path)
+
 class VideoThread(QThread):
-    change_pixmap_signal = pyqtSignal(np.ndarray)
+    """
+    Presentation loop of the video player.
+    Frames are decoded ahead of time by a DecodeAheadWorker into a bounded ring buffer,
+    and this thread only pops the frames that are ready and emits them to the gui.
+    Each frame is presented at its deadline on a PlaybackClock. Frames whose display slot is
+    already over are dropped, and the decoder skips ahead to the frame that is due.
+    Emitted frames are already resized for the video label by a FrameConverter, so the gui thread
+    only wraps them in a QImage.
+    With use_decode_process, decoding and converting run in a separate process instead (see decode_process),
+    so they don't compete with the gui thread for the GIL.
+    buffer_frames -> maximum number of decoded frames kept ahead of the playhead
+    buffer_bytes -> maximum size in bytes of the decoded frames kept ahead of the playhead
+    max_frame_skip -> maximum number of consecutive frames dropped before a late frame is shown anyway
+    """
+    # frames (numpy arrays) converted for the video label
+    change_pixmap_signal = pyqtSignal(object)
 
-    def __init__(self):
+    def __init__(self, buffer_frames=8, buffer_bytes=256 * 1024 * 1024, max_frame_skip=8, use_decode_process=False):
         super().__init__()
         self.mutex = QMutex()
         self.condv = QWaitCondition()
@@ -57,58 +217,214 @@ class VideoThread(QThread):
         self.paused = True
         self.video = None
 
-    def back(self):
-        # if a video is loaded and it is running, return the previous frame
-        if not self.running and self.video:
-            ret, cv_img = self.video.previous_frame()
+        self.buffer_frames = buffer_frames
+        self.buffer_bytes = buffer_bytes
+        self.max_frame_skip = max_frame_skip
+        # converts frames to the size of the video label, on the decode side
+        self.converter = FrameConverter(pool_size=buffer_frames + 4)
+        # decode-ahead worker of the current video
+        self.decoder = None
+        self.use_decode_process = use_decode_process
+        # decoder process, started by the first video played with use_decode_process
+        self.decode_process = None
+        # presentation clock of the current video
+        self.clock = None
+        # index of the last frame emitted to the gui
+        self.current_frame = -1
+        # True when frames were stepped through with random access, and the decoder is behind/ahead
+        self.needs_seek = False
+        # timing probes of the presentation stages (see Profiler)
+        self.profiler = shared_profiler()
 
-            if ret:
-                self.change_pixmap_signal.emit(cv_img)
+    def back(self):
+        # if a video is loaded and it is paused, return the previous frame
+        if not self.running and self.decoder and self.current_frame > 0:
+            # served from the GOP cache of the video, without restarting the decode-ahead worker
+            self._emit_frame(self.current_frame - 1)
     
     def front(self):
-        # if a video is loaded and it is running, return the next frame
-        if not self.running and self.video:
-            ret, cv_img = self.video.next_frame()
+        # if a video is loaded and it is paused, return the next frame
+        if not self.running and self.decoder:
+            if self.needs_seek:
+                # the user stepped backwards, so the buffered frames are not the next ones
+                self._emit_frame(self.current_frame + 1)
+            else:
+                self._emit_next(count_underrun=False)
 
-            if ret:
-                self.change_pixmap_signal.emit(cv_img)
+    def _emit_frame(self, frame):
+        """
+        Emits the frame with the given index using random access. Returns True if a frame was emitted
+        """
+        start = self.profiler.begin()
+        cv_img = self.decoder.read_frame(frame)
+        self.profiler.end("read_frame", start)
+        if cv_img is None:
+            return False
+
+        self.current_frame = frame
+        # the decode-ahead buffer must be repositioned before playback resumes
+        self.needs_seek = True
+        self._emit(cv_img)
+        return True
+
+    def _emit(self, cv_img):
+        """ Sends a frame to the gui. The time until the gui receives it is measured by the video label """
+        start = self.profiler.begin()
+        self.profiler.stamp("signal", id(cv_img))
+        self.change_pixmap_signal.emit(cv_img)
+        self.profiler.end("emit", start)
+
+    @pyqtSlot(object)
+    def releaseFrame(self, cv_img):
+        """ Called once the gui copied an emitted frame, or the frame was dropped: its buffer can be written again """
+        self.converter.release(cv_img)
+        decode_process = self.decode_process
+        if decode_process is not None:
+            decode_process.release(cv_img)
+
+    @pyqtSlot(int, int)
+    def setTargetSize(self, width, height):
+        """
+        Sets the size that frames are converted to (the size of the video label).
+        If the video is paused, the current frame is emitted again at the new size
+        """
+        self.converter.set_target_size(width, height)
+        if self.decoder:
+            self.decoder.set_target_size(width, height)
+        if not self.running and self.decoder and self.current_frame >= 0:
+            self._emit_frame(self.current_frame)
+
+    def _emit_next(self, count_underrun=True):
+        """
+        Pops the next decoded frame and emits it. Returns True if a frame was emitted
+        """
+        item = self.decoder.buffer.pop(count_underrun=count_underrun)
+        if item is None:
+            return False
+
+        self.current_frame, cv_img = item
+        self.profiler.since_stamp("buffer_wait", "buffer", id(cv_img))
+        self._emit(cv_img)
+        return True
 
     def run(self):
+        self.profiler.name_thread("presentation")
 
         while True:
 
             self.mutex.lock()
-            if not self.running or not self.video:
+            if not self.running or not self.decoder:
                 # the video is paused, this thread waits
                 self.condv.wait(self.mutex)
+            decoder = self.decoder
+            clock = self.clock
             self.mutex.unlock()
 
-            if self.video:
-                # if there is a video currently loaded, gets the next frame
-                ret, cv_img = self.video.next_frame()
-            else:
-                # if there is no video currently loaded, returns no frame
-                ret, cv_img = False, None
+            if not decoder:
+                continue
 
-            if ret:
-                self.change_pixmap_signal.emit(cv_img)
-                self.msleep(self.video.frame_interval_ms)  # Add a delay between frames
-            else:
-                self.pause_resume()
-                #break
+            # only pops frames that are already decoded, waiting at most one frame interval
+            item = decoder.buffer.pop(self.video.frame_interval_ms)
+
+            if item is None:
+                if decoder.buffer.end_of_stream:
+                    self.pause_resume()
+                continue
+
+            frame_index, cv_img = item
+            self.profiler.since_stamp("buffer_wait", "buffer", id(cv_img))
+            if not clock.started:
+                # first frame after starting, resuming or seeking: it's due right now
+                clock.start(frame_index)
+            elif clock.is_late(frame_index) and frame_index - clock.last_presented <= self.max_frame_skip:
+                # the display slot of this frame is over, so it is dropped, and the decoder skips
+                # straight to the frame that is due instead of decoding and converting every late frame
+                decoder.skip_to(clock.due_frame())
+                self.releaseFrame(cv_img)
+                continue
+
+            # sleeps until the absolute deadline of the frame, not a fixed interval
+            remaining = clock.time_until(frame_index)
+            if remaining > 0:
+                self.usleep(int(remaining * 1000000))
+
+            self.current_frame = frame_index
+            self._emit(cv_img)
+            clock.presented_frame(frame_index)
 
     def setCurrentVideo(self, video, frame=0):
         """
         Sets the video being played by the thread to the video received in the argument, starting in 
         the frame received in the argument.
         """
-        video.cap.set(cv2.CAP_PROP_POS_FRAMES, frame-1)
+        if not self.isRunning():
+            self.start()
+
+        if isinstance(video, VideoInfo) and not self.use_decode_process:
+            # a video that was played in the decoder process is now decoded in this one (see setDecodeProcess)
+            video = video.open()
+
+        if self.use_decode_process:
+            if self.decode_process is None or not self.decode_process.alive():
+                # the slots of the frames decoded ahead or queued to the gui, plus a margin
+                self.decode_process = DecodeProcess(slots=self.buffer_frames + 4, reserve=4)
+            converter = self.converter
+            target = (converter.target_width, converter.target_height) if converter.target_width else DEFAULT_TARGET
+            decoder = ProcessDecodeWorker(self.decode_process, video, target)
+        else:
+            decoder = DecodeAheadWorker(video, self.buffer_frames, self.buffer_bytes, self.converter)
+        decoder.seek(frame)
+        decoder.start()
+
+        self.mutex.lock()
+        old_decoder = self.decoder
+        self.decoder = decoder
         self.video = video
+        self.clock = PlaybackClock(video.fps)
+        self.current_frame = frame - 1
+        self.needs_seek = False
+        self.mutex.unlock()
+
+        if old_decoder:
+            old_decoder.stop()
+        if not self.use_decode_process and self.decode_process is not None:
+            self.decode_process.close()
+            self.decode_process = None
+
+    def setDecodeProcess(self, enabled):
+        """
+        Turns decoding in a separate process on or off. The current video is loaded again, at the same frame
+        """
+        if enabled == self.use_decode_process:
+            return
+        self.use_decode_process = enabled
+        if self.video is not None:
+            self.setCurrentVideo(self.video, self.current_frame + 1)
 
+    def buffer_stats(self):
+        """
+        Returns the fill level (in frames and bytes) and the underrun count of the decode-ahead buffer,
+        or None if no video is loaded
+        """
+        if not self.decoder:
+            return None
+        return self.decoder.buffer.stats()
+
+    def playback_stats(self):
+        """
+        Returns the achieved fps, dropped frames and jitter of the playback, or None if no video is loaded
+        """
+        if not self.clock:
+            return None
+        return self.clock.stats()
 
     def stop(self):
         #sets running flag to false and waits for the thread to finish
         self.running = False
+        if self.decoder:
+            self.decoder.stop()
+        if self.decode_process is not None:
+            self.decode_process.close()
         self.wait()
 
     def pause_resume(self):
@@ -116,25 +432,180 @@ class VideoThread(QThread):
         self.mutex.lock()
         self.running = not(self.running)
 
+        if self.running and self.needs_seek:
+            # playback continues right after the frame stepped to with back/front
+            self.decoder.seek(self.current_frame + 1)
+            self.needs_seek = False
+
+        if self.clock:
+            # the clock is anchored again on the first frame presented after resuming
+            self.clock.reset()
+
         if self.running:
             # The video was resumed, need to wake up worker thread
             self.condv.wakeAll()
             
         self.mutex.unlock()
 
+class ExportThread(QThread):
+    """
+    Runs an ExportEngine in the background, reporting its progress with signals.
+    With more than one worker, the timeline is rendered in segments by a process pool (SegmentedExport), if
+    ffmpeg is there to join them
+    """
+    # frames done, total frames, render fps, eta in seconds
+    progress_signal = pyqtSignal(int, int, float, float)
+    # path of the rendered video
+    finished_signal = pyqtSignal(str)
+    # error message (empty if the export was cancelled)
+    failed_signal = pyqtSignal(str)
+
+    def __init__(self, clips, output_path, fps=30, size=None, workers=1, reframe=None):
+        super().__init__()
+        if workers > 1 and SegmentedExport.available():
+            self.engine = SegmentedExport(clips, output_path, fps, size, workers=workers, progress=self.progress_signal.emit,
+                                          reframe=reframe)
+        else:
+            self.engine = ExportEngine(clips, output_path, fps, size, progress=self.progress_signal.emit, reframe=reframe)
+
+    def run(self):
+        try:
+            self.finished_signal.emit(self.engine.render())
+        except ExportCancelled:
+            self.failed_signal.emit("")
+        except Exception as e:
+            self.failed_signal.emit(str(e))
+
+    def cancel(self):
+        self.engine.cancel()
+
 class VideoPlayer:
     def __init__(self, video_widget) -> None:
         
-        self.thread = VideoThread()
+        # SHORTSMAKER_DECODE_PROCESS=1 starts the player decoding in a separate process (see setDecodeProcess)
+        self.thread = VideoThread(use_decode_process=os.environ.get("SHORTSMAKER_DECODE_PROCESS") == "1")
+        self.video_widget = video_widget
+        # repaints the performance overlay while it is shown, so its numbers stay current when paused
+        self.overlay_timer = QTimer()
+        self.overlay_timer.setInterval(500)
+        self.overlay_timer.timeout.connect(video_widget.update)
         # connects the change pixmap signal to the slot that is the update_image method of the video_widget
         self.thread.change_pixmap_signal.connect(video_widget.update_image)
-        # start the thread
-        self.thread.start()
-        #self.thread.setCurrentVideo(Video('input/video2.mp4'))
+        # and the frames go back to the converter's pool once the video_widget copied them
+        video_widget.frame_shown.connect(self.thread.releaseFrame)
+        # frames are converted to the size of the video widget before being emitted
+        video_widget.target_size_changed.connect(self.thread.setTargetSize)
+        # the thread is started by the first video loaded, so launching the editor doesn't start it
 
         self.video_database = video_container.VideoContainer()
+        # imports videos in the background, adding them to the video database
+        self.importer = MediaImporter(self.video_database)
+
+        # low resolution proxies, generated in the background for every imported video and used for playback
+        self.proxies = ProxyManager()
+        self.importer.imported.connect(lambda id, length, video_path: self.proxies.generate(video_path))
+        self.proxies.proxyStateChanged.connect(self._proxyStateChanged)
+        # path of the original video being played (even if its proxy is what is decoded)
+        self.current_source = None
+
+    def playVideo(self, source_path, frame=0):
+        """
+        Loads a video in the player, starting at the given frame. If the video has a proxy, the proxy is played
+        """
+        self.current_source = source_path
+        playback_path = self.proxies.playbackPath(source_path)
+        video = None
+        if self.thread.use_decode_process:
+            # only the decoder process opens the video. A proxy has the frames of its source, so the metadata
+            # cached at import applies to both
+            metadata = self.importer.cache.get(source_path) or video_container.probe(playback_path)
+            if metadata is not None:
+                video = VideoInfo(playback_path, metadata[0], metadata[1])
+        self.thread.setCurrentVideo(video or Video(playback_path), frame)
+
+    def playTimeline(self, clips, fps, frame=0, reframe=None):
+        """
+        Loads the timeline (list of ExportClip) in the player, starting at the given frame. The clips active at each
+        frame are composited over every slot, as in the export. Clips whose video has a proxy decode the proxy.
+        reframe -> optional Reframer (for example to 9:16), as in the export
+        """
+        if not clips:
+            return
+        # same canvas as the export, but composited directly at the size it is displayed at
+        width, height = timeline_size(clips, reframe)
+        converter = self.thread.converter
+        if converter.target_width and converter.target_height:
+            fitted_width, fitted_height = converter.fitted_size(width, height)
+            if fitted_width < width:
+                width, height = fitted_width, fitted_height
+
+        playback_clips = [ExportClip(self.proxies.playbackPath(clip.source_path), clip.start_frame, clip.nframes,
+                                     clip.slot, clip.opacity, clip.source_start) for clip in clips]
+        self.current_source = None
+        timeline = TimelineSource(playback_clips, fps, (width, height), pool_size=self.thread.buffer_frames + 4,
+                                  reframe=reframe)
+        self.thread.setCurrentVideo(timeline, frame)
+
+    def _proxyStateChanged(self, source_path, state, progress):
+        # when the proxy of the video being played becomes ready, playback switches to it at the same frame
+        if state == ProxyState.READY and source_path == self.current_source and self.thread.video \
+                and self.thread.video.path == source_path and not self.thread.running:
+            self.playVideo(source_path, self.thread.current_frame + 1)
+
+    def setDecodeProcess(self, enabled):
+        """ Decodes the videos played in a separate process (enabled) or in a thread of this one """
+        self.thread.setDecodeProcess(enabled)
+
+    def setProfiling(self, enabled):
+        """
+        Turns the timing probes of the playback stages on or off, with the performance overlay on the video.
+        Turning them on starts new statistics
+        """
+        profiler = shared_profiler()
+        if enabled:
+            profiler.reset()
+        profiler.enabled = enabled
+        self.video_widget.set_overlay(self.overlayLines if enabled else None)
+        if enabled:
+            self.overlay_timer.start()
+        else:
+            self.overlay_timer.stop()
+
+    def overlayLines(self):
+        """ Returns the lines of the performance overlay: fps, drops, jitter and the p95 of every stage """
+        lines = []
+        stats = self.thread.playback_stats()
+        if stats:
+            lines.append(f"fps {stats['achieved_fps']:5.1f}/{stats['target_fps']:.4g}  dropped {stats['dropped']}"
+                         f"  jitter {stats['jitter_ms']:.1f}ms")
+        buffer = self.thread.buffer_stats()
+        if buffer:
+            lines.append(f"buffer {buffer['frames']}/{buffer['max_frames']}  underruns {buffer['underruns']}")
+        for stage, summary in sorted(shared_profiler().summary().items()):
+            lines.append(f"{stage:<15} p50 {summary['p50_ms']:6.2f}ms  p95 {summary['p95_ms']:6.2f}ms")
+        return lines
+
+    def exportTrace(self, path):
+        """ Writes the recorded timings to path, as a trace that chrome://tracing or Perfetto can open """
+        return shared_profiler().export_trace(path)
+
+    def cache_stats(self):
+        """ Returns the hit, miss and eviction statistics of the frame cache shared by all videos """
+        return shared_frame_cache().stats()
 
     def addVideo(self, video_path):
         # Adds a video to the database of videos, and returns the id and length in seconds of the video
-        id, length = self.video_database.addVideo(video_path)
-        return id, length
\ No newline at end of file
+        # (or None if the video can't be read). Blocks while the video is probed, see importVideos
+        return self.video_database.addVideo(video_path)
+
+    def export(self, clips, output_path, fps=30, size=None, workers=1, reframe=None):
+        # Renders the clips (list of ExportClip) into output_path in the background, and returns the ExportThread
+        # With workers > 1, segments of the timeline are rendered in parallel processes
+        # reframe is an optional Reframer that crops every clip (for example to 9:16)
+        self.export_thread = ExportThread(clips, output_path, fps, size, workers, reframe)
+        self.export_thread.start()
+        return self.export_thread
+
+    def importVideos(self, video_paths):
+        # Adds the videos to the database in the background. Progress is reported by self.importer's signals
+        self.importer.importVideos(video_paths)
\ No newline at end of file
@@ -1,75 +1,133 @@
-import cv2
-from enum import Enum
+from backend.lazy_import import lazy_import
+from backend.capture_pool import shared_capture_pool
+cv2 = lazy_import("cv2")
 
 class Video():
-    def __init__(self, id, total_frames, fps, length_seconds) -> None:
+    def __init__(self, id, total_frames, fps, length_seconds, path=None) -> None:
         self.id = id
+        self.path = path
         self.total_frames = total_frames
         self.fps = fps
         self.length_seconds = length_seconds
         pass
 
-class VideoContainer():
-    def __init__(self):
-        self.videos = []
-        self.container = AVLTree()
-        self.videos_counter = 0
-
-    def addVideo(self, video_path):
-        # Capture video
-        cap = cv2.VideoCapture(video_path)
+def probe(video_path):
+    """
+    Opens the video in the given path and reads its metadata.
+    Returns (total_frames, fps, length_seconds), or None if the file can't be read as a video.
+    The capture is always given back to the capture pool, where it's reused by the next reader of the video
+    """
+    cap = shared_capture_pool().acquire(video_path)
+    try:
+        if not cap.isOpened():
+            return None
         # Get total number of frames
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         # Get fps of the video
         fps = cap.get(cv2.CAP_PROP_FPS)
+        if total_frames <= 0 or fps <= 0:
+            return None
         # Get the length of the video in seconds
         length_seconds = total_frames / fps
+        return total_frames, fps, length_seconds
+    finally:
+        cap.release()
+
+class VideoContainer():
+    def __init__(self):
+        self.videos = []
+        self.videos_counter = 0
+
+    def addVideo(self, video_path, metadata=None):
+        """
+        Adds a video to the container. metadata is the result of probe(video_path), and is read
+        from the file when not given (blocking).
+        Returns the id of the created video and its length in seconds, or None if the video can't be read
+        """
+        if metadata is None:
+            metadata = probe(video_path)
+            if metadata is None:
+                return None
+        total_frames, fps, length_seconds = metadata
 
-        video = Video(self.videos_counter, total_frames, fps, length_seconds)
+        video = Video(self.videos_counter, total_frames, fps, length_seconds, video_path)
         self.videos.append(video)
 
         self.videos_counter += 1
 
         # returns the id of the created video, and the length in seconds
         return video.id, video.length_seconds
-        
-        cap.release()
-
-class TrackFlag(Enum):
-    START=1
-    END=2
 
-class TreeNode:
-    def __init__(self, time, track, height=1):
+class IntervalNode:
+    def __init__(self, start, end, slot, clip, seq):
         """
-        Creates a Node for the AVLTree, which represents a start or end time in a track
+        Creates a Node for the IntervalTree, which represents a clip placed in a slot,
+        occupying the frames [start, end)
         """
-        # time 
-        self.time = time
-        # video track associated with this node
-        self.track = track
+        self.start = start
+        self.end = end
+        self.slot = slot
+        self.clip = clip
+        # insertion counter, breaks ties between clips with the same start and end
+        self.seq = seq
+        # greatest end of the intervals in the subtree rooted at this node
+        self.max_end = end
         # height of the current tree
-        self.height = height
+        self.height = 1
 
         # left subtree
         self.left = None
         # right subtree
         self.right = None
 
-class AVLTree:
+    @property
+    def key(self):
+        return (self.start, self.end, self.seq)
+
+    def entry(self):
+        return (self.start, self.end, self.slot, self.clip)
+
+class IntervalTree:
+    """
+    Index of the clips placed on the timeline, over every slot.
+    Each clip is an interval [start, end) of frames. The tree is an AVL tree ordered by start frame,
+    where every node also stores the greatest end frame of its subtree, so that the subtrees that
+    can't contain a match are skipped.
+
+    Queries return (start frame, end frame, slot, clip) tuples sorted by start frame.
+    Clips must be hashable, since the tree keeps a map from each clip to its node.
+    """
     def __init__(self):
         self.root = None
+        self.nodes = {}
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, clip):
+        return clip in self.nodes
 
     def get_height(self, node):
         if not node:
             return 0
         return node.height
 
+    def get_max_end(self, node):
+        if not node:
+            return float("-inf")
+        return node.max_end
+
     def get_balance(self, node):
         if not node:
             return 0
         return self.get_height(node.left) - self.get_height(node.right)
 
+    def update(self, node):
+        # recomputes the height and the max end of a node from its children
+        node.height = 1 + max(self.get_height(node.left), self.get_height(node.right))
+        node.max_end = max(node.end, self.get_max_end(node.left), self.get_max_end(node.right))
+
     def left_rotate(self, z):
         y = z.right
         T2 = y.left
@@ -77,8 +135,8 @@ class AVLTree:
         y.left = z
         z.right = T2
 
-        z.height = 1 + max(self.get_height(z.left), self.get_height(z.right))
-        y.height = 1 + max(self.get_height(y.left), self.get_height(y.right))
+        self.update(z)
+        self.update(y)
 
         return y
 
@@ -89,91 +147,60 @@ class AVLTree:
         x.right = y
         y.left = T2
 
-        y.height = 1 + max(self.get_height(y.left), self.get_height(y.right))
-        x.height = 1 + max(self.get_height(x.left), self.get_height(x.right))
+        self.update(y)
+        self.update(x)
 
         return x
 
-    def insert(self, time):
-        if not self.root:
-            self.root = TreeNode(time)
-            return
-
-        self.root = self._insert(self.root, time)
-
-    def _insert(self, node, time):
-        if not node:
-            return TreeNode(time)
-
-        if time < node.time:
-            node.left = self._insert(node.left, time)
-        else:
-            node.right = self._insert(node.right, time)
-
-        node.height = 1 + max(self.get_height(node.left), self.get_height(node.right))
-
+    def rebalance(self, node):
+        self.update(node)
         balance = self.get_balance(node)
 
         # Left heavy
         if balance > 1:
-            if time < node.left.time:  # Left-Left
-                return self.right_rotate(node)
-            else:  # Left-Right
+            if self.get_balance(node.left) < 0:  # Left-Right
                 node.left = self.left_rotate(node.left)
-                return self.right_rotate(node)
+            return self.right_rotate(node)
 
         # Right heavy
         if balance < -1:
-            if time > node.right.time:  # Right-Right
-                return self.left_rotate(node)
-            else:  # Right-Left
+            if self.get_balance(node.right) > 0:  # Right-Left
                 node.right = self.right_rotate(node.right)
-                return self.left_rotate(node)
+            return self.left_rotate(node)
 
         return node
 
-    def search(self, time):
-        return self._search(self.root, time)
+    def insert(self, start, end, slot, clip):
+        """ Adds a clip occupying the frames [start, end) of the given slot """
+        if clip in self.nodes:
+            self.remove(clip)
 
-    def _search(self, node, time):
-        if node is None or node.time == time:
+        node = IntervalNode(start, end, slot, clip, self.seq)
+        self.seq += 1
+        self.nodes[clip] = node
+        self.root = self._insert(self.root, node)
+
+    def _insert(self, root, node):
+        if not root:
             return node
-        if time < node.time:
-            return self._search(node.left, time)
-        return self._search(node.right, time)
-
-    def next_larger(self, time):
-        node = self.search(time)
-        return self._next_larger(self.root, node)
-
-    def _next_larger(self, root, node):
-        if node.right:
-            return self._min_value_node(node.right)
-        successor = None
-        while root:
-            if node.time < root.time:
-                successor = root
-                root = root.left
-            elif node.time > root.time:
-                root = root.right
-            else:
-                break
-        return successor
 
-    def _min_value_node(self, node):
-        current = node
-        while current.left:
-            current = current.left
-        return current
-    
-    def delete(self, key):
-        self.root = self._delete(self.root, key)
+        if node.key < root.key:
+            root.left = self._insert(root.left, node)
+        else:
+            root.right = self._insert(root.right, node)
+
+        return self.rebalance(root)
+
+    def remove(self, clip):
+        """ Removes a clip from the index. Does nothing if the clip isn't indexed """
+        node = self.nodes.pop(clip, None)
+        if node:
+            self.root = self._delete(self.root, node.key)
 
     def _delete(self, root, key):
         if not root:
             return root
 
-        # First, handle standard BST delete
         if key < root.key:
             root.left = self._delete(root.left, key)
         elif key > root.key:
@@ -183,29 +210,92 @@ class AVLTree:
                 return root.right
             elif root.right is None:
                 return root.left
-            root.key = self._min_value_node(root.right).key
-            root.right = self._delete(root.right, root.key)
+            # replaces the node by its successor, which is removed from the right subtree
+            successor = self._min_value_node(root.right)
+            successor.right = self._delete_min(root.right)
+            successor.left = root.left
+            root = successor
 
-        # Update height of the current node
-        root.height = 1 + max(self.get_height(root.left), self.get_height(root.right))
+        return self.rebalance(root)
 
-        # Now handle AVL rotations if needed
-        balance = self.get_balance(root)
+    def _delete_min(self, root):
+        if root.left is None:
+            return root.right
+        root.left = self._delete_min(root.left)
+        return self.rebalance(root)
 
-        # Left heavy
-        if balance > 1:
-            if self.get_balance(root.left) >= 0:  # Left-Left
-                return self.right_rotate(root)
-            else:  # Left-Right
-                root.left = self.left_rotate(root.left)
-                return self.right_rotate(root)
+    def _min_value_node(self, node):
+        current = node
+        while current.left:
+            current = current.left
+        return current
 
-        # Right heavy
-        if balance < -1:
-            if self.get_balance(root.right) <= 0:  # Right-Right
-                return self.left_rotate(root)
-            else:  # Right-Left
-                root.right = self.right_rotate(root.right)
-                return self.left_rotate(root)
+    def move(self, clip, start, end, slot):
+        """ Updates the position of an indexed clip (or adds it if it isn't indexed) """
+        node = self.nodes.get(clip)
+        if node and node.start == start and node.end == end:
+            # only the slot changed, the order of the tree is the same
+            node.slot = slot
+            return
+        self.insert(start, end, slot, clip)
 
-        return root
\ No newline at end of file
+    def bulk_load(self, entries):
+        """
+        Replaces the content of the index with the given (start, end, slot, clip) entries.
+        The tree is built already balanced in O(n log n), instead of n separate insertions
+        """
+        self.root = None
+        self.nodes = {}
+        nodes = []
+        for start, end, slot, clip in entries:
+            node = IntervalNode(start, end, slot, clip, self.seq)
+            self.seq += 1
+            self.nodes[clip] = node
+            nodes.append(node)
+        nodes.sort(key=lambda node: node.key)
+        self.root = self._build(nodes, 0, len(nodes))
+
+    def _build(self, nodes, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        node = nodes[mid]
+        node.left = self._build(nodes, lo, mid)
+        node.right = self._build(nodes, mid + 1, hi)
+        self.update(node)
+        return node
+
+    def at(self, frame):
+        """ Returns the clips active at the given frame """
+        return self.overlapping(frame, frame + 1)
+
+    def overlapping(self, a, b, limit=None):
+        """ Returns the clips that overlap the frames [a, b). With a limit, at most the first limit clips """
+        result = []
+        self._overlapping(self.root, a, b, result, limit)
+        return result
+
+    def _overlapping(self, node, a, b, result, limit):
+        # no interval in this subtree ends after a
+        if node is None or node.max_end <= a or (limit is not None and len(result) >= limit):
+            return
+        self._overlapping(node.left, a, b, result, limit)
+        # every interval on the right starts at or after node.start, so if node starts at or
+        # after b, neither the node nor its right subtree can overlap
+        if node.start < b and (limit is None or len(result) < limit):
+            if node.end > a:
+                result.append(node.entry())
+            self._overlapping(node.right, a, b, result, limit)
+
+    def entries(self):
+        """ Returns every indexed clip, sorted by start frame """
+        result = []
+        self._inorder(self.root, result)
+        return result
+
+    def _inorder(self, node, result):
+        if node is None:
+            return
+        self._inorder(node.left, result)
+        result.append(node.entry())
+        self._inorder(node.right, result)
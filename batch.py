@@ -0,0 +1,201 @@
+"""
+Headless batch renderer.
+Renders project files (JSON or YAML descriptions of a timeline, or .smproj projects saved by the editor)
+with the backend export engine only, without importing Qt, so it can run on machines with no display
+(overnight batch runs, CI).
+
+Run from the root of the repository:
+    python batch.py project.json                  renders one project, in segments over every core
+    python batch.py projects/ --workers 4         renders every project in the directory, 4 at a time
+
+A project looks like this (YAML projects have the same keys, and need PyYAML installed):
+    {
+        "fps": 30,                          fps of the timeline, defaults to 30
+        "size": [1080, 1920],               size of the output, defaults to the size of the first clip
+        "reframe": "center",                optional: "center" or "motion" (9:16 crop, see backend/reframe.py)
+        "output": "out/project.mp4",        defaults to <output dir>/<project name>.mp4
+        "clips": [
+            {"source": "input/a.mp4", "start": 0.0, "slot": 0},
+            {"source": "input/b.mp4", "start": 2.5, "in": 10.0, "duration": 4.0, "slot": 1, "opacity": 0.8}
+        ]
+    }
+Times are in seconds. "in" is the time of the source where the clip starts (0 by default), and a clip's
+duration defaults to the rest of its source. Relative paths are relative to the project file.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from backend.export import ExportClip, ExportEngine, SegmentedExport
+from backend.reframe import Reframer
+from backend.video_container import probe
+from backend.project_file import ProjectFileError, load_project
+
+PROJECT_EXTENSIONS = (".json", ".yaml", ".yml", ".smproj")
+
+class ProjectError(Exception):
+    pass
+
+class Project:
+    """
+    A timeline loaded from a project file, ready to be rendered.
+    clips -> list of ExportClip, with their times converted to timeline frames
+    """
+    def __init__(self, path, clips, fps=30, size=None, output_path=None, reframe=None, fourcc="mp4v"):
+        self.path = path
+        self.clips = clips
+        self.fps = fps
+        self.size = size
+        self.output_path = output_path
+        self.reframe = reframe
+        self.fourcc = fourcc
+
+    @property
+    def name(self):
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    @staticmethod
+    def read(path):
+        """ Returns the contents of a project file as a dict """
+        with open(path) as f:
+            if path.endswith(".json"):
+                return json.load(f)
+            try:
+                import yaml
+            except ImportError:
+                raise ProjectError(f"{path}: reading YAML projects requires PyYAML (pip install pyyaml)")
+            return yaml.safe_load(f)
+
+    @classmethod
+    def load(cls, path, output_dir="output"):
+        """ Loads the project file in the given path. Raises ProjectError if it is invalid """
+        if path.endswith(".smproj"):
+            return cls.load_saved(path, output_dir)
+        try:
+            data = cls.read(path)
+        except (OSError, ValueError) as e:
+            raise ProjectError(f"{path}: {e}")
+        if not isinstance(data, dict) or not data.get("clips"):
+            raise ProjectError(f"{path}: a project needs a list of clips")
+
+        base_dir = os.path.dirname(os.path.abspath(path))
+        fps = data.get("fps", 30)
+        clips = []
+        for i, clip in enumerate(data["clips"]):
+            if "source" not in clip:
+                raise ProjectError(f"{path}: clip {i} has no source")
+            source_path = os.path.join(base_dir, clip["source"])
+            source_start = clip.get("in", 0)
+            duration = clip.get("duration")
+            if duration is None:
+                metadata = probe(source_path)
+                if metadata is None:
+                    raise ProjectError(f"{path}: can't read {source_path}")
+                duration = metadata[2] - source_start
+            clips.append(ExportClip(source_path, round(clip.get("start", 0) * fps), max(round(duration * fps), 1),
+                                    clip.get("slot", 0), clip.get("opacity", 1.0), source_start))
+
+        reframe = data.get("reframe")
+        if reframe not in (None, "center", "motion"):
+            raise ProjectError(f"{path}: unknown reframe '{reframe}'")
+        if reframe:
+            reframe = Reframer(Reframer.FIXED if reframe == "center" else Reframer.MOTION)
+
+        output_path = data.get("output")
+        output_path = os.path.join(base_dir, output_path) if output_path else None
+        project = cls(path, clips, fps, tuple(data["size"]) if data.get("size") else None, output_path, reframe,
+                      data.get("fourcc", "mp4v"))
+        project.output_path = project.output_path or os.path.join(output_dir, project.name + ".mp4")
+        return project
+
+    @classmethod
+    def load_saved(cls, path, output_dir="output"):
+        """ Loads a project saved by the editor, with the edits of its journal """
+        try:
+            data = load_project(path)
+        except ProjectFileError as e:
+            raise ProjectError(str(e))
+        if not len(data):
+            raise ProjectError(f"{path}: a project needs a list of clips")
+        clips = [ExportClip(source_path, start, length, slot, source_start=source_start / data.fps)
+                 for _, source_path, slot, start, length, source_start in data.clips()]
+        clips.sort(key=lambda clip: (clip.start_frame, clip.slot))
+        project = cls(path, clips, data.fps)
+        project.output_path = os.path.join(output_dir, project.name + ".mp4")
+        return project
+
+    def render(self, workers=1, progress=None):
+        """
+        Renders the project. With workers > 1, segments of the timeline are rendered in parallel processes (if
+        ffmpeg is installed to join them, see SegmentedExport.available)
+        """
+        if workers > 1 and SegmentedExport.available():
+            engine = SegmentedExport(self.clips, self.output_path, self.fps, self.size, self.fourcc, workers=workers,
+                                     progress=progress, reframe=self.reframe)
+        else:
+            engine = ExportEngine(self.clips, self.output_path, self.fps, self.size, self.fourcc, progress=progress,
+                                  reframe=self.reframe)
+        return engine.render()
+
+def find_projects(paths):
+    """ Returns the project files in the given paths (files, or directories that are searched non-recursively) """
+    projects = []
+    for path in paths:
+        if os.path.isdir(path):
+            projects.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                            if name.endswith(PROJECT_EXTENSIONS))
+        else:
+            projects.append(path)
+    return projects
+
+def render_project(path, output_dir, workers=1):
+    """ Loads and renders one project. Runs in a worker process when rendering a batch """
+    start = time.perf_counter()
+    project = Project.load(path, output_dir)
+    output_path = project.render(workers)
+    return output_path, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renders ShortsMaker projects without the GUI")
+    parser.add_argument("projects", nargs="+", help="project files, or directories of project files")
+    parser.add_argument("-o", "--output-dir", default="output",
+                        help="directory of the rendered videos, for projects that don't set their output")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: number of cores)")
+    args = parser.parse_args(argv)
+
+    projects = find_projects(args.projects)
+    if not projects:
+        print("no projects found", file=sys.stderr)
+        return 1
+
+    failed = 0
+    if len(projects) == 1:
+        # a single project uses every worker for its segments
+        try:
+            output_path, elapsed = render_project(projects[0], args.output_dir, args.workers)
+            print(f"{projects[0]} -> {output_path} ({elapsed:.1f}s)")
+        except Exception as e:
+            print(f"{projects[0]} failed: {e}", file=sys.stderr)
+            failed += 1
+        return 1 if failed else 0
+
+    # several projects are rendered concurrently, each one in a single process
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        futures = {executor.submit(render_project, path, args.output_dir): path for path in projects}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                output_path, elapsed = future.result()
+                print(f"{path} -> {output_path} ({elapsed:.1f}s)")
+            except Exception as e:
+                print(f"{path} failed: {e}", file=sys.stderr)
+                failed += 1
+
+    print(f"{len(projects) - failed}/{len(projects)} projects rendered")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Cold start of the editor, measured in the process being started (see bench_startup in benchmarks/suite.py,
+which runs it in fresh processes):
+    import_ms       importing the editor's modules (PyQt5 included)
+    window_ms       from the start of this script to the main window being shown and the media of the
+                    previous session restored, which is when the editor is interactive
+Prints the timings as one JSON line, with the heavy modules (cv2, numpy) that were loaded by then, which
+should be none: they are only imported when a video is first opened.
+
+Run from the root of the repository:
+    python -m benchmarks.startup
+"""
+import time
+start = time.perf_counter()
+
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import sys
+import json
+import importlib.util
+
+HEAVY_MODULES = ("cv2", "numpy")
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, root)
+    # the editor is the package at the root of the repository, loaded from its file as `python __init__.py` would
+    spec = importlib.util.spec_from_file_location("shortsmaker_main", os.path.join(root, "__init__.py"))
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
+    from PyQt5.QtWidgets import QApplication
+    imported = time.perf_counter()
+
+    app = QApplication(sys.argv[:1])
+    window = app_module.MainWindow()
+    window.show()
+    # the first pass paints the window, the second one runs the deferred session restore
+    app.processEvents()
+    app.processEvents()
+    shown = time.perf_counter()
+
+    print(json.dumps({
+        "import_ms": 1000 * (imported - start),
+        "window_ms": 1000 * (shown - start),
+        "restored_media": window.sidebar_content.media_list.count(),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+    }), flush=True)
+    # skips the teardown of Qt, which isn't part of the startup
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+Benchmark suite of the hot paths of the editor:
+    decode      Video.next_frame decode rate
+    seek        Video.previous_frame latency (stepping backwards, as with the Back button)
+    convert     FrameConverter.convert + VideoLabelWidget.update_image time per frame
+    snapping    VideoTrack.mouseMoveEvent cost with N clips on the timeline
+    timeline    TracksView zoom + redraw time
+    captures    playback of a split clip through the capture pool, and captures kept open over many sources
+    process     decoding in a thread and in a separate process: 4K delivery rate, GUI thread work during playback
+    startup     cold start of the editor, in fresh processes (see benchmarks/startup.py)
+Qt runs with the offscreen platform, so the suite also runs on machines without a display.
+Input videos are synthetic (see benchmarks/synthetic.py).
+
+Run from the root of the repository:
+    python -m benchmarks.suite                                   runs everything and prints the results
+    python -m benchmarks.suite -o results.json                   also writes the results to JSON
+    python -m benchmarks.suite --baseline baseline.json          compares with stored results, and exits with
+                                                                 status 1 if a metric regressed by more than
+                                                                 --tolerance (default 20%)
+    python -m benchmarks.suite --only decode seek                runs some of the benchmarks
+"""
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import platform
+import argparse
+import numpy as np
+import cv2
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QPointF
+from benchmarks.synthetic import synthetic_video
+
+def metric(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+def percentile(samples, q):
+    return float(np.percentile(np.asarray(samples), q))
+
+def bench_decode(args):
+    """ Decode rate of Video.next_frame over a whole synthetic video (best of a few runs, to filter out noise) """
+    from backend.video import Video
+    from backend.frame_cache import shared_frame_cache
+
+    results = {}
+    for width, height in ((1280, 720), (1920, 1080)):
+        path = synthetic_video(width, height, args.frames)
+        best = 0
+        for _ in range(min(args.repeat, 3)):
+            shared_frame_cache().clear()
+            video = Video(path)
+            decoded = 0
+            start = time.perf_counter()
+            while True:
+                ret, _ = video.next_frame()
+                if not ret:
+                    break
+                decoded += 1
+            best = max(best, decoded / (time.perf_counter() - start))
+        results[f"decode_{height}p_fps"] = metric(best, "fps", True)
+    return results
+
+def bench_seek(args):
+    """ Latency of Video.previous_frame, stepping backwards from the end of a video """
+    from backend.video import Video
+    from backend.frame_cache import shared_frame_cache
+
+    path = synthetic_video(1280, 720, args.frames)
+    shared_frame_cache().clear()
+    video = Video(path)
+    # builds the frame index before measuring (it is built once per file, then loaded from the cache)
+    video.frame_index(wait=True)
+    video.read_frame(video.total_frames - 1)
+
+    samples = []
+    for _ in range(min(args.frames - 2, 120)):
+        start = time.perf_counter()
+        ret, _ = video.previous_frame()
+        samples.append(time.perf_counter() - start)
+        if not ret:
+            break
+    return {
+        "seek_previous_mean_ms": metric(1000 * sum(samples) / len(samples), "ms", False),
+        "seek_previous_p95_ms": metric(1000 * percentile(samples, 95), "ms", False),
+    }
+
+def bench_convert(args):
+    """ Time to convert a 1080p frame to the label's size and show it in the VideoLabelWidget """
+    from backend.frame_converter import FrameConverter
+    from frontend.video_label import VideoLabelWidget
+
+    label = VideoLabelWidget()
+    label.resize(1280, 720)
+    label.show()
+    QApplication.processEvents()
+    converter = FrameConverter()
+    converter.set_target_size(label.width(), label.height())
+    label.frame_shown.connect(converter.release)
+
+    frame = np.random.default_rng(0).integers(0, 255, (1080, 1920, 3), dtype=np.uint8)
+    convert, update = [], []
+    for _ in range(args.repeat * 20):
+        start = time.perf_counter()
+        converted = converter.convert(frame)
+        middle = time.perf_counter()
+        label.update_image(converted)
+        end = time.perf_counter()
+        convert.append(middle - start)
+        update.append(end - middle)
+    label.close()
+    return {
+        "convert_1080p_ms": metric(1000 * percentile(convert, 50), "ms", False),
+        "update_image_ms": metric(1000 * percentile(update, 50), "ms", False),
+    }
+
+def populate(tracks_view, nclips, clip_seconds=10, slots=4):
+    """ Lays out nclips clips back to back over the given number of slots. Returns the clips """
+    while tracks_view.slots_manager.current_slots < slots:
+        tracks_view.slots_manager.addSlot()
+    nframes = clip_seconds * tracks_view.track_fps
+    return [tracks_view.slots_manager.addTrack(clip_seconds, i % slots, start=(i // slots) * (nframes + 15))
+            for i in range(nclips)]
+
+class MoveEvent:
+    """ The part of QGraphicsSceneMouseEvent used by VideoTrack.mouseMoveEvent (PyQt can't create scene events) """
+    def __init__(self, scene_pos, last_scene_pos):
+        self.scene_pos = scene_pos
+        self.last_scene_pos = last_scene_pos
+
+    def scenePos(self):
+        return self.scene_pos
+
+    def lastScenePos(self):
+        return self.last_scene_pos
+
+def bench_snapping(args):
+    """ Cost of one VideoTrack.mouseMoveEvent (position, snapping lookup and index update) with N clips """
+    from frontend.timeline import TracksView
+
+    results = {}
+    for nclips in args.clips:
+        tracks_view = TracksView()
+        tracks_view.create_slot_manager()
+        clips = populate(tracks_view, nclips)
+        rng = np.random.default_rng(0)
+        moved = tracks_view.clipItem(clips[len(clips) // 2])
+
+        moves = 2000
+        steps = rng.integers(-40, 40, moves)
+        start = time.perf_counter()
+        for step in steps:
+            # only the horizontal delta between the two positions matters, the track stays in its slot
+            moved.mouseMoveEvent(MoveEvent(QPointF(float(step), moved.y() + 1), QPointF(0, moved.y() + 1)))
+        elapsed = time.perf_counter() - start
+        results[f"snapping_{nclips}_clips_us"] = metric(1e6 * elapsed / moves, "us/move", False)
+        tracks_view.deleteLater()
+    return results
+
+def bench_timeline(args):
+    """ Time to change the zoom of a TracksView with many clips and redraw it, from fully zoomed out to frames """
+    from frontend.timeline import TracksView
+
+    tracks_view = TracksView()
+    tracks_view.create_slot_manager()
+    tracks_view.resize(1600, 300)
+    tracks_view.show()
+    populate(tracks_view, args.timeline_clips)
+    QApplication.processEvents()
+
+    zooms = [tracks_view.min_zoom * 2 ** i for i in range(0, 16, 3)]
+    samples = []
+    for _ in range(args.repeat):
+        for zoom in zooms:
+            start = time.perf_counter()
+            tracks_view.setZoom(zoom)
+            tracks_view.view.viewport().repaint()
+            samples.append(time.perf_counter() - start)
+    tracks_view.close()
+    return {
+        f"timeline_zoom_redraw_{args.timeline_clips}_clips_ms": metric(1000 * percentile(samples, 50), "ms", False),
+        # the zoomed out redraws, with every clip in view
+        f"timeline_zoom_redraw_{args.timeline_clips}_clips_p95_ms": metric(1000 * percentile(samples, 95), "ms",
+                                                                           False),
+    }
+
+def bench_captures(args):
+    """
+    Capture pool: timeline playback of a video split in half-second clips (each clip reads on from the
+    capture of the previous one, instead of opening the video and seeking), and the captures left open
+    after probing more videos than the pool keeps open
+    """
+    from backend.capture_pool import shared_capture_pool
+    from backend.export import ExportClip
+    from backend.timeline_source import TimelineSource
+    from backend.video_container import probe
+
+    pool = shared_capture_pool()
+    path = synthetic_video(1280, 720, args.frames)
+    part = 15
+    clips = [ExportClip(path, start, min(part, args.frames - start), source_start=start / 30)
+             for start in range(0, args.frames, part)]
+    best = 0
+    for _ in range(min(args.repeat, 3)):
+        pool.clear()
+        source = TimelineSource(clips, 30, (1280, 720))
+        start = time.perf_counter()
+        while source.next_frame()[0]:
+            pass
+        best = max(best, source.total_frames / (time.perf_counter() - start))
+        source.release()
+
+    pool.clear()
+    sources = 4 * pool.max_open
+    for i in range(sources):
+        probe(synthetic_video(160, 90, 10 + i))
+    open_captures = pool.stats()["open"]
+    pool.clear()
+    return {
+        "split_clips_playback_fps": metric(best, "fps", True),
+        f"captures_open_after_{sources}_sources": metric(open_captures, "captures", False),
+    }
+
+# the presentation loop of a VideoThread never exits, so the threads of the benchmarks are kept until the end
+_idle_threads = []
+
+def bench_process(args):
+    """
+    Decoding in a separate process (see backend/decode_process.py): rate at which the decoder delivers converted
+    4K frames, in a thread and in a process, and the time a fixed piece of Python work (like a drag on the
+    timeline) takes on the GUI thread while a two-slot timeline plays, with each decoder
+    """
+    from PyQt5.QtCore import QEventLoop, QTimer
+    from backend.video import Video, VideoThread
+    from backend.frame_buffer import DecodeAheadWorker
+    from backend.frame_converter import FrameConverter
+    from backend.frame_cache import shared_frame_cache
+    from backend.decode_process import DecodeProcess, ProcessDecodeWorker
+    from backend.timeline_source import TimelineSource
+    from backend.export import ExportClip
+    from frontend.video_label import VideoLabelWidget
+
+    def spin(ms):
+        loop = QEventLoop()
+        QTimer.singleShot(ms, loop.quit)
+        loop.exec_()
+
+    def release(frame):
+        # frees the buffer or the slot of the frame, as the video label does once it copied it
+        converter.release(frame)
+        process.release(frame)
+
+    def delivered_fps(worker):
+        worker.seek(0)
+        worker.start()
+        # the first frame waits for the decoder to start
+        release(worker.buffer.pop()[1])
+        frames = 0
+        start = time.perf_counter()
+        while True:
+            item = worker.buffer.pop()
+            if item is None:
+                break
+            release(item[1])
+            frames += 1
+        worker.stop()
+        return frames / (time.perf_counter() - start)
+
+    results = {}
+    path = synthetic_video(3840, 2160, min(args.frames, 120))
+    process = DecodeProcess()
+    best = {"thread": 0, "process": 0}
+    for _ in range(min(args.repeat, 2)):
+        shared_frame_cache().clear()
+        converter = FrameConverter()
+        converter.set_target_size(1280, 720)
+        best["thread"] = max(best["thread"], delivered_fps(DecodeAheadWorker(Video(path), converter=converter)))
+        best["process"] = max(best["process"], delivered_fps(ProcessDecodeWorker(process, Video(path), (1280, 720))))
+    process.close()
+    for mode, fps in best.items():
+        results[f"decode_2160p_{mode}_fps"] = metric(fps, "fps", True)
+
+    label = VideoLabelWidget()
+    label.resize(1280, 720)
+    label.show()
+    path = synthetic_video(1920, 1080, args.frames)
+    clips = [ExportClip(path, 0, args.frames, 0), ExportClip(path, 0, args.frames, 1, opacity=0.5, source_start=0.5)]
+    for mode in ("thread", "process"):
+        thread = VideoThread(use_decode_process=mode == "process")
+        thread.change_pixmap_signal.connect(label.update_image)
+        label.frame_shown.connect(thread.releaseFrame)
+        thread.setTargetSize(1280, 720)
+        thread.setCurrentVideo(TimelineSource(clips, 30, (1920, 1080), pool_size=thread.buffer_frames + 4), 0)
+        spin(1500)
+
+        samples = []
+        def work():
+            start = time.perf_counter()
+            sum(i * i for i in range(20000))
+            samples.append(time.perf_counter() - start)
+        timer = QTimer()
+        timer.setInterval(5)
+        timer.timeout.connect(work)
+        thread.pause_resume()
+        timer.start()
+        spin(min(args.frames * 1000 // 30 - 500, 5000))
+        timer.stop()
+        if thread.running:
+            thread.pause_resume()
+        if thread.decode_process is not None:
+            thread.decode_process.close()
+        _idle_threads.append(thread)
+        results[f"gui_work_during_playback_{mode}_p95_ms"] = metric(1000 * percentile(samples, 95), "ms", False)
+    label.close()
+    return results
+
+def bench_startup(args):
+    """
+    Cold start of the editor: each run is a fresh process (see benchmarks/startup.py), with a home folder
+    whose media cache holds a few videos, so restoring the previous session is part of the startup
+    """
+    from backend.media_cache import MediaCache
+
+    home = tempfile.mkdtemp(prefix="shortsmaker_startup_")
+    cache = MediaCache(os.path.join(home, ".cache", "ShortsMaker", "media.json"))
+    for frames in (args.frames, args.frames + 1, args.frames + 2):
+        cache.put(synthetic_video(640, 360, frames), (frames, 30.0, frames / 30))
+    cache.save()
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+
+    process, window, imports = [], [], []
+    try:
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-m", "benchmarks.startup"], env=env, capture_output=True,
+                                    text=True, check=True).stdout
+            process.append(time.perf_counter() - start)
+            result = json.loads(output.strip().splitlines()[-1])
+            window.append(result["window_ms"])
+            imports.append(result["import_ms"])
+            if result["heavy_modules"]:
+                print(f"startup: {', '.join(result['heavy_modules'])} imported before the window was shown",
+                      file=sys.stderr)
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    return {
+        "startup_process_ms": metric(1000 * percentile(process, 50), "ms", False),
+        "startup_window_ms": metric(percentile(window, 50), "ms", False),
+        "startup_import_ms": metric(percentile(imports, 50), "ms", False),
+    }
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "seek": bench_seek,
+    "convert": bench_convert,
+    "snapping": bench_snapping,
+    "timeline": bench_timeline,
+    "captures": bench_captures,
+    "process": bench_process,
+    "startup": bench_startup,
+}
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results with a baseline. Returns the rows (name, baseline, current, change, regressed) of the
+    metrics present in both. A metric regressed if it is worse than the baseline by more than tolerance
+    """
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or not previous["value"]:
+            continue
+        change = current["value"] / previous["value"] - 1
+        worse = -change if current["higher_is_better"] else change
+        rows.append((name, previous["value"], current["value"], change, worse > tolerance))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the decode, seek, conversion and timeline hot paths")
+    parser.add_argument("-o", "--output", help="writes the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging a regression")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--frames", type=int, default=300, help="frames of the synthetic videos")
+    parser.add_argument("--clips", type=int, nargs="+", default=[100, 1000, 5000, 20000], help="clip counts for snapping")
+    parser.add_argument("--timeline-clips", type=int, default=500, help="clips on the timeline for the redraw")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of the short benchmarks")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        start = time.perf_counter()
+        results.update(BENCHMARKS[name](args))
+        print(f"{name} done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    print(f"{'metric':<40} {'value':>12} unit")
+    for name, result in results.items():
+        print(f"{name:<40} {result['value']:>12.3f} {result['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": platform.python_version(),
+                    "opencv": cv2.__version__,
+                    "machine": platform.machine(),
+                    "cpus": os.cpu_count(),
+                },
+                "results": results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\n{'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+        for name, previous, current, change, regressed in rows:
+            print(f"{name:<40} {previous:>12.3f} {current:>12.3f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+        if any(row[4] for row in rows):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
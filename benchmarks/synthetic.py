@@ -0,0 +1,42 @@
+"""
+Synthetic test videos for the benchmarks, generated locally with cv2.VideoWriter.
+The content is deterministic (moving gradients, a moving shape and seeded noise, so the encoder can't
+compress frames to nothing), and videos are cached by their parameters, so runs compare the same input.
+"""
+import os
+import tempfile
+import numpy as np
+import cv2
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "shortsmaker_benchmarks")
+
+def synthetic_video(width=1280, height=720, frames=300, fps=30, fourcc="mp4v", seed=0):
+    """ Returns the path of a synthetic video with the given parameters, generating it if needed """
+    extension = ".avi" if fourcc == "MJPG" else ".mp4"
+    path = os.path.join(CACHE_DIR, f"synthetic_{width}x{height}_{frames}f_{fps}fps_{fourcc}_{seed}{extension}")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = path + ".part" + extension
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 24, (height, width, 3), dtype=np.uint8)
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+
+    writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+    try:
+        for i in range(frames):
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[..., 0] = (x + i * 2) % 256
+            frame[..., 1] = (y + i * 3) % 256
+            frame[..., 2] = (x + y + i) % 256
+            cv2.add(frame, np.roll(noise, i * 7, axis=1), dst=frame)
+            cx = int((i * 11) % width)
+            cv2.circle(frame, (cx, height // 2), height // 8, (255, 255, 255), -1)
+            cv2.putText(frame, str(i), (20, height - 20), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 4)
+            writer.write(frame)
+    finally:
+        writer.release()
+    os.replace(tmp_path, path)
+    return path
@@ -1,6 +1,12 @@
 from PyQt5.QtCore import QSize, Qt
 from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QWidget, QPushButton, QStackedWidget, QLabel, QVBoxLayout, QFileDialog, QToolButton
+from PyQt5.QtWidgets import QWidget, QPushButton, QStackedWidget, QLabel, QVBoxLayout, QFileDialog, QToolButton, \
+                            QProgressBar, QListWidget, QListWidgetItem, QCheckBox
+import os
+import logging
+from backend.proxy import ProxyState
+
+logger = logging.getLogger(__name__)
 
 class MySidebar(QWidget):
     def __init__(self, parent=None):
@@ -43,15 +49,61 @@ class SidebarContent(QStackedWidget):
         self.tracks_view = tracks_view
 
         #self.setFixedSize(int(0.2 * self.video.display_width), int(0.7 * self.video.display_height))
-        self.content_options = QLabel("Options")
+        self.content_options = QLabel()
         self.content_media = QLabel()
         self.content_audio = QLabel("Audio")
 
         self.import_video_btn = QPushButton("Import Video")
         self.import_video_btn.clicked.connect(self.import_video)
 
+        # progress of the background import, only visible while importing
+        self.import_progress = QProgressBar()
+        self.import_progress.setVisible(False)
+        self.cancel_import_btn = QPushButton("Cancel Import")
+        self.cancel_import_btn.setVisible(False)
+
+        importer = self.video_player.importer
+        self.cancel_import_btn.clicked.connect(importer.cancel)
+        importer.imported.connect(self.video_imported)
+        importer.failed.connect(self.video_failed)
+        importer.progress.connect(self.import_progressed)
+        importer.finished.connect(self.import_finished)
+        # videos of the previous session only come back to the media list, not to the timeline
+        importer.restored.connect(lambda id, length, video_path: self.add_media_item(video_path))
+
+        # imported videos, with the state of their proxies. Double clicking a video plays it
+        self.media_list = QListWidget()
+        self.media_items = {}
+        self.media_list.itemDoubleClicked.connect(lambda item: self.video_player.playVideo(item.data(Qt.UserRole)))
+        self.video_player.proxies.proxyStateChanged.connect(self.proxy_state_changed)
+
+        self.use_proxies_box = QCheckBox("Use proxies for playback")
+        self.use_proxies_box.setChecked(self.video_player.proxies.enabled)
+        self.use_proxies_box.toggled.connect(self.use_proxies_toggled)
+
+        # playback instrumentation: timing probes with an overlay on the video, and trace export
+        self.profiling_box = QCheckBox("Performance overlay")
+        self.profiling_box.toggled.connect(self.video_player.setProfiling)
+        self.export_trace_btn = QPushButton("Export Trace")
+        self.export_trace_btn.clicked.connect(self.export_trace)
+        # decoding in a separate process keeps the editor responsive while playing large videos
+        self.decode_process_box = QCheckBox("Decode in a separate process")
+        self.decode_process_box.setChecked(self.video_player.thread.use_decode_process)
+        self.decode_process_box.toggled.connect(self.video_player.setDecodeProcess)
+
+        self.content_options_layout = QVBoxLayout()
+        self.content_options_layout.addWidget(self.profiling_box)
+        self.content_options_layout.addWidget(self.export_trace_btn)
+        self.content_options_layout.addWidget(self.decode_process_box)
+        self.content_options_layout.addStretch()
+        self.content_options.setLayout(self.content_options_layout)
+
         self.content_media_layout = QVBoxLayout()
         self.content_media_layout.addWidget(self.import_video_btn)
+        self.content_media_layout.addWidget(self.import_progress)
+        self.content_media_layout.addWidget(self.cancel_import_btn)
+        self.content_media_layout.addWidget(self.media_list)
+        self.content_media_layout.addWidget(self.use_proxies_box)
         self.content_media.setLayout(self.content_media_layout)
 
         content_style = """
@@ -76,14 +128,78 @@ class SidebarContent(QStackedWidget):
 
     def import_video(self):
         """
-        This function opens a File Dialog for the user to select the video, and after the user selects the video,
-        the track with the video is added to the TracksView object
+        This function opens a File Dialog for the user to select one or more videos. The selected videos are
+        probed in the background, and the track of each video is added to the TracksView object as soon as
+        its probe completes
         """
         options = QFileDialog.Options()
-        video_path, _ = QFileDialog.getOpenFileName(self, "Import Video", "", "Video Files (*.mp4 *.avi *.mkv *.mov);;All Files (*)", options=options)
-        if video_path:
-            # adds to the video player the video with the given path. Gets the id and length of the created video
-            id, length = self.video_player.addVideo(video_path)
+        video_paths, _ = QFileDialog.getOpenFileNames(self, "Import Video", "", "Video Files (*.mp4 *.avi *.mkv *.mov);;All Files (*)", options=options)
+        if video_paths:
+            self.import_progress.setRange(0, len(video_paths))
+            self.import_progress.setValue(0)
+            self.import_progress.setVisible(True)
+            self.cancel_import_btn.setVisible(True)
+
+            self.video_player.importVideos(video_paths)
+
+    def export_trace(self):
+        """
+        Saves the timings recorded while the performance overlay was on, as a trace file for chrome://tracing or Perfetto
+        """
+        path, _ = QFileDialog.getSaveFileName(self, "Export Trace", "trace.json", "Trace Files (*.json)")
+        if path:
+            self.video_player.exportTrace(path)
+
+    def video_imported(self, id, length, video_path):
+        # Adds a track to the tracks view section of the gui with duration 'length'
+        self.tracks_view.addTrack(length, source_path=video_path)
+        self.add_media_item(video_path)
+
+    def media_item(self, video_path):
+        # Returns the entry of the video in the media list, adding it if there is none
+        item = self.media_items.get(video_path)
+        if item is None:
+            item = QListWidgetItem()
+            item.setData(Qt.UserRole, video_path)
+            self.media_list.addItem(item)
+            self.media_items[video_path] = item
+        return item
+
+    def add_media_item(self, video_path):
+        # Adds the video to the media list. The entry may be left from an import of the video that failed
+        self.media_item(video_path).setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+        self.proxy_state_changed(video_path, self.video_player.proxies.state(video_path), 0)
+
+    def proxy_state_changed(self, video_path, state, progress):
+        item = self.media_items.get(video_path)
+        if item is None:
+            return
+        if state == ProxyState.GENERATING:
+            state = f"generating {progress}%"
+        item.setText(f"{os.path.basename(video_path)}  [proxy: {state}]")
+
+    def use_proxies_toggled(self, checked):
+        proxies = self.video_player.proxies
+        proxies.enabled = checked
+        for video_path, item in self.media_items.items():
+            if not item.flags() & Qt.ItemIsEnabled:
+                # videos that failed to import have no proxy
+                continue
+            if checked:
+                proxies.generate(video_path)
+            self.proxy_state_changed(video_path, proxies.state(video_path) if checked else "off", 0)
+
+    def video_failed(self, video_path):
+        logger.warning("could not import %s", video_path)
+        # the video is listed as failed (and can't be played) until an import of it succeeds
+        item = self.media_item(video_path)
+        item.setFlags(Qt.NoItemFlags)
+        item.setText(f"{os.path.basename(video_path)}  [could not import]")
+
+    def import_progressed(self, done, total):
+        self.import_progress.setRange(0, total)
+        self.import_progress.setValue(done)
 
-            # Adds a track to the tracks view section of the gui with duration 'length'
-            self.tracks_view.addTrack(length)
\ No newline at end of file
+    def import_finished(self):
+        self.import_progress.setVisible(False)
+        self.cancel_import_btn.setVisible(False)
\ No newline at end of file
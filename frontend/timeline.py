@@ -1,10 +1,17 @@
 
+from bisect import bisect_left, bisect_right
 from PyQt5.QtWidgets import QWidget, QGraphicsSceneMouseEvent, QStyleOptionGraphicsItem, \
-                            QVBoxLayout, QHBoxLayout, QPushButton, QGraphicsRectItem, \
-                            QGraphicsPathItem, QGraphicsScene, QGraphicsView, QGraphicsTextItem
-from PyQt5.QtGui import QPen, QBrush, QColor, QPainterPath, QFont, QPainter
-from PyQt5.QtCore import Qt, QRectF
-import time
+                            QVBoxLayout, QHBoxLayout, QPushButton, \
+                            QGraphicsPathItem, QGraphicsScene, QGraphicsView, QComboBox
+from PyQt5.QtGui import QPen, QBrush, QColor, QPainterPath, QFont, QPainter, QStaticText, QImage
+from PyQt5.QtCore import Qt, QRectF, QPointF, QTimer
+from backend.video_container import IntervalTree
+from backend.edge_index import EdgeIndex
+from backend.thumbnails import ThumbnailCache
+from backend.scene_cuts import SceneCutManager
+from backend.export import ExportClip
+from backend.project_file import ProjectData, ProjectAutosave, load_project
+from backend.clip_model import TimelineClip, TimelineHistory
 
 class EditVideo(QWidget):
     """
@@ -32,11 +39,37 @@ class EditVideo(QWidget):
         self.add_slot_button = QPushButton('Add Slot')
         #self.add_slot_button.clicked.connect(self.tracks.slots_manager.addSlot)
 
+        self.play_timeline_button = QPushButton('Play Timeline')
+
+        self.undo_button = QPushButton('Undo')
+        self.redo_button = QPushButton('Redo')
+
+        # splits the selected clip (or every clip, if none is selected) at its detected scene cuts
+        self.split_cuts_button = QPushButton('Split at Cuts')
+
+        # output format of the timeline: the source aspect ratio, or vertical (9:16) for Shorts
+        self.format_box = QComboBox()
+        self.format_box.addItems(['Original', '9:16 Center', '9:16 Follow Motion'])
+
+        self.export_button = QPushButton('Export')
+
+        # the timeline is saved to a project file, and every edit after that is saved to it automatically
+        self.save_project_button = QPushButton('Save Project')
+        self.open_project_button = QPushButton('Open Project')
+
         layout_buttons.setContentsMargins(0,0,0,0)
         layout_buttons.addWidget(self.pause_resume_button)
         layout_buttons.addWidget(self.back_button)
         layout_buttons.addWidget(self.front_button)
         layout_buttons.addWidget(self.add_slot_button)
+        layout_buttons.addWidget(self.play_timeline_button)
+        layout_buttons.addWidget(self.undo_button)
+        layout_buttons.addWidget(self.redo_button)
+        layout_buttons.addWidget(self.split_cuts_button)
+        layout_buttons.addWidget(self.format_box)
+        layout_buttons.addWidget(self.export_button)
+        layout_buttons.addWidget(self.save_project_button)
+        layout_buttons.addWidget(self.open_project_button)
 
         main_layout.setContentsMargins(0,0,0,0)
         main_layout.addLayout(layout_buttons)
@@ -44,85 +77,98 @@ class EditVideo(QWidget):
 
         self.setLayout(main_layout)
 
-class VideoTrackSlot(QGraphicsRectItem):
+class VideoTrackSlot:
     """
-    Represents a video slot in TrackView's scene
+    Represents a video slot in TrackView's scene.
+    Slots aren't graphics items: TimelineView draws their visible part in its background
     """
     def __init__(self, id, x, y, width, height, tracks_view):
-        super().__init__(x,y,width,height)
         self.x = x
         self.y = y
         self.width = width
         self.height = height
         self.slot_id = id
-        self.tracks = []
+        # clips in this slot, a set so that removing one doesn't scan the others
+        self.tracks = set()
         self.tracks_view = tracks_view
 
-        # We set the Z level of the track slots
-        # We want the track rectangles to be drawn on top of the track slots
-        # That's why we assign a lower z value to the slots
-        self.setZValue(0)
+        # Sorted start and end frames of the clips in this slot, used for snapping (and the level of detail bars)
+        self.starts = EdgeIndex()
+        self.ends = EdgeIndex()
+
+    def addTrack(self, seconds, source_path=None, source_start=0, start=0):
+        """
+        Adds a clip to the current slot
+        seconds -> length of the clip in seconds
+        source_path -> path of the video of the clip
+        source_start -> frame of the source where the clip starts
+        start -> frame of the timeline where the clip starts
+        """
+        nframes = round(self.tracks_view.track_fps * seconds)
+        clip = TimelineClip(self.tracks_view.newClipId(), source_path, self.slot_id, start, nframes, source_start)
+        self.tracks.add(clip)
+
+        #returns the clip
+        return clip
 
-    def addTrack(self, seconds):
+    def updateEdges(self, clip, start, end):
         """
-        Adds a Video Track to the current slot
-        seconds -> length of the track in seconds
+        Updates the start and end frames of a clip in the snapping index of this slot
         """
-        vt = VideoTrack(seconds, self.x, self.y, self.tracks_view)
-        self.tracks.append(vt)
+        self.starts.move(clip, start)
+        self.ends.move(clip, end)
 
-        #returns the rectangle in VideoTrack
-        return vt
+    def removeTrack(self, clip):
+        """
+        Removes a clip from the current slot
+        """
+        self.tracks.discard(clip)
+        self.starts.remove(clip)
+        self.ends.remove(clip)
+
+    def clear(self):
+        """
+        Removes every clip from the current slot
+        """
+        self.tracks = set()
+        self.starts = EdgeIndex()
+        self.ends = EdgeIndex()
 
 """
 Class TrackRectangle
-Rectangle that represents the track visually
+Rectangle that represents a clip visually
 We extend from QGraphicsPathItem so that we can override the function mouseMoveEvent, and make it
 so that the rectangle can only be moved laterally, and not vertically.
+Only the clips near the visible part of the timeline have one: TracksView binds the items to the clips
+as the view is scrolled or zoomed, and reuses the items of the clips that went out of view.
 """
 class VideoTrack(QGraphicsPathItem):
     base_snap_threshold = 10 # base threshold for two tracks to snap together
     base_unsnap_threshold  = 10 # base threshold for two tracks to unsnap
 
-    def __init__(self, duration, x0, y0, tracks_view):
+    # BGR888 lets Qt read the cached thumbnails directly (Qt >= 5.14)
+    thumbnail_format = QImage.Format_BGR888 if hasattr(QImage, "Format_BGR888") else None
 
-        self.duration = duration
-        self.start_time = 0
+    border_roundness = 10
+
+    def __init__(self, tracks_view):
+        super().__init__()
 
         # Initializes the "pointer" to the TracksView object received as argument
         self.tracks_view = tracks_view
-
-        # Initializes the number of frames of this video track rectangle
-        self.nframes = round(self.tracks_view.track_fps * duration)
-        
-        border_roundness = 10
-        # Create a QPainterPath object
-        path = QPainterPath()
-        # Add a rounded rectangle to the path
-        path.addRoundedRect(QRectF(0, 0, self.nframes, self.tracks_view.track_height), border_roundness, border_roundness)
-        super().__init__(path)
-
-        # We set the position of the rectangle to the coordinates passed in the constructor
-        self.setPos(x0, y0)
+        # clip shown by the item
+        self.clip = None
 
         # We set the Z value of the track rectangles to be higher than the slots
         self.setZValue(1)
 
-
         # is_clicked variable defines if the user is click holding the track
         self.is_clicked = False
-        # snapped variable defined the track that the current track is snapped to
-        self.snapped = None
-        #sets the current rectangle as a movable item
-        self.setFlag(QGraphicsPathItem.ItemIsMovable)
 
         # is_clicked brush
         self.clicked_brush = QBrush(QColor("yellow").darker(180)) # yellow 80% darker
         # not clicked brush
         self.not_clicked_brush = QBrush(QColor("black")) # Set fill color to black
-        
-        self.new_x = self.x()
-        self.new_y = self.y()
 
         pen = QPen(QColor("yellow"))  # Set outline color to yellow
         pen.setWidth(10)  # Set the outline width
@@ -130,7 +176,26 @@ class VideoTrack(QGraphicsPathItem):
 
         self.setBrush(self.not_clicked_brush)  # Apply the fill settings
 
+        # scene cut markers
+        self.cut_pen = QPen(QColor("red"))
+        self.cut_pen.setWidth(2)
+        self.cut_pen.setCosmetic(True)
+
+        #sets the current rectangle as a movable item
         self.setFlag(QGraphicsPathItem.ItemIsMovable)
+        # gives paint() the exposed rectangle, so only the visible thumbnails are drawn
+        self.setFlag(QGraphicsPathItem.ItemUsesExtendedStyleOption)
+
+    def bind(self, clip):
+        """ Shows the given clip with this item """
+        self.clip = clip
+        path = QPainterPath()
+        path.addRoundedRect(QRectF(0, 0, clip.nframes, self.tracks_view.track_height), self.border_roundness,
+                            self.border_roundness)
+        self.setPath(path)
+        self.setPos(clip.start, self.tracks_view.slots_manager.slots[clip.slot].y)
+        self.new_x = self.x()
+        self.new_y = self.y()
 
     @property
     def SNAP_THRESHOLD(self):
@@ -149,30 +214,84 @@ class VideoTrack(QGraphicsPathItem):
     def mousePressEvent(self, event: QGraphicsSceneMouseEvent) -> None:
         #sets is_clicked flag to True
         self.is_clicked = True
-        # updates the visual of the rectangle (calls paint)
-        self.update()
-        
+        # the last clicked clip is the target of the timeline actions (like splitting at cuts)
+        self.tracks_view.selected_clip = self.clip
+        # The rectangle's inner color is light yellow while it's held by the user (setBrush repaints it)
+        self.setBrush(self.clicked_brush)
+
         return super().mousePressEvent(event)
     
     def mouseReleaseEvent(self, event: QGraphicsSceneMouseEvent) -> None:
         #sets is_clicked flag to False
         self.is_clicked = False
-        # updates the visual of the rectangle (calls paint)
-        self.update()
+        # the move is saved once, where the track was dropped, and is one step of the undo history
+        self.tracks_view.recordClip(self.clip)
+        self.tracks_view.commitEdit("move")
+        # and black again once dropped
+        self.setBrush(self.not_clicked_brush)
+        # the clip may have been dropped out of view
+        self.tracks_view.scheduleRefresh()
 
         return super().mouseReleaseEvent(event)
     
     def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget | None = ...) -> None:
-        # The rectangle's inner color is light yellow when it's being held by the user,
-        # and it is black when not held
-        if self.is_clicked:
-            self.setBrush(self.clicked_brush)
-        else:
-            self.setBrush(self.not_clicked_brush)
+        super().paint(painter, option, widget)
+
+        if self.clip.source_path:
+            self.paintThumbnails(painter, option)
+        if self.clip.cuts:
+            self.paintCuts(painter, option)
 
-        return super().paint(painter, option, widget)
+    def paintThumbnails(self, painter: QPainter, option: QStyleOptionGraphicsItem) -> None:
+        """
+        Draws the filmstrip of the track. Only thumbnails that are already cached are drawn, the missing ones
+        are requested from the background workers, and the track is repainted when they are ready
+        """
+        clip = self.clip
+        thumbnails = self.tracks_view.thumbnails
+        # pixels per frame on screen
+        zoom = painter.worldTransform().m11()
+        step = thumbnails.level_step(zoom, thumbnails.width)
+
+        exposed = option.exposedRect
+        # thumbnails are aligned on frames of the source, which starts source_start frames before the track
+        frame = max(int(exposed.left() + clip.source_start) // step * step, clip.source_start)
+        last = min(exposed.right(), clip.nframes) + clip.source_start
+        # thumbnails are drawn at their size in pixels, whatever the zoom
+        width = thumbnails.width / zoom
+        y = (self.tracks_view.track_height - thumbnails.height) / 2
+
+        painter.save()
+        painter.setClipPath(self.path(), Qt.IntersectClip)
+        missing = []
+        while frame < last:
+            thumbnail = thumbnails.get(clip.source_path, frame)
+            if thumbnail is None:
+                missing.append(frame)
+            else:
+                image = QImage(thumbnail.data, thumbnails.width, thumbnails.height, thumbnails.width * 3,
+                               self.thumbnail_format or QImage.Format_RGB888)
+                if self.thumbnail_format is None:
+                    image = image.rgbSwapped()
+                painter.drawImage(QRectF(frame - clip.source_start, y, width, thumbnails.height), image)
+            frame += step
+        painter.restore()
+
+        if missing:
+            thumbnails.request(clip.source_path, missing)
+
+    def paintCuts(self, painter: QPainter, option: QStyleOptionGraphicsItem) -> None:
+        """ Draws a marker at each scene cut of the track inside the exposed rectangle """
+        cuts = self.clip.cuts
+        exposed = option.exposedRect
+        first = bisect_left(cuts, exposed.left())
+        last = bisect_right(cuts, exposed.right())
+        painter.setPen(self.cut_pen)
+        for cut in cuts[first:last]:
+            painter.drawLine(QPointF(cut, 0), QPointF(cut, self.tracks_view.track_height))
     
     def mouseMoveEvent(self, event: QGraphicsSceneMouseEvent) -> None:
+        clip = self.clip
         new_pos = event.scenePos() 
         old_pos = event.lastScenePos()
         dx = new_pos.x() - old_pos.x() # change in x (delta)
@@ -200,80 +319,248 @@ class VideoTrack(QGraphicsPathItem):
             self.new_x = 0
             self.current_frame = 0
         #elif self.new_x + self.boundingRect().width() > self.scene().sceneRect().width():
-        elif self.current_frame + self.nframes >= self.tracks_view.max_frames:
+        elif self.current_frame + clip.nframes >= self.tracks_view.max_frames:
             # since the track can't go out of the scene, this includes to the right of the scene
             # so we check if the rightmost edge of the rectangle goes out of scope
             # self.new_x = self.scene().sceneRect().width() - self.boundingRect().width()
-            self.new_x = self.tracks_view.max_frames - self.nframes - 1
-            self.current_frame = self.tracks_view.max_frames - self.nframes - 1
-        if self.snapped:
-            # if the track is snapped to another track, we check if the new_x value is enough to unsnap
-            snapped_track = self.snapped
-
-            current_track_start = self.current_frame # start of current track
-            current_track_end = self.current_frame + self.nframes # end of current track
+            self.new_x = self.tracks_view.max_frames - clip.nframes - 1
+            self.current_frame = self.tracks_view.max_frames - clip.nframes - 1
+        # start and end x of the current track
+        current_track_start = self.current_frame
+        current_track_end = self.current_frame + clip.nframes
 
-            neighbor_track_start = snapped_track.x() # start of neighbor track
-            neighbor_track_end = snapped_track.x() + snapped_track.nframes # end of neighbor track
+        if clip.snapped:
+            # if the track is snapped, we check if the new_x value is enough to unsnap
+            snapped_track = clip.snapped
 
             # if the distance between the two is above the unsnap threshold, we unsnap them
-            if abs(current_track_start - neighbor_track_end) > self.UNSNAP_THRESHOLD and abs(current_track_end - neighbor_track_start) > self.UNSNAP_THRESHOLD:
-                self.unsnap()
+            if abs(current_track_start - clip.snap_frame) > self.UNSNAP_THRESHOLD and abs(current_track_end - clip.snap_frame) > self.UNSNAP_THRESHOLD:
+                clip.unsnap()
                 snapped_track.unsnap()
                 self.setPos(self.current_frame, self.y())
         else:
-            # if the track isn't snapped to any track, we check among the other tracks if it is within distance
-            # to being snapped
-            snapPosition = None
-
-            # We iterate through all neighbor tracks, to check if the current track is withing snapping distance
-            for neighbor_track in self.scene().items():
-                if neighbor_track == self or not isinstance(neighbor_track, type(self)):
-                    continue
-                
-                # start and end x of the current track
-                current_track_start = self.current_frame
-                current_track_end = self.current_frame + self.nframes
-
-                # start and end x of the neighbor track
-                neighbor_track_start = neighbor_track.x()
-                neighbor_track_end = neighbor_track.x() + neighbor_track.nframes
-                
-                # snap beggining of current track to end of neighbor track
-                threshold = self.SNAP_THRESHOLD
-                if abs(current_track_start - neighbor_track_end) < self.SNAP_THRESHOLD:
-                    snapPosition = neighbor_track_end
-                    self.snap(neighbor_track)
-                    neighbor_track.snap(self)
-                    break
-                # snap end of current track to beggining of neighbor track
-                elif abs(current_track_end - neighbor_track_start) < self.SNAP_THRESHOLD:
-                    snapPosition = neighbor_track_start - self.nframes
-                    self.snap(neighbor_track)
-                    neighbor_track.snap(self)
-                    break
-            if snapPosition is not None:
+            # if the track isn't snapped to any track, we look up the nearest edge of another track
+            # within snapping distance. This is a binary search on sorted edges
+            snap = self.tracks_view.findSnap(clip, current_track_start, current_track_end, self.SNAP_THRESHOLD)
+
+            if snap is not None:
+                snapPosition, snap_frame, target = snap
+                clip.snap(target, snap_frame)
+                target.snap(clip, snap_frame)
                 self.setPos(snapPosition, self.y())
             else:
                 self.setPos(self.current_frame, self.y())
-        
-        seconds = self.x() / self.tracks_view.track_fps
-        self.start_time = seconds
 
-    def snap(self, other_track):
-        # Defines the track that self is snapped to
-        self.snapped = other_track
-    
-    def unsnap(self):
-        # Unsnaps the current track with whatever track it had
-        self.snapped = None
+        # keeps the clip, and the clip index of the timeline, up to date with the new position
+        self.tracks_view.moveClip(clip, round(self.x()), new_slot.slot_id)
+
+class TimelineView(QGraphicsView):
+    """
+    Graphics view of the TracksView scene, with a time ruler on top.
+    The ruler is painted in the view's foreground, in viewport coordinates, and only for the visible
+    range of frames. Tick labels are pre-laid-out QStaticText objects, cached by their text, and the
+    tick interval is picked from the zoom level, so repainting it is cheap enough for every scroll and zoom.
+    """
+    ruler_height = 24
+    # minimum distance in pixels between two labelled ticks
+    min_label_spacing = 90
+    # tick intervals, in seconds
+    tick_intervals = [1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600]
+    max_cached_labels = 1024
+    # clips less than this many pixels apart are drawn as one bar by the level of detail rendering
+    lod_merge_pixels = 4
+
+    def __init__(self, scene, tracks_view):
+        super().__init__(scene)
+        self.tracks_view = tracks_view
+        self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+
+        self.label_cache = {}
+        self.label_font = QFont("Arial", 8)
+        self.background_brush = QBrush(QColor(40, 40, 40))
+        self.tick_pen = QPen(QColor(200, 200, 200))
+        self.tick_pen.setCosmetic(True)
+        self.slot_pen = QPen(QColor("black"))
+        self.slot_pen.setCosmetic(True)
+        self.lod_pen = QPen(QColor("yellow"))
+        self.lod_pen.setWidth(2)
+        self.lod_pen.setCosmetic(True)
+        self.lod_brush = QBrush(QColor("black"))
+        # merged clips of each slot, by the zoom level they were merged at
+        self.lod_bars = {}
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        # scrolling only repaints the exposed area, but the ruler is drawn at a fixed place of the viewport
+        self.viewport().update(0, 0, self.viewport().width(), self.ruler_height)
+        self.tracks_view.refreshItems()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.tracks_view.refreshItems()
+
+    def lodBars(self):
+        """
+        Returns the clips of each slot merged into bars, as a (starts, ends) pair of sorted lists per slot.
+        Clips closer than lod_merge_pixels at the current zoom are one bar. The bars of each zoom level are
+        kept until the clips change
+        """
+        zoom = self.transform().m11()
+        bars = self.lod_bars.get(zoom)
+        if bars is None:
+            gap = self.lod_merge_pixels / zoom
+            bars = self.lod_bars[zoom] = []
+            for slot in self.tracks_view.slots_manager.slots:
+                starts, ends = [], []
+                bar_start = bar_end = None
+                # the start edges of a slot are its clips sorted by start frame
+                for start, clip in zip(slot.starts.frames, slot.starts.owners):
+                    end = start + clip.nframes
+                    if bar_end is not None and start - bar_end <= gap:
+                        if end > bar_end:
+                            bar_end = end
+                    else:
+                        if bar_end is not None:
+                            starts.append(bar_start)
+                            ends.append(bar_end)
+                        bar_start, bar_end = start, end
+                if bar_end is not None:
+                    starts.append(bar_start)
+                    ends.append(bar_end)
+                bars.append((starts, ends))
+        return bars
+
+    def lodClipAt(self, pos):
+        """
+        Returns the clip drawn under the given scene position by the level of detail bars, or None.
+        Clips within half the merge distance count as under it, since bars are at least a pixel wide
+        """
+        for slot in self.tracks_view.slots_manager.slots:
+            if slot.y <= pos.y() < slot.y + self.tracks_view.track_height:
+                break
+        else:
+            return None
+        tolerance = self.lod_merge_pixels / self.transform().m11() / 2
+        entries = [entry for entry in self.tracks_view.clip_index.overlapping(pos.x() - tolerance, pos.x() + tolerance)
+                   if entry[2] == slot.slot_id]
+        if not entries:
+            return None
+        # the clip nearest to the cursor, when several share the pixel
+        return min(entries, key=lambda entry: max(entry[0] - pos.x(), pos.x() - entry[1], 0))[3]
+
+    def mousePressEvent(self, event):
+        if self.tracks_view.lod and self.tracks_view.slots_manager is not None:
+            # clips drawn as bars have no item, the clicked one is given one before the scene handles the press,
+            # so it can be selected and dragged like in the detailed view
+            clip = self.lodClipAt(self.mapToScene(event.pos()))
+            if clip is not None:
+                self.tracks_view.clipItem(clip)
+                self.tracks_view.selected_clip = clip
+        super().mousePressEvent(event)
+
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        slots_manager = self.tracks_view.slots_manager
+        if slots_manager is None:
+            return
+
+        painter.save()
+        painter.setPen(self.slot_pen)
+        painter.setBrush(Qt.NoBrush)
+        for slot in slots_manager.slots:
+            painter.drawRect(QRectF(slot.x, slot.y, slot.width, slot.height))
+
+        if self.tracks_view.lod:
+            # too many clips in view to give each one an item, they are drawn as bars of at least one pixel
+            min_width = 1 / self.transform().m11()
+            painter.setPen(self.lod_pen)
+            painter.setBrush(self.lod_brush)
+            for slot, (starts, ends) in zip(slots_manager.slots, self.lodBars()):
+                i = bisect_right(ends, rect.left())
+                while i < len(starts) and starts[i] < rect.right():
+                    painter.drawRect(QRectF(starts[i], slot.y, max(ends[i] - starts[i], min_width),
+                                            self.tracks_view.track_height))
+                    i += 1
+        painter.restore()
+
+    def tickInterval(self):
+        """
+        Returns the interval (in frames) between labelled ticks, and the number of subdivisions between them
+        """
+        fps = self.tracks_view.track_fps
+        zoom = self.transform().m11()
+
+        # below one second, the candidate intervals are a number of frames
+        for frames in (1, 2, 5, 10, 15):
+            if frames < fps and frames * zoom >= self.min_label_spacing:
+                return frames, frames if frames <= 5 else 5
+        for seconds in self.tick_intervals:
+            if seconds * fps * zoom >= self.min_label_spacing:
+                return seconds * fps, 5 if seconds % 5 == 0 else seconds
+        return self.tick_intervals[-1] * fps, 4
+
+    def label(self, frame, show_frames):
+        """ Returns the cached, pre-laid-out label of the given frame """
+        key = (frame, show_frames)
+        static_text = self.label_cache.get(key)
+        if static_text is None:
+            if len(self.label_cache) >= self.max_cached_labels:
+                self.label_cache.clear()
+            fps = self.tracks_view.track_fps
+            seconds, frames = divmod(int(frame), fps)
+            minutes, seconds = divmod(seconds, 60)
+            hours, minutes = divmod(minutes, 60)
+            text = f"{hours}:{minutes:02d}:{seconds:02d}"
+            if show_frames:
+                text += f".{frames:02d}"
+            static_text = QStaticText(text)
+            static_text.prepare(font=self.label_font)
+            self.label_cache[key] = static_text
+        return static_text
+
+    def drawForeground(self, painter, rect):
+        width = self.viewport().width()
+        zoom = self.transform().m11()
+        # first visible frame
+        left_frame = self.mapToScene(0, 0).x()
+        right_frame = left_frame + width / zoom
+
+        interval, subdivisions = self.tickInterval()
+        minor = interval / subdivisions
+        show_frames = interval < self.tracks_view.track_fps
+
+        painter.save()
+        # draws in viewport coordinates, so the ruler isn't scaled by the zoom
+        painter.resetTransform()
+        painter.fillRect(0, 0, width, self.ruler_height, self.background_brush)
+        painter.setPen(self.tick_pen)
+        painter.setFont(self.label_font)
+
+        tick = int(max(left_frame, 0) // minor)
+        frame = tick * minor
+        while frame <= right_frame:
+            x = (frame - left_frame) * zoom
+            if tick % subdivisions == 0:
+                painter.drawLine(QPointF(x, 0), QPointF(x, self.ruler_height))
+                painter.drawStaticText(QPointF(x + 3, 2), self.label(round(frame), show_frames))
+            else:
+                painter.drawLine(QPointF(x, self.ruler_height * 2 / 3), QPointF(x, self.ruler_height))
+            tick += 1
+            frame = tick * minor
+
+        painter.restore()
+
 
 """
 Tracks View widget
 This widget displays the video and audio tracks, and the cursor for the user to click and select the current time
-It contains an array with the loaded video tracks, a variable which holds
+The clips of the timeline are TimelineClip objects, indexed by their frames. Only the clips near the visible
+part of the timeline are shown by graphics items (VideoTrack), and when there are too many of them in view,
+they are drawn merged into bars instead (level of detail), so the timeline stays responsive with any number of clips
 """
 class TracksView(QWidget):
+    # above this many clips around the view, the clips are drawn as bars instead of items
+    max_items = 400
 
     def __init__(self, parent=None):
         super().__init__(parent)  # Initialize the superclass
@@ -285,8 +572,33 @@ class TracksView(QWidget):
         self.track_fps = 30
         # List to store video track items
         self.video_tracks = []
-
-        self.track_offset = 10
+        # Index of the clips placed on the timeline, by their [start, end) frames, over every slot
+        self.clip_index = IntervalTree()
+        # Filmstrip thumbnails of the tracks, generated in the background
+        self.thumbnails = ThumbnailCache(self.track_fps)
+        # Scene cuts of the sources of the tracks, detected in the background
+        self.scene_cuts = SceneCutManager()
+        # Last clip clicked by the user
+        self.selected_clip = None
+        # Autosave of the project file of the timeline, None until the timeline is saved or opened
+        self.project = None
+        self.next_clip_id = 0
+        # Undo/redo history of the clips, and the clips by clip id
+        self.history = TimelineHistory()
+        self.clips_by_id = {}
+        # True while an undo or redo is applied to the clips, which must not be recorded as a new edit
+        self.restoring = False
+
+        # items of the clips near the view, and the unused items, which are bound to the next clips to show
+        self.items = {}
+        self.free_items = []
+        # True when the clips in view are drawn as bars instead of items
+        self.lod = False
+        self.refresh_pending = False
+        self.slots_manager = None
+
+        # the slots start below the time ruler
+        self.track_offset = TimelineView.ruler_height + 10
         self.track_height = 50
 
         # Initialize a multiplier for the scene size relative to the view
@@ -304,10 +616,15 @@ class TracksView(QWidget):
 
         # Create the scene and the view
         self.scene = QGraphicsScene()
-        self.view = QGraphicsView(self.scene)
+        self.view = TimelineView(self.scene, self)
 
         self.scene.setSceneRect(0, 0, self.scene_width, self.scene_height)
 
+        # repaints the tracks when new thumbnails are available
+        self.thumbnails.thumbnailsReady.connect(lambda source_path: self.view.viewport().update())
+        # shows the markers of the cuts when they are detected
+        self.scene_cuts.cutsReady.connect(self.updateCuts)
+
         # Calculate minimum zoom level
         self.min_zoom = 1 / (self.max_frames / self.view.width())
         # Set the anchor point for zoom transformations
@@ -324,47 +641,12 @@ class TracksView(QWidget):
     def create_slot_manager(self):
         self.slots_manager = VideoTrackSlotManager(self.track_offset, self.track_height, self.max_frames, self)
 
-    def drawTimeMarker(self):
-        # Clear existing time marker items
-        for item in self.scene.items():
-            if isinstance(item, QGraphicsTextItem):
-                self.scene.removeItem(item)
-
-        # Determine granularity based on zoom level
-        if self.zoom < 0.5:
-            interval, time_format = 60, "%H:%M"
-        elif 0.5 <= self.zoom < 1:
-            interval, time_format = 10, "%H:%M"
-        elif 1 <= self.zoom < 2:
-            interval, time_format = 1, "%M:%S"
-        else:
-            interval, time_format = 0.1, "%M:%S"
-
-        # Calculate pixel interval based on zoom level
-        pixel_interval = interval * 100 * self.zoom
-
-        # Get visible area to determine start and end
-        visible_rect = self.view.mapToScene(self.view.rect()).boundingRect()
-        start_x = visible_rect.left()
-        end_x = visible_rect.right()
-
-        # Draw ticks and labels
-        x = (start_x // pixel_interval + 1) * pixel_interval
-        while x < end_x:
-            time_val = x / (100 * self.zoom)
-            time_str = time.strftime(time_format, time.gmtime(time_val))
-            text_item = self.scene.addText(time_str, QFont("Arial", 10))
-            text_item.setPos(x, 10)
-            text_item.setDefaultTextColor(Qt.red)
-            x += pixel_interval
-        
     def resizeEvent(self, event):
         """Handle resize events for the widget."""
 
         # recalculate the minimum zoom, because it depends on the width of the view
         self.min_zoom = 1 / (self.max_frames / self.view.width())
         super().resizeEvent(event)  # call the base class method
-        #self.drawTimeMarker()
 
     def wheelEvent(self, event):
         """Handle mouse wheel events for zooming."""
@@ -383,25 +665,340 @@ class TracksView(QWidget):
             if topLeft.x() < 0:
                 shift_x = -topLeft.x()
                 self.view.translate(shift_x, 0)
-        #self.drawTimeMarker()
 
     """
     This function adds a video track to the Tracks section. The size of the track depends on length of the video track.
     """
-    def addTrack(self, seconds, slot=0):
-        """Add a new track to the scene."""
+    def addTrack(self, seconds, slot=0, source_path=None):
+        """Add a new clip to the timeline."""
         number_of_frames = self.track_fps * seconds # sets the number of frames that the track has
 
-        vt = self.slots_manager.addTrack(seconds, slot)
+        clip = self.slots_manager.addTrack(seconds, slot, source_path)
+        self.recordClip(clip)
+        self.commitEdit("add")
 
         # we multiply by 1.25 so that a bit more frames are shown
         new_zoom = 1 / (number_of_frames * 1.25 / self.view.width())
         self.setZoom(new_zoom)
         self.applyZoom()
 
-        # returns the created video track
-        return vt
-        
+        # returns the created clip
+        return clip
+
+    def moveClip(self, clip, start, slot=None):
+        """Move a clip to the given start frame (and slot), in the clip index and in the snapping index of its slot."""
+        slots = self.slots_manager.slots
+        if slot is not None and slot != clip.slot:
+            # the clip was moved to another slot
+            slots[clip.slot].removeTrack(clip)
+            slots[slot].tracks.add(clip)
+            clip.slot = slot
+        clip.start = start
+
+        slots[clip.slot].updateEdges(clip, start, clip.end)
+        self.clip_index.move(clip, start, clip.end, clip.slot)
+        self.clipsChanged()
+
+        item = self.items.get(clip)
+        if item is None:
+            # the clip may have been moved into view
+            self.scheduleRefresh()
+        elif not item.is_clicked:
+            item.setPos(start, slots[clip.slot].y)
+            item.new_x = item.x()
+            item.new_y = item.y()
+
+    def removeTrack(self, clip):
+        """Remove a clip from the timeline."""
+        if isinstance(clip.snapped, TimelineClip):
+            clip.snapped.unsnap()
+        if self.selected_clip is clip:
+            self.selected_clip = None
+        self.recordRemoval(clip)
+        del self.clips_by_id[clip.clip_id]
+        self.slots_manager.slots[clip.slot].removeTrack(clip)
+        self.clip_index.remove(clip)
+        if clip in self.items:
+            self.releaseItem(clip)
+        self.clipsChanged()
+
+    def clearClips(self):
+        """
+        Remove every clip from the timeline at once, without recording the removals (for replacing the whole
+        timeline, whose history starts over)
+        """
+        for clip in list(self.items):
+            self.releaseItem(clip)
+        for slot in self.slots_manager.slots:
+            slot.clear()
+        self.clip_index = IntervalTree()
+        self.clips_by_id = {}
+        self.selected_clip = None
+        self.clipsChanged()
+
+    def clipsChanged(self):
+        # the level of detail bars are merged again when they are next drawn
+        self.view.lod_bars.clear()
+        if self.lod:
+            self.view.viewport().update()
+
+    def scheduleRefresh(self):
+        """Update the items of the clips in view once the current event is handled, for any number of edits."""
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            QTimer.singleShot(0, self.refreshItems)
+
+    def refreshItems(self):
+        """
+        Give an item to every clip near the visible part of the timeline (half a view on each side, so that
+        scrolling a little doesn't change them), and take it from the others. When there are more than
+        max_items such clips, none has an item, and the view draws them as bars
+        """
+        self.refresh_pending = False
+        if self.slots_manager is None:
+            return
+        left = self.view.mapToScene(0, 0).x()
+        right = self.view.mapToScene(self.view.viewport().width(), 0).x()
+        margin = (right - left) / 2
+        entries = self.clip_index.overlapping(left - margin, right + margin, self.max_items + 1)
+
+        lod = len(entries) > self.max_items
+        visible = set() if lod else {clip for _, _, _, clip in entries}
+        for clip, item in list(self.items.items()):
+            # the item being dragged is kept until it's dropped
+            if clip not in visible and not item.is_clicked:
+                self.releaseItem(clip)
+        for clip in visible:
+            if clip not in self.items:
+                self.clipItem(clip)
+
+        if lod != self.lod:
+            self.lod = lod
+            self.view.viewport().update()
+
+    def clipItem(self, clip):
+        """Return the item of a clip, binding an item to it if it has none."""
+        item = self.items.get(clip)
+        if item is None:
+            if self.free_items:
+                item = self.free_items.pop()
+                item.bind(clip)
+                item.show()
+            else:
+                item = VideoTrack(self)
+                item.bind(clip)
+                self.scene.addItem(item)
+            self.items[clip] = item
+        return item
+
+    def releaseItem(self, clip):
+        """Take the item from a clip, keeping it hidden for the next clip to show."""
+        item = self.items.pop(clip)
+        item.hide()
+        item.clip = None
+        self.free_items.append(item)
+
+    def trackCuts(self, clip):
+        """Return the scene cuts of the source of a clip that fall inside it, in frames from its start."""
+        cuts = self.scene_cuts.cuts(clip.source_path) if clip.source_path else None
+        if cuts is None:
+            return []
+        frames = (round(frame * self.track_fps / cuts.fps) - clip.source_start for frame in cuts.frames)
+        return [frame for frame in frames if 0 < frame < clip.nframes]
+
+    def loadCuts(self, clip):
+        """Set the scene cuts of a clip, requesting their detection if they are not available yet."""
+        if clip.source_path:
+            self.scene_cuts.request(clip.source_path)
+            clip.cuts = self.trackCuts(clip)
+
+    def updateCuts(self, source_path):
+        """Update the cut markers of the clips of a source whose cuts were just detected."""
+        for _, _, _, clip in self.clip_index.entries():
+            if clip.source_path == source_path:
+                clip.cuts = self.trackCuts(clip)
+                if clip in self.items:
+                    self.items[clip].update()
+
+    def splitAtCuts(self, clip=None):
+        """Split a clip at its scene cuts. Without a clip, the selected clip is split, or every clip."""
+        clip = clip or self.selected_clip
+        clips = [clip] if clip else [other for _, _, _, other in self.clip_index.entries()]
+        for other in clips:
+            if other.cuts:
+                self.splitTrack(other, other.cuts)
+        self.commitEdit("split")
+
+    def splitTrack(self, clip, offsets):
+        """
+        Replace a clip with consecutive clips split at the given frames (from the start of the clip).
+        Return the new clips
+        """
+        bounds = [0] + sorted(offset for offset in offsets if 0 < offset < clip.nframes) + [clip.nframes]
+        self.removeTrack(clip)
+
+        parts = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            part = self.slots_manager.addTrack((b - a) / self.track_fps, clip.slot, clip.source_path,
+                                               clip.source_start + a, clip.start + a)
+            self.recordClip(part)
+            parts.append(part)
+        return parts
+
+    def findSnap(self, clip, start, end, threshold):
+        """
+        Find where a clip spanning the frames [start, end) should snap to.
+        The start of the clip snaps to the end of other clips, and its end to the start of other clips.
+        Each lookup is a binary search on the sorted edges of each slot.
+        Returns (new start of the clip, frame snapped to, clip snapped to) of the nearest edge
+        within threshold, or None
+        """
+        candidates = []
+        for slot in self.slots_manager.slots:
+            candidates.append((slot.ends.nearest(start, threshold, exclude=clip), 0))
+            candidates.append((slot.starts.nearest(end, threshold, exclude=clip), clip.nframes))
+
+        best = None
+        best_distance = threshold
+        for candidate, offset in candidates:
+            if candidate is None:
+                continue
+            frame, target = candidate
+            distance = abs(frame - offset - start)
+            if distance < best_distance:
+                best, best_distance = (frame - offset, frame, target), distance
+        return best
+
+    def exportClips(self):
+        """Return the clips placed on the timeline as ExportClip objects, sorted by start frame and slot."""
+        clips = [ExportClip(clip.source_path, start, end - start, slot, source_start=clip.source_start / self.track_fps)
+                 for start, end, slot, clip in self.clip_index.entries() if clip.source_path]
+        return sorted(clips, key=lambda clip: (clip.start_frame, clip.slot))
+
+    def newClipId(self):
+        """Return a new id for a clip."""
+        self.next_clip_id += 1
+        return self.next_clip_id - 1
+
+    def recordClip(self, clip):
+        """Save a clip that was added or edited to the undo history and to the project file, if any."""
+        if not self.restoring:
+            self.history.put(clip.clip_id, clip.state())
+        if self.project is not None and clip.source_path:
+            self.project.put(clip.clip_id, clip.source_path, clip.slot, clip.start, clip.nframes, clip.source_start)
+
+    def recordRemoval(self, clip):
+        """Save the removal of a clip to the undo history and to the project file, if any."""
+        if not self.restoring:
+            self.history.remove(clip.clip_id)
+        if self.project is not None:
+            self.project.remove(clip.clip_id)
+
+    def recordSlots(self):
+        if self.project is not None:
+            self.project.setSlots(self.slots_manager.current_slots)
+
+    def commitEdit(self, label):
+        """Make the changes recorded since the last commit one step of the undo history."""
+        self.history.commit(label)
+
+    def setClipId(self, clip, clip_id):
+        """Give a clip the id of an existing clip (of a project file, or of the undo history)."""
+        del self.clips_by_id[clip.clip_id]
+        clip.clip_id = clip_id
+        self.clips_by_id[clip_id] = clip
+
+    def undo(self):
+        """Undo the last edit of the clips."""
+        self.restoreClips(self.history.undo())
+
+    def redo(self):
+        """Redo the last undone edit of the clips."""
+        self.restoreClips(self.history.redo())
+
+    def restoreClips(self, clips):
+        """
+        Bring the clips with the given clip ids to the given ClipState, removing the ones whose state is
+        None and creating the missing ones. The changes are saved to the project file, but not to the history
+        """
+        if not clips:
+            return
+        self.restoring = True
+        try:
+            for clip_id, state in clips.items():
+                clip = self.clips_by_id.get(clip_id)
+                if state is None:
+                    if clip is not None:
+                        self.removeTrack(clip)
+                    continue
+                while self.slots_manager.current_slots <= state.slot:
+                    self.slots_manager.addSlot()
+                if clip is None:
+                    clip = self.slots_manager.addTrack(state.length / self.track_fps, state.slot, state.source_path,
+                                                       state.source_start, state.start)
+                    self.setClipId(clip, clip_id)
+                else:
+                    if isinstance(clip.snapped, TimelineClip):
+                        clip.snapped.unsnap()
+                    self.moveClip(clip, state.start, state.slot)
+                clip.unsnap()
+                self.recordClip(clip)
+        finally:
+            self.restoring = False
+
+    def projectData(self):
+        """Return the clips of the timeline as a ProjectData."""
+        data = ProjectData(self.track_fps, self.slots_manager.current_slots)
+        for start, end, slot, clip in self.clip_index.entries():
+            if clip.source_path:
+                data.put(clip.clip_id, data.source_id(clip.source_path), slot, start, end - start, clip.source_start)
+        return data
+
+    def saveProject(self, path):
+        """Save the timeline to a project file. The edits made after are saved to it automatically."""
+        self.closeProject()
+        self.project = ProjectAutosave(path, self.projectData())
+
+    def openProject(self, path):
+        """
+        Replace the timeline with the project in the given file, whose edits are then saved to it automatically.
+        Raises ProjectFileError if the file can't be read
+        """
+        data = load_project(path)
+        self.closeProject()
+        self.clearClips()
+        while self.slots_manager.current_slots < data.slot_count:
+            self.slots_manager.addSlot()
+        # the new clips get ids above the ones of the project, so they are free to take them
+        self.next_clip_id = max(self.next_clip_id, max(data.ids, default=-1) + 1)
+
+        # frames of the project are converted if it was saved at another fps
+        scale = self.track_fps / data.fps
+        for clip_id, source_path, slot, start, length, source_start in data.clips():
+            clip = self.slots_manager.addTrack(round(length * scale) / self.track_fps, slot, source_path,
+                                               round(source_start * scale), round(start * scale))
+            self.setClipId(clip, clip_id)
+
+        # the opened project is where the undo history starts
+        self.history.reset((clip.clip_id, clip.state()) for _, _, _, clip in self.clip_index.entries())
+        saved = self.projectData()
+        saved.generation = data.generation
+        self.project = ProjectAutosave(path, saved)
+
+    def closeProject(self):
+        """Write the pending edits of the project file, and stop saving the timeline to it."""
+        if self.project is not None:
+            self.project.close()
+            self.project = None
+
+    def clipsAt(self, frame):
+        """Return the (start, end, slot, clip) of every clip active at the given frame."""
+        return self.clip_index.at(frame)
+
+    def clipsBetween(self, start, end):
+        """Return the (start, end, slot, clip) of every clip overlapping the frames [start, end)."""
+        return self.clip_index.overlapping(start, end)
+
     def setZoom(self, new_zoom):
         """Set the zoom level, constrained by a minimum value."""
         if new_zoom > self.min_zoom:
@@ -411,15 +1008,18 @@ class TracksView(QWidget):
         self.applyZoom()
 
     def applyZoom(self):
+        # the queued thumbnails were requested for the previous zoom level
+        self.thumbnails.cancelPending()
         self.view.resetTransform()
         self.view.scale(self.zoom, 1)
+        self.refreshItems()
 
 
 class VideoTrackSlotManager:
     """
     Video Track Slot Manager
     Manages the Slots of the TracksView class
-    Provides functions for adding and removing video tracks
+    Provides functions for adding and removing clips
     y_offset -> initial offset of the first slot
     y_size -> y height of each slot
     scene_width -> length of the scene (important to calculate size of each slot rectangle)
@@ -467,22 +1067,35 @@ class VideoTrackSlotManager:
         # Increments number of slots
         self.current_slots += 1
 
-        # Adds the slot to the scene
-        self.tracks_view.scene.addItem(slot)
+        # Draws the new slot
+        self.tracks_view.clipsChanged()
+        self.tracks_view.view.viewport().update()
         print("added slot")
+        self.tracks_view.recordSlots()
         return slot
     
-    def addTrack(self, seconds, slot=0):
+    def addTrack(self, seconds, slot=0, source_path=None, source_start=0, start=0):
         """
-        Adds a Video Track to given slot
-        seconds -> length of the track in seconds
-        slot -> slot to add the track
+        Adds a clip to given slot
+        seconds -> length of the clip in seconds
+        slot -> slot to add the clip
+        source_path -> path of the video of the clip
+        source_start -> frame of the source where the clip starts
+        start -> frame of the timeline where the clip starts
         """
-        vt = self.slots[slot].addTrack(seconds)
-        self.tracks_view.scene.addItem(vt)
+        clip = self.slots[slot].addTrack(seconds, source_path, source_start, start)
+        self.tracks_view.clips_by_id[clip.clip_id] = clip
+        self.tracks_view.moveClip(clip, start)
+        self.tracks_view.loadCuts(clip)
+
+        # returns the created clip
+        return clip
 
-        # returns the created video track
-        return vt
+    def removeTrack(self, clip):
+        """
+        Removes a clip from the timeline
+        """
+        self.tracks_view.removeTrack(clip)
 
     def removeSlot(self):
 
@@ -492,5 +1105,6 @@ class VideoTrackSlotManager:
         # Pops from the list of slots the last slot
         slot = self.slots.pop()
 
-        # Removes the slot from the scene
-        self.tracks_view.scene.removeItem(slot)
+        # Removes the slot from the view
+        self.tracks_view.clipsChanged()
+        self.tracks_view.view.viewport().update()
@@ -1,46 +1,88 @@
 from PyQt5.QtWidgets import QLabel
-from PyQt5.QtCore import pyqtSlot, Qt
+from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt
 from PyQt5 import QtGui
-from PyQt5.QtGui import QPixmap
-import cv2
-import numpy as np
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QFont
+from backend.profiler import shared_profiler
 
 class VideoLabelWidget(QLabel):
+    """
+    Displays the frames of the video player.
+    Frames arrive already resized to the label's size and in display channel order (see FrameConverter),
+    so updating the label only wraps the frame's memory in a QImage, without copying or scaling it.
+    """
+    # emitted when the label is resized, with the new width and height
+    target_size_changed = pyqtSignal(int, int)
+    # emitted with each frame once it was copied into the label, so its buffer can be reused
+    frame_shown = pyqtSignal(object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
-        self.last_image = np.array(0)
+        self.video_width = 0
+        self.video_height = 0
         self.setScaledContents(False)
         self.setAlignment(Qt.AlignCenter)
         self.setStyleSheet("background-color: black;")
 
-    @pyqtSlot(np.ndarray)
+        # BGR888 lets Qt read OpenCV's channel order directly (Qt >= 5.14)
+        if hasattr(QtGui.QImage, "Format_BGR888"):
+            self.image_format = QtGui.QImage.Format_BGR888
+        else:
+            self.image_format = QtGui.QImage.Format_RGB888
+
+        self.profiler = shared_profiler()
+        self.profiler.name_thread("gui")
+        # function returning the lines of the performance overlay, or None to hide it
+        self.overlay = None
+        self.overlay_font = QFont("monospace", 9)
+        self.overlay_font.setStyleHint(QFont.Monospace)
+
+    def set_overlay(self, overlay):
+        """Shows the lines returned by overlay() over the video on each repaint, or hides them if overlay is None"""
+        self.overlay = overlay
+        self.update()
+
+    @pyqtSlot(object)
     def update_image(self, cv_img):
         """Updates the video_label with a new opencv image"""
-        self.last_image = cv_img
-
+        # time the frame spent queued between the video thread and the gui thread
+        self.profiler.since_stamp("signal_latency", "signal", id(cv_img))
+        start = self.profiler.begin()
         h, w, ch = cv_img.shape
-        aspect_ratio = w/h
 
-        new_w = self.video_width
-        new_h = int(new_w / aspect_ratio)
+        # wraps the frame's memory, no conversion. QPixmap.fromImage makes the only copy
+        qt_img = QtGui.QImage(cv_img.data, w, h, cv_img.strides[0], self.image_format)
+        pixmap = QPixmap.fromImage(qt_img)
+
+        if self.video_width and self.video_height and (w > self.video_width or h > self.video_height):
+            # frame converted before the last resize, it is still scaled to fit
+            pixmap = pixmap.scaled(self.video_width, self.video_height, Qt.KeepAspectRatio)
+
+        self.setPixmap(pixmap)
+        self.profiler.end("update_image", start)
+        self.frame_shown.emit(cv_img)
 
-        if new_h > self.video_height:
-            new_h = self.video_height
-            new_w = int(new_h * aspect_ratio)
+    def paintEvent(self, event):
+        start = self.profiler.begin()
+        super().paintEvent(event)
+        self.profiler.end("paint", start)
 
-        resized_img = cv2.resize(cv_img, (new_w, new_h))
-        rgb_image = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
+        if self.overlay is not None:
+            painter = QPainter(self)
+            painter.setFont(self.overlay_font)
+            lines = self.overlay()
+            height = painter.fontMetrics().height()
+            width = max((painter.fontMetrics().horizontalAdvance(line) for line in lines), default=0)
+            painter.fillRect(4, 4, width + 12, height * len(lines) + 8, QColor(0, 0, 0, 160))
+            painter.setPen(QColor("white"))
+            for i, line in enumerate(lines):
+                painter.drawText(10, 8 + height * (i + 1) - painter.fontMetrics().descent(), line)
+            painter.end()
 
-        convert_to_Qt_format = QtGui.QImage(rgb_image.data, new_w, new_h, ch * new_w, QtGui.QImage.Format_RGB888)
-        p = convert_to_Qt_format.scaled(new_w, new_h, Qt.KeepAspectRatio)
-        qt_img = QPixmap.fromImage(p)
-        self.setPixmap(qt_img)
-    
     def resizeEvent(self, event):
         self.video_width = event.size().width()
         self.video_height = event.size().height()
-        if self.last_image.any() > 0: # self.last_image is defined. change this
-            self.update_image(self.last_image)
+        # the video thread converts the next frames (and the current one, if paused) to the new size
+        self.target_size_changed.emit(self.video_width, self.video_height)
 
         return super().resizeEvent(event)
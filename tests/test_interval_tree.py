@@ -0,0 +1,144 @@
+import random
+from backend.video_container import IntervalTree
+
+class Oracle:
+    """ The same index as a plain list, scanned linearly """
+    def __init__(self):
+        # clip -> (start, end, slot, seq)
+        self.clips = {}
+        self.seq = 0
+
+    def insert(self, start, end, slot, clip):
+        self.clips[clip] = (start, end, slot, self.seq)
+        self.seq += 1
+
+    def move(self, clip, start, end, slot):
+        old = self.clips.get(clip)
+        if old and old[0] == start and old[1] == end:
+            self.clips[clip] = (start, end, slot, old[3])
+        else:
+            self.insert(start, end, slot, clip)
+
+    def remove(self, clip):
+        self.clips.pop(clip, None)
+
+    def overlapping(self, a, b, limit=None):
+        result = sorted((start, end, seq, slot, clip) for clip, (start, end, slot, seq) in self.clips.items()
+                        if start < b and end > a)
+        result = [(start, end, slot, clip) for start, end, _, slot, clip in result]
+        return result if limit is None else result[:limit]
+
+def check_invariants(tree, node):
+    """ Returns the height of the subtree, checking its AVL balance, max_end and order """
+    if node is None:
+        return 0
+    left = check_invariants(tree, node.left)
+    right = check_invariants(tree, node.right)
+    assert abs(left - right) <= 1
+    assert node.height == 1 + max(left, right)
+    assert node.max_end == max(node.end, tree.get_max_end(node.left), tree.get_max_end(node.right))
+    assert node.left is None or node.left.key < node.key
+    assert node.right is None or node.right.key > node.key
+    return node.height
+
+def random_interval(rng, length):
+    start = rng.randrange(length)
+    return start, start + rng.randint(1, 300)
+
+def test_random_operations_match_oracle():
+    rng = random.Random(1234)
+    tree = IntervalTree()
+    oracle = Oracle()
+    length = 5000
+    next_clip = 0
+
+    for step in range(5000):
+        op = rng.random()
+        clips = list(oracle.clips)
+        if op < 0.35 or not clips:
+            start, end = random_interval(rng, length)
+            slot = rng.randrange(4)
+            tree.insert(start, end, slot, next_clip)
+            oracle.insert(start, end, slot, next_clip)
+            next_clip += 1
+        elif op < 0.55:
+            clip = rng.choice(clips)
+            if rng.random() < 0.3:
+                # same frames, only the slot changes
+                start, end = oracle.clips[clip][:2]
+            else:
+                start, end = random_interval(rng, length)
+            slot = rng.randrange(4)
+            tree.move(clip, start, end, slot)
+            oracle.move(clip, start, end, slot)
+        elif op < 0.7:
+            clip = rng.choice(clips + [-1])
+            tree.remove(clip)
+            oracle.remove(clip)
+        elif op < 0.85:
+            frame = rng.randrange(-10, length + 310)
+            assert tree.at(frame) == oracle.overlapping(frame, frame + 1)
+        else:
+            a = rng.randrange(-10, length + 310)
+            b = a + rng.randint(1, 800)
+            limit = rng.choice([None, 1, 3, 10])
+            assert tree.overlapping(a, b, limit) == oracle.overlapping(a, b, limit)
+
+        assert len(tree) == len(oracle.clips)
+        if step % 250 == 0:
+            check_invariants(tree, tree.root)
+
+    check_invariants(tree, tree.root)
+    assert tree.entries() == oracle.overlapping(float("-inf"), float("inf"))
+
+def test_bulk_load_matches_insertions():
+    rng = random.Random(42)
+    entries = []
+    for clip in range(2000):
+        start, end = random_interval(rng, 10000)
+        entries.append((start, end, rng.randrange(4), clip))
+
+    loaded = IntervalTree()
+    loaded.insert(0, 10, 0, "replaced")
+    loaded.bulk_load(entries)
+    oracle = Oracle()
+    for entry in entries:
+        oracle.insert(*entry)
+
+    assert "replaced" not in loaded
+    assert len(loaded) == len(entries)
+    check_invariants(loaded, loaded.root)
+    for _ in range(500):
+        a = rng.randrange(10300)
+        b = a + rng.randint(1, 500)
+        assert loaded.overlapping(a, b) == oracle.overlapping(a, b)
+
+    # the loaded tree keeps working as a regular one
+    for clip in range(0, 2000, 3):
+        loaded.remove(clip)
+        oracle.remove(clip)
+    loaded.move(1, 50, 60, 2)
+    oracle.move(1, 50, 60, 2)
+    check_invariants(loaded, loaded.root)
+    assert loaded.entries() == oracle.overlapping(float("-inf"), float("inf"))
+
+def test_bulk_load_empty():
+    tree = IntervalTree()
+    tree.bulk_load([])
+    assert len(tree) == 0
+    assert tree.at(0) == []
+    assert tree.overlapping(0, 100, limit=5) == []
+
+def test_overlapping_limit_returns_first_clips_by_start():
+    tree = IntervalTree()
+    for clip in range(10):
+        tree.insert(clip * 10, clip * 10 + 100, 0, clip)
+
+    assert [clip for _, _, _, clip in tree.overlapping(0, 1000, limit=3)] == [0, 1, 2]
+    assert [clip for _, _, _, clip in tree.overlapping(45, 1000, limit=2)] == [0, 1]
+    assert tree.overlapping(0, 1000, limit=0) == []
+    assert len(tree.overlapping(0, 1000, limit=100)) == 10
+    # intervals are half-open: a clip ending at a frame isn't active at that frame
+    assert tree.at(100) == [(10, 110, 0, 1), (20, 120, 0, 2), (30, 130, 0, 3), (40, 140, 0, 4),
+                            (50, 150, 0, 5), (60, 160, 0, 6), (70, 170, 0, 7), (80, 180, 0, 8),
+                            (90, 190, 0, 9)]
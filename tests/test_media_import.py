@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import cv2
+from PyQt5.QtCore import QCoreApplication
+from backend.media_cache import MediaCache
+from backend.media_import import MediaImporter
+from backend.video_container import VideoContainer
+
+def write_video(path, frames=10):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (64, 48))
+    for i in range(frames):
+        writer.write(np.full((48, 64, 3), i * 20, np.uint8))
+    writer.release()
+    return path
+
+def test_second_import_replaces_the_first_without_finishing(tmp_path):
+    app = QCoreApplication.instance() or QCoreApplication([])
+    first = [write_video(str(tmp_path / f"first_{i}.avi")) for i in range(3)]
+    second = [write_video(str(tmp_path / f"second_{i}.avi")) for i in range(2)] + [str(tmp_path / "missing.avi")]
+
+    importer = MediaImporter(VideoContainer(), cache=MediaCache(str(tmp_path / "media.json")))
+    finished, imported, failed, progress = [], [], [], []
+    importer.finished.connect(lambda: finished.append(True))
+    importer.imported.connect(lambda id, length, path: imported.append(path))
+    importer.failed.connect(failed.append)
+    importer.progress.connect(lambda done, total: progress.append((done, total)))
+
+    importer.importVideos(first)
+    importer.importVideos(second)
+    # the first import was replaced, not finished: the progress display stays up for the second one
+    assert finished == []
+    assert importer.isRunning()
+
+    importer.pool.waitForDone()
+    app.processEvents()
+
+    assert finished == [True]
+    assert not importer.isRunning()
+    assert sorted(imported) == sorted(second[:2])
+    assert failed == [second[2]]
+    assert progress[-1] == (3, 3)
+    assert os.path.exists(tmp_path / "media.json")
+
+def test_cancel_finishes_the_import(tmp_path):
+    app = QCoreApplication.instance() or QCoreApplication([])
+    videos = [write_video(str(tmp_path / f"video_{i}.avi")) for i in range(2)]
+    importer = MediaImporter(VideoContainer(), cache=MediaCache(str(tmp_path / "media.json")))
+    finished, imported = [], []
+    importer.finished.connect(lambda: finished.append(True))
+    importer.imported.connect(lambda id, length, path: imported.append(path))
+
+    importer.importVideos(videos)
+    importer.cancel()
+    importer.pool.waitForDone()
+    app.processEvents()
+
+    assert finished == [True]
+    assert imported == []
+    assert not importer.isRunning()